@@ -0,0 +1,592 @@
+import argparse
+import json
+import os
+import re
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timezone
+from urllib.request import urlopen
+
+import main as miy
+
+# Anvil's first default account, which receives the minted tokens
+DEFAULT_TO_ADDRESS = '0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266'
+# Answers every confirmation prompt of main.py with yes
+PROMPT_ANSWERS = "y\n" * 20
+# Result fields where a larger value is an improvement; for every other number smaller is better
+HIGHER_IS_BETTER = ('per_second', 'speedup', 'uploaded')
+
+def generate_collection(directory_path, count, file_size=1024, attribute_count=4, extension='png', uploaded=True):
+    # Synthetic collection in the layout process_files expects: <id>.<ext> next to <id>.json.
+    # With uploaded=False the metadata has no image URL, so a run uploads every media file.
+    os.makedirs(directory_path, exist_ok=True)
+    for token_id in range(1, count + 1):
+        with open(os.path.join(directory_path, f"{token_id}.{extension}"), 'wb') as media_file:
+            media_file.write(os.urandom(file_size))
+        metadata = {
+            "name": f"NFT {token_id}",
+            "description": "A synthetic benchmark asset.",
+            "image": f"https://arweave.net/{token_id:043d}" if uploaded else "None",
+            "attributes": [{"trait_type": f"Trait {i}", "value": f"Value {token_id % (i + 2)}"} for i in range(attribute_count)]
+        }
+        with open(os.path.join(directory_path, f"{token_id}.json"), 'w') as metadata_file:
+            json.dump(metadata, metadata_file, indent=4)
+
+def bench_scan(count, file_size, attribute_count):
+    with tempfile.TemporaryDirectory() as workdir:
+        images_directory = os.path.join(workdir, 'images')
+        index_path = os.path.join(workdir, miy.COLLECTION_INDEX_FILE)
+        generate_collection(images_directory, count, file_size, attribute_count)
+
+        # Cold: no index on disk, every metadata file is read and parsed
+        started = time.perf_counter()
+        cold_entries = miy.process_files(images_directory, index_path)
+        cold_seconds = time.perf_counter() - started
+
+        # Warm: nothing changed, metadata comes from the index
+        started = time.perf_counter()
+        warm_entries = miy.process_files(images_directory, index_path)
+        warm_seconds = time.perf_counter() - started
+
+        assert len(cold_entries) == len(warm_entries) == count
+
+    return {
+        "benchmark": "scan",
+        "count": count,
+        "cold_seconds": round(cold_seconds, 4),
+        "warm_seconds": round(warm_seconds, 4),
+        "speedup": round(cold_seconds / warm_seconds, 2) if warm_seconds else None,
+    }
+
+def bench_upload_memory(size_mb, gateway, heap_mb, buffered=False):
+    # One sparse file of size_mb goes through the generated upload script with the V8 heap
+    # capped at heap_mb. Needs a node at the gateway (arlocal) and a funded ARWEAVE_KEY in .env;
+    # run it from the project root so node_modules resolve.
+    size = size_mb * 1024 * 1024
+    if buffered:
+        # Force the old read-everything path for comparison
+        miy.STREAM_UPLOAD_THRESHOLD = size + 1
+    with tempfile.TemporaryDirectory() as workdir:
+        file_path = os.path.join(workdir, 'large.bin')
+        with open(file_path, 'wb') as large_file:
+            large_file.truncate(size)
+        miy.create_script_arweave([(file_path, 'application/octet-stream')], gateway=gateway)
+
+        started = time.perf_counter()
+        completed = subprocess.run(['node', f'--max-old-space-size={heap_mb}', 'upload_to_arweave.js'], capture_output=True, text=True)
+        seconds = time.perf_counter() - started
+
+    uploaded = json.loads(completed.stdout.strip() or '[]') if completed.returncode == 0 else []
+    return {
+        "benchmark": "upload-memory",
+        "size_mb": size_mb,
+        "heap_mb": heap_mb,
+        "mode": "buffered" if buffered else "streamed",
+        "uploaded": len(uploaded) == 1,
+        "seconds": round(seconds, 2),
+        "mb_per_second": round(size_mb / seconds, 2) if seconds else None,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "stderr_tail": completed.stderr.strip().splitlines()[-3:],
+    }
+
+def get_price(gateway, byte_count):
+    # Winston fee the gateway quotes for one transaction of byte_count data bytes
+    with urlopen(f"{gateway}/price/{byte_count}") as response:
+        return int(response.read())
+
+def bench_upload_bundle(count, file_size, gateway, bundle_size_mb):
+    # Uploads the same small files once per file and once bundled, and compares wall time,
+    # number of Arweave transactions and the fee quoted for them
+    with tempfile.TemporaryDirectory() as workdir:
+        files = []
+        for index in range(count):
+            file_path = os.path.join(workdir, f"{index}.svg")
+            with open(file_path, 'wb') as small_file:
+                small_file.write(os.urandom(file_size))
+            files.append((file_path, 'image/svg+xml'))
+
+        results = {}
+        for mode, bundle_max_bytes in (("per_file", 0), ("bundled", bundle_size_mb * 1024 * 1024)):
+            miy.create_script_arweave(files, concurrency=4, gateway=gateway, bundle_max_bytes=bundle_max_bytes)
+            started = time.perf_counter()
+            completed = subprocess.run(['node', 'upload_to_arweave.js'], capture_output=True, text=True)
+            seconds = time.perf_counter() - started
+            uploaded = json.loads(completed.stdout.strip() or '[]') if completed.returncode == 0 else []
+
+            # The upload script logs the size of every bundle it posts
+            transaction_sizes = [int(size) for size in re.findall(r'^Bundle \S+: \d+ files, (\d+) bytes$', completed.stderr, re.MULTILINE)]
+            if not bundle_max_bytes:
+                transaction_sizes = [file_size] * len(uploaded)
+            results[mode] = {
+                "uploaded": len(uploaded),
+                "seconds": round(seconds, 2),
+                "files_per_second": round(len(uploaded) / seconds, 2) if seconds else None,
+                "transactions": len(transaction_sizes),
+                "winston": sum(get_price(gateway, size) for size in transaction_sizes),
+            }
+
+    return {"benchmark": "upload-bundle", "count": count, "file_size": file_size, **results}
+
+def bench_pipeline(count, upload_ms, mint_ms):
+    # Stand-in stages that only sleep, so the result shows the scheduling alone: staged wall
+    # time is the sum of both stages, overlapped should approach the slower one
+    def upload_files(files):
+        time.sleep(upload_ms * len(files) / 1000)
+        return {file_path: f"https://arweave.net/{index:043d}" for index, (file_path, _) in enumerate(files)}
+
+    def mint_tokens(group):
+        time.sleep(mint_ms * len(group) / 1000)
+
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # The pipeline journals to the working directory
+        os.chdir(workdir)
+        try:
+            images_directory = os.path.join(workdir, 'images')
+            generate_collection(images_directory, count, file_size=16)
+            entries = [entry._replace(skip_upload=False) for entry in miy.process_files(images_directory, os.path.join(workdir, miy.COLLECTION_INDEX_FILE))]
+
+            started = time.perf_counter()
+            uploaded_urls = upload_files([(os.path.join(images_directory, entry.file), entry.content_type) for entry in entries])
+            mint_tokens([{'tokenId': entry.token_id, 'metadata': entry.metadata} for entry in entries if os.path.join(images_directory, entry.file) in uploaded_urls])
+            staged_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            miy.run_overlapped_pipeline(entries, images_directory, upload_files, mint_tokens)
+            overlapped_seconds = time.perf_counter() - started
+        finally:
+            os.chdir(previous_directory)
+
+    return {
+        "benchmark": "pipeline",
+        "count": count,
+        "upload_seconds": round(upload_ms * count / 1000, 2),
+        "mint_seconds": round(mint_ms * count / 1000, 2),
+        "staged_seconds": round(staged_seconds, 2),
+        "overlapped_seconds": round(overlapped_seconds, 2),
+    }
+
+def bench_deploy(network, rpc_url, gas_price, engine_name):
+    # Time to deploy the generated token contract with an empty compile cache and again with a
+    # warm one. Needs truffle, the npm packages in ./node_modules, a funded MNEMONIC in .env and
+    # a local node at rpc_url. Runs in a scratch project so the real one is left untouched.
+    project_directory = os.getcwd()
+    previous_directory = os.getcwd()
+    timings = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            os.symlink(os.path.join(project_directory, 'node_modules'), 'node_modules')
+            shutil.copy(os.path.join(project_directory, '.env'), '.env')
+            os.makedirs('migrations')
+            miy.create_contract_token('Bench Token', 'BENCH', 'BenchToken', 500)
+            miy.create_script_deploy_contracts('BenchToken')
+            miy.overwrite_truffle_config({network: ({'gasPrice': gas_price}, rpc_url)})
+            engine = miy.start_python_engine(network, miy.get_fee_policy({'gas_price': gas_price}), rpc_url) if engine_name == 'python' else None
+
+            for label in ('cold', 'warm'):
+                started = time.perf_counter()
+                if engine:
+                    miy.deploy_with_python_engine(engine, 'BenchToken', [])
+                else:
+                    miy.deploy_contracts(network)
+                timings[f"{label}_seconds"] = round(time.perf_counter() - started, 2)
+        finally:
+            os.chdir(previous_directory)
+
+    return {"benchmark": "deploy", "engine": engine_name, **timings}
+
+def bench_mint_shards(network, rpc_url, gas_price, count, account_counts, window):
+    # Mints count fresh tokens once per entry in account_counts with the python engine, sharded
+    # over that many accounts of the .env mnemonic. Same requirements as bench_deploy.
+    project_directory = os.getcwd()
+    previous_directory = os.getcwd()
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            os.symlink(os.path.join(project_directory, 'node_modules'), 'node_modules')
+            shutil.copy(os.path.join(project_directory, '.env'), '.env')
+            os.makedirs('migrations')
+            miy.create_contract_token('Bench Token', 'BENCH', 'BenchToken', 500)
+            # truffle compile needs a config in the scratch project
+            miy.overwrite_truffle_config({network: ({'gasPrice': gas_price}, rpc_url)})
+            engine = miy.start_python_engine(network, miy.get_fee_policy({'gas_price': gas_price}), rpc_url)
+            miy.deploy_with_python_engine(engine, 'BenchToken', [])
+
+            next_token_id = 1
+            for accounts in account_counts:
+                token_data = [{'tokenId': token_id, 'metadata': {"name": f"NFT {token_id}"}} for token_id in range(next_token_id, next_token_id + count)]
+                next_token_id += count
+                started = time.perf_counter()
+                miy.mint_with_python_engine(engine, network, 'BenchToken', engine.address, token_data, 'single', pipeline_window=window, mint_accounts=accounts)
+                seconds = time.perf_counter() - started
+                runs.append({"accounts": accounts, "seconds": round(seconds, 2), "tokens_per_second": round(count / seconds, 2) if seconds else None})
+        finally:
+            os.chdir(previous_directory)
+
+    return {"benchmark": "mint-shards", "count": count, "window": window, "runs": runs}
+
+def bench_vouchers(count, workers, network, rpc_url, gas_price, redeem_count):
+    # Offline voucher signing throughput. With redeem_count set, a lazy contract is then deployed
+    # on a local chain with the python engine for every metadata storage layout, and that many
+    # vouchers are redeemed on each and checked with ownerOf and tokenURI. Redemption has the
+    # same requirements as bench_deploy.
+    token_data = [{'tokenId': token_id, 'metadata': {"name": f"NFT {token_id}", "image": f"https://arweave.net/{token_id:043d}"}} for token_id in range(1, count + 1)]
+    key = bytes(miy.Account.create().key)
+    domain = miy.get_voucher_domain('Bench Token', 31337, DEFAULT_TO_ADDRESS)
+    started = time.perf_counter()
+    vouchers = miy.sign_vouchers(key, domain, token_data, 0, 'onchain', workers)
+    seconds = time.perf_counter() - started
+    result = {"benchmark": "vouchers", "count": count, "workers": workers, "sign_seconds": round(seconds, 2),
+              "vouchers_per_second": round(count / seconds, 2) if seconds else None,
+              "file_bytes": len(json.dumps(vouchers, separators=(',', ':')).encode('utf-8'))}
+    if not redeem_count:
+        return result
+
+    project_directory = os.getcwd()
+    previous_directory = os.getcwd()
+    base_uri = 'https://arweave.net/manifest/'
+    redemptions = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            os.symlink(os.path.join(project_directory, 'node_modules'), 'node_modules')
+            shutil.copy(os.path.join(project_directory, '.env'), '.env')
+            os.makedirs('migrations')
+            miy.overwrite_truffle_config({network: ({'gasPrice': gas_price}, rpc_url)})
+            engine = miy.start_python_engine(network, miy.get_fee_policy({'gas_price': gas_price}), rpc_url)
+            # One lazy contract per storage layout, each compiled, deployed and redeemed against
+            for metadata_storage in miy.METADATA_STORAGE_MODES:
+                contract_name = f"BenchToken_{metadata_storage}"
+                miy.create_contract_token('Bench Token', 'BENCH', contract_name, 500, 'lazy', 0, metadata_storage)
+                miy.deploy_with_python_engine(engine, contract_name, [base_uri] if metadata_storage == 'manifest' else [])
+                with open(os.path.join('build', 'contracts', f'{contract_name}.json'), 'r') as artifact_file:
+                    artifact = json.load(artifact_file)
+                redemptions[metadata_storage] = redeem_vouchers(engine, artifact, token_data[:redeem_count + 1], metadata_storage, base_uri, workers)
+        finally:
+            os.chdir(previous_directory)
+    result["redemptions"] = redemptions
+    return result
+
+def redeem_vouchers(engine, artifact, token_data, metadata_storage, base_uri, workers):
+    # Redeems all but the last of token_data's vouchers and checks each token's owner and URI.
+    # The last voucher is sent with a token id it was not signed for, which must be rejected.
+    abi = artifact['abi']
+    contract_address = artifact['networks'][str(engine.network_id)]['address']
+    domain = miy.get_voucher_domain('Bench Token', engine.chain_id, contract_address)
+    vouchers = miy.sign_vouchers(bytes(engine.account.key), domain, token_data, 0, metadata_storage, workers)
+
+    forged = dict(vouchers.pop(), tokenId=token_data[-1]['tokenId'] + len(token_data))
+    try:
+        engine.rpc.call('eth_estimateGas', [{"from": engine.address, "to": contract_address, "data": miy.encode_function_call(abi, 'redeem', miy.get_redeem_call_args(forged, metadata_storage))}])
+        forged_rejected = False
+    except miy.RpcError:
+        forged_rejected = True
+
+    jobs = [{"tokenIds": [voucher['tokenId']], "to": contract_address, "data": miy.encode_function_call(abi, 'redeem', miy.get_redeem_call_args(voucher, metadata_storage))} for voucher in vouchers]
+    started = time.perf_counter()
+    summary = engine.send_jobs(jobs, window=16)
+    seconds = time.perf_counter() - started
+    calls = [('eth_call', [{"to": contract_address, "data": miy.encode_function_call(abi, name, [voucher['tokenId']])}, 'latest']) for voucher in vouchers for name in ('ownerOf', 'tokenURI')]
+    results = engine.rpc.batch(calls)
+    # Manifest vouchers carry no URI: the token resolves through the base URI
+    expected_uris = [f"{base_uri}{voucher['tokenId']}" if metadata_storage == 'manifest' else voucher['uri'] for voucher in vouchers]
+    verified = sum(1 for expected_uri, owner, uri in zip(expected_uris, results[::2], results[1::2])
+                   if miy.decode_function_result(abi, 'ownerOf', owner)[0].lower() == engine.address.lower()
+                   and miy.decode_function_result(abi, 'tokenURI', uri)[0] == expected_uri)
+    return {"redeemed": summary['mintedCount'], "verified": verified, "forged_rejected": forged_rejected, "redeem_seconds": round(seconds, 2),
+            "redeem_gas_per_token": round(summary['gasUsed'] / summary['mintedCount']) if summary['mintedCount'] else None}
+
+def write_png(path, width, height, seed):
+    # Gradient image compressed at zlib level 1 with a text chunk, like many exporters write
+    rows = b''.join(b'\x00' + bytes((x * seed + y) % 256 for x in range(width * 3)) for y in range(height))
+    def chunk(chunk_type, body):
+        return struct.pack('>I4s', len(body), chunk_type) + body + struct.pack('>I', zlib.crc32(chunk_type + body))
+    with open(path, 'wb') as png_file:
+        png_file.write(miy.PNG_SIGNATURE + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+                       + chunk(b'tEXt', b'Software\x00benchmark ' * 64) + chunk(b'IDAT', zlib.compress(rows, 1)) + chunk(b'IEND', b''))
+
+def bench_preprocess(count, size, worker_counts):
+    # Preprocesses count synthetic PNGs once per entry in worker_counts with an empty cache,
+    # then once more with a warm one
+    previous_directory = os.getcwd()
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            os.makedirs('images')
+            files = []
+            for token_id in range(1, count + 1):
+                path = os.path.join(workdir, 'images', f"{token_id}.png")
+                write_png(path, size, size, token_id)
+                files.append((path, 'image/png'))
+            input_bytes = sum(os.path.getsize(path) for path, _ in files)
+
+            for workers in worker_counts:
+                shutil.rmtree(miy.PREPROCESS_DIR, ignore_errors=True)
+                started = time.perf_counter()
+                miy.preprocess_media(files, workers)
+                seconds = time.perf_counter() - started
+                runs.append({"workers": workers, "seconds": round(seconds, 3), "mib_per_second": round(input_bytes / 1024 / 1024 / seconds, 2)})
+
+            started = time.perf_counter()
+            processed_files, _ = miy.preprocess_media(files, worker_counts[-1])
+            warm_seconds = time.perf_counter() - started
+            output_bytes = sum(os.path.getsize(path) for path, _ in processed_files)
+        finally:
+            os.chdir(previous_directory)
+
+    return {
+        "benchmark": "preprocess",
+        "count": count,
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "runs": runs,
+        "warm_seconds": round(warm_seconds, 3),
+    }
+
+def summarize_profile(profile_path):
+    # Total seconds and counters per span name across both sources of a --profile run, plus the
+    # wall-clock time from the first start to the last end, which differs when spans overlap
+    spans = {}
+    with open(profile_path, 'r') as profile_file:
+        for line in profile_file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            span = spans.setdefault(entry['span'], {"count": 0, "seconds": 0.0, "bytes": 0, "gasUsed": 0, "tokens": 0, "start": entry['start'], "end": 0.0, "networks": set()})
+            span['count'] += 1
+            span['seconds'] += entry['seconds']
+            span['start'] = min(span['start'], entry['start'])
+            span['end'] = max(span['end'], entry['start'] + entry['seconds'])
+            if entry.get('network'):
+                span['networks'].add(entry['network'])
+            for field in ('bytes', 'gasUsed', 'tokens'):
+                if isinstance(entry.get(field), (int, float)) and not entry.get('error'):
+                    span[field] += entry[field]
+    return spans
+
+def bench_e2e(count, file_size, attribute_count, network, rpc_url, gateway, gas_price, to_address, overrides):
+    # A whole run of main.py on a synthetic collection, answered non-interactively, against a
+    # local chain at rpc_url (Anvil, Ganache) and a local gateway (arlocal). Needs the npm
+    # packages in ./node_modules and a .env with a funded MNEMONIC and ARWEAVE_KEY. Stage
+    # timings come from the run's --profile spans.
+    project_directory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as workdir:
+        # main.py looks for images/ next to itself, so the scratch project gets its own copy
+        shutil.copy(os.path.join(project_directory, 'main.py'), workdir)
+        os.symlink(os.path.join(project_directory, 'node_modules'), os.path.join(workdir, 'node_modules'))
+        shutil.copy(os.path.join(project_directory, '.env'), os.path.join(workdir, '.env'))
+        generate_collection(os.path.join(workdir, 'images'), count, file_size, attribute_count, uploaded=False)
+        contract_parameters = {
+            "to_address": to_address,
+            "network_choice": network,
+            "token_name": "Bench Token",
+            "token_symbol": "BENCH",
+            "contract_name": "BenchToken",
+            "creator_earnings": 500,
+            "gas_price": str(gas_price),
+            "rpc_url": rpc_url,
+            "arweave_gateway": gateway,
+        }
+        contract_parameters.update(overrides)
+        with open(os.path.join(workdir, 'contract_parameters.json'), 'w') as config_file:
+            json.dump(contract_parameters, config_file, indent=4)
+
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, 'main.py', '--skip-env-check', '--profile'], cwd=workdir, input=PROMPT_ANSWERS, capture_output=True, text=True)
+        seconds = time.perf_counter() - started
+        profile_path = os.path.join(workdir, miy.PROFILE_FILE)
+        spans = summarize_profile(profile_path) if os.path.exists(profile_path) else {}
+
+    def stage(name):
+        return spans.get(name, {"count": 0, "seconds": 0.0, "bytes": 0, "gasUsed": 0, "tokens": 0, "start": 0.0, "end": 0.0, "networks": set()})
+
+    upload, mint = stage('upload'), stage('mint')
+    # Mint transactions are timed by whichever engine sent them
+    minted_tokens = stage('mint_tx')['tokens']
+    return {
+        "benchmark": "e2e",
+        "count": count,
+        "file_size": file_size,
+        "config": overrides,
+        "exit_code": completed.returncode,
+        "seconds": round(seconds, 2),
+        "scan_seconds": round(stage('scan')['seconds'], 4),
+        "upload_seconds": round(upload['seconds'], 2),
+        "upload_mb_per_second": round(upload['bytes'] / 1024 / 1024 / upload['seconds'], 2) if upload['seconds'] else None,
+        "deploy_seconds": round(stage('deploy')['seconds'], 2),
+        "mint_seconds": round(mint['seconds'], 2),
+        # Networks mint concurrently, so with several of them the sum above counts overlapping time
+        "networks": max(1, len(mint['networks'])),
+        "mint_wall_seconds": round(mint['end'] - mint['start'], 2),
+        "tokens_per_second": round(minted_tokens / mint['seconds'], 2) if mint['seconds'] else None,
+        "gas_per_token": round(stage('mint_tx')['gasUsed'] / minted_tokens) if minted_tokens else None,
+        "minted_tokens": minted_tokens,
+        "stages": {name: {"count": span['count'], "seconds": round(span['seconds'], 4)} for name, span in sorted(spans.items())},
+        "output_tail": (completed.stdout + completed.stderr).strip().splitlines()[-5:] if completed.returncode else [],
+    }
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_result(result, output_path=None):
+    print(json.dumps(result, indent=4))
+    if output_path:
+        # One JSON line per run, tagged with the code version, so runs can be compared over time
+        record = {"time": datetime.now(timezone.utc).isoformat(timespec='seconds'), "commit": get_git_commit(), "result": result}
+        with open(output_path, 'a') as output_file:
+            output_file.write(json.dumps(record) + "\n")
+
+def load_results(path):
+    # Latest result per benchmark in a --output file
+    results = {}
+    with open(path, 'r') as results_file:
+        for line in results_file:
+            if line.strip():
+                record = json.loads(line)
+                results[record['result']['benchmark']] = record
+    return results
+
+def flatten_metrics(result, prefix=''):
+    metrics = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[f"{prefix}{key}"] = value
+    return metrics
+
+def compare_results(baseline_path, current_path, threshold):
+    # Prints every shared metric of the latest runs in both files with its change, and returns
+    # the metrics that got worse by more than threshold percent
+    baseline, current = load_results(baseline_path), load_results(current_path)
+    regressions = []
+    for benchmark in sorted(set(baseline) & set(current)):
+        print(f"{benchmark}: {baseline[benchmark]['commit']} -> {current[benchmark]['commit']}")
+        before, after = flatten_metrics(baseline[benchmark]['result']), flatten_metrics(current[benchmark]['result'])
+        for metric in sorted(set(before) & set(after)):
+            if not before[metric]:
+                continue
+            change = (after[metric] - before[metric]) / abs(before[metric]) * 100
+            worse = -change if any(marker in metric for marker in HIGHER_IS_BETTER) else change
+            flag = ''
+            if worse > threshold and metric not in ('count', 'file_size'):
+                flag = '  REGRESSION'
+                regressions.append(f"{benchmark}.{metric}")
+            print(f"  {metric:<40}{before[metric]:>14}{after[metric]:>14}{change:>+9.1f}%{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark mint-it-yourself stages.")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    scan_parser = subparsers.add_parser('scan', help="Cold and warm scan time of the images directory.")
+    scan_parser.add_argument('--count', type=int, default=10000, help="Number of tokens to generate.")
+    scan_parser.add_argument('--file-size', type=int, default=1024, help="Size of each media file in bytes.")
+    scan_parser.add_argument('--attributes', type=int, default=4, help="Attributes per metadata file.")
+
+    upload_memory_parser = subparsers.add_parser('upload-memory', help="Peak memory of uploading one large file.")
+    upload_memory_parser.add_argument('--size-mb', type=int, default=2048, help="Size of the synthetic file in MiB.")
+    upload_memory_parser.add_argument('--gateway', default='http://localhost:1984', help="Arweave node to upload to.")
+    upload_memory_parser.add_argument('--heap-mb', type=int, default=256, help="V8 heap cap for the upload script.")
+    upload_memory_parser.add_argument('--buffered', action='store_true', help="Read the whole file into memory, as before streaming.")
+
+    upload_bundle_parser = subparsers.add_parser('upload-bundle', help="Per-file uploads against ANS-104 bundles.")
+    upload_bundle_parser.add_argument('--count', type=int, default=500, help="Number of small files.")
+    upload_bundle_parser.add_argument('--file-size', type=int, default=4096, help="Size of each file in bytes.")
+    upload_bundle_parser.add_argument('--gateway', default='http://localhost:1984', help="Arweave node to upload to.")
+    upload_bundle_parser.add_argument('--bundle-size-mb', type=int, default=32, help="Maximum bundle size.")
+
+    pipeline_parser = subparsers.add_parser('pipeline', help="Staged against overlapped upload and mint scheduling.")
+    pipeline_parser.add_argument('--count', type=int, default=200, help="Number of tokens.")
+    pipeline_parser.add_argument('--upload-ms', type=float, default=20, help="Simulated upload time per file.")
+    pipeline_parser.add_argument('--mint-ms', type=float, default=30, help="Simulated mint time per token.")
+
+    deploy_parser = subparsers.add_parser('deploy', help="Time to deploy with a cold and a warm compile cache.")
+    deploy_parser.add_argument('--network', default='anvil', help="Network name written to the truffle config.")
+    deploy_parser.add_argument('--rpc-url', default='http://127.0.0.1:8545', help="Local node to deploy to.")
+    deploy_parser.add_argument('--gas-price', type=int, default=1000000000, help="Gas price in wei.")
+    deploy_parser.add_argument('--engine', choices=miy.TX_ENGINES, default='truffle', help="Deploy with truffle migrate or the python engine.")
+
+    mint_shards_parser = subparsers.add_parser('mint-shards', help="Mint throughput against the number of minting accounts.")
+    mint_shards_parser.add_argument('--network', default='anvil', help="Network name used for the deployment record.")
+    mint_shards_parser.add_argument('--rpc-url', default='http://127.0.0.1:8545', help="Local node to mint on.")
+    mint_shards_parser.add_argument('--gas-price', type=int, default=1000000000, help="Gas price in wei.")
+    mint_shards_parser.add_argument('--count', type=int, default=500, help="Tokens minted per run.")
+    mint_shards_parser.add_argument('--accounts', type=int, nargs='+', default=[1, 2, 4, 8], help="Account counts to compare.")
+    mint_shards_parser.add_argument('--window', type=int, default=16, help="Pending transactions per account.")
+
+    preprocess_parser = subparsers.add_parser('preprocess', help="Media preprocessing throughput against the number of workers.")
+    preprocess_parser.add_argument('--count', type=int, default=200, help="Number of PNG files.")
+    preprocess_parser.add_argument('--size', type=int, default=512, help="Width and height of each image in pixels.")
+    preprocess_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()], help="Worker counts to compare.")
+
+    vouchers_parser = subparsers.add_parser('vouchers', help="Lazy-mint voucher signing throughput, and redemption on a local chain.")
+    vouchers_parser.add_argument('--count', type=int, default=10000, help="Number of vouchers to sign.")
+    vouchers_parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Signing processes.")
+    vouchers_parser.add_argument('--redeem', type=int, default=0, help="Vouchers to redeem on the local chain; 0 only signs.")
+    vouchers_parser.add_argument('--network', default='anvil', help="Network name used for the deployment record.")
+    vouchers_parser.add_argument('--rpc-url', default='http://127.0.0.1:8545', help="Local node to redeem on.")
+    vouchers_parser.add_argument('--gas-price', type=int, default=1000000000, help="Gas price in wei.")
+
+    e2e_parser = subparsers.add_parser('e2e', help="A full non-interactive run of main.py against a local chain and gateway.")
+    e2e_parser.add_argument('--count', type=int, default=100, help="Number of tokens to generate.")
+    e2e_parser.add_argument('--file-size', type=int, default=16384, help="Size of each media file in bytes.")
+    e2e_parser.add_argument('--attributes', type=int, default=4, help="Attributes per metadata file.")
+    e2e_parser.add_argument('--network', default='anvil', help="Network name written to the truffle config.")
+    e2e_parser.add_argument('--rpc-url', default='http://127.0.0.1:8545', help="Local node to deploy and mint on.")
+    e2e_parser.add_argument('--gateway', default='http://localhost:1984', help="Arweave node to upload to.")
+    e2e_parser.add_argument('--gas-price', type=int, default=1000000000, help="Gas price in wei.")
+    e2e_parser.add_argument('--to-address', default=DEFAULT_TO_ADDRESS, help="Address that receives the tokens.")
+    e2e_parser.add_argument('--set', action='append', default=[], metavar='KEY=JSON', help="Override a contract_parameters.json key, e.g. --set tx_engine='\"python\"'.")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare the latest results of two --output files.")
+    compare_parser.add_argument('baseline', help="Results of the earlier version.")
+    compare_parser.add_argument('current', help="Results of the version under test.")
+    compare_parser.add_argument('--threshold', type=float, default=10, help="Percentage by which a metric may get worse before it counts as a regression.")
+
+    for subparser in subparsers.choices.values():
+        if subparser is not compare_parser:
+            subparser.add_argument('--output', help="Append the result as a JSON line, with the time and git commit, to this file.")
+
+    args = parser.parse_args()
+    if args.benchmark == 'scan':
+        print_result(bench_scan(args.count, args.file_size, args.attributes), args.output)
+    elif args.benchmark == 'upload-memory':
+        print_result(bench_upload_memory(args.size_mb, args.gateway, args.heap_mb, args.buffered), args.output)
+    elif args.benchmark == 'upload-bundle':
+        print_result(bench_upload_bundle(args.count, args.file_size, args.gateway, args.bundle_size_mb), args.output)
+    elif args.benchmark == 'pipeline':
+        print_result(bench_pipeline(args.count, args.upload_ms, args.mint_ms), args.output)
+    elif args.benchmark == 'deploy':
+        print_result(bench_deploy(args.network, args.rpc_url, args.gas_price, args.engine), args.output)
+    elif args.benchmark == 'mint-shards':
+        print_result(bench_mint_shards(args.network, args.rpc_url, args.gas_price, args.count, args.accounts, args.window), args.output)
+    elif args.benchmark == 'preprocess':
+        print_result(bench_preprocess(args.count, args.size, args.workers), args.output)
+    elif args.benchmark == 'vouchers':
+        print_result(bench_vouchers(args.count, args.workers, args.network, args.rpc_url, args.gas_price, args.redeem), args.output)
+    elif args.benchmark == 'e2e':
+        overrides = {}
+        for setting in args.set:
+            key, value = setting.split('=', 1)
+            overrides[key] = json.loads(value)
+        print_result(bench_e2e(args.count, args.file_size, args.attributes, args.network, args.rpc_url, args.gateway, args.gas_price, args.to_address, overrides), args.output)
+    elif args.benchmark == 'compare':
+        regressions = compare_results(args.baseline, args.current, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
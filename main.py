@@ -1,9 +1,165 @@
+import argparse
+import atexit
+import queue
 import subprocess
+import shutil
 import sys
+import threading
 import os
 import json
+import hashlib
+import math
+import multiprocessing
 import re
+import struct
 import time
+import zlib
+import xml.etree.ElementTree as ElementTree
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing.connection import wait
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+# Only needed by the python transaction engine (tx_engine "python") and lazy minting
+try:
+    import eth_abi
+    from eth_account import Account
+    from eth_keys import keys as eth_keys
+    from eth_utils import keccak
+except ImportError:
+    eth_abi = Account = eth_keys = keccak = None
+
+SUPPORTED_FORMATS = ('jpg', 'png', 'gif', 'svg', 'mp4', 'webm', 'mp3', 'wav', 'ogg', 'glb', 'gltf')
+COLLECTION_INDEX_FILE = '.collection_index.json'
+CollectionEntry = namedtuple('CollectionEntry', ['file', 'token_id', 'metadata', 'skip_upload', 'content_type', 'metadata_needs_upload'])
+
+TOOLCHAIN_CACHE_FILE = '.toolchain_cache.json'
+SOLC_VERSION = '0.8.21'
+COMPILE_CACHE_DIR = '.compile_cache'
+NPM_PACKAGE_CHECKS = [
+    {"name": "truffle", "command": "truffle version"},
+    {"name": "@truffle/hdwallet-provider", "command": "npm list @truffle/hdwallet-provider"},
+    {"name": "dotenv", "command": "npm list dotenv"},
+    {"name": "@openzeppelin/contracts", "command": "npm list @openzeppelin/contracts"},
+    {"name": "arweave", "command": "npm list arweave"}
+]
+# Checked and installed only for the configurations that use them, see get_optional_npm_packages
+OPTIONAL_NPM_PACKAGE_CHECKS = {
+    "arbundles": {"name": "arbundles", "command": "npm list arbundles", "install": "arbundles"},
+    "web3": {"name": "web3", "command": "npm list web3", "install": "web3@1"},
+}
+
+DEFAULT_ARWEAVE_GATEWAY = 'https://arweave.net'
+UPLOAD_CACHE_FILE = '.arweave_upload_cache.json'
+# Files at least this large are uploaded from disk chunk by chunk instead of from one buffer
+STREAM_UPLOAD_THRESHOLD = 16 * 1024 * 1024
+# With bundling enabled, files below this size are packed into ANS-104 bundles
+BUNDLE_ITEM_MAX_SIZE = 1024 * 1024
+# Same bound as DATA_ITEM_OVERHEAD in the upload script
+DATA_ITEM_OVERHEAD = 1200
+ARWEAVE_ID_LENGTH = 43
+SIDECAR_SCRIPT = 'sidecar.js'
+
+PREPROCESS_DIR = '.preprocessed'
+PREPROCESS_INDEX_FILE = os.path.join(PREPROCESS_DIR, 'index.json')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Ancillary PNG chunks that do not change how the image renders
+PNG_STRIPPED_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+
+MINT_MODES = ('single', 'batch', 'consecutive', 'lazy')
+DEFAULT_BATCH_GAS_LIMIT = 6000000  # Stays below the 8M gas limit set in truffle-config.js
+BATCH_BASE_GAS = 30000
+MINT_BASE_GAS = 55000
+STORAGE_SLOT_GAS = 22100
+CALLDATA_BYTE_GAS = 16
+CREATE_GAS = 32000
+CODE_DEPOSIT_BYTE_GAS = 200
+MINT_METHODS = {'single': 'mint', 'batch': 'mintBatch', 'consecutive': 'setTokenURIs'}
+MINT_CALL_ARGS = {
+    'single': '[toAddress, tokenIds[0], tokenURIs[0]]',
+    'batch': '[toAddress, tokenIds, tokenURIs]',
+    'consecutive': '[tokenIds, tokenURIs]',
+}
+# In manifest mode tokenURI is baseURI + tokenId, so calls carry no URIs
+MANIFEST_CALL_ARGS = {
+    'single': '[toAddress, tokenIds[0]]',
+    'batch': '[toAddress, tokenIds]',
+}
+
+TX_ENGINES = ('truffle', 'python')
+# Vouchers only verify on the chain and contract they were signed for, so each network gets its own file
+VOUCHER_FILE = 'vouchers.{network}.json'
+VOUCHER_DOMAIN_VERSION = '1'
+EIP712_DOMAIN_TYPE = 'EIP712Domain(string name,string version,uint256 chainId,address verifyingContract)'
+# Vouchers handed to each signing process at a time
+VOUCHER_SIGN_CHUNK = 1000
+FEE_STRATEGIES = ('legacy', 'eip1559')
+FEE_HISTORY_BLOCKS = 20
+MIN_PRIORITY_FEE = 10 ** 9
+RPC_BATCH_SIZE = 100
+RECEIPT_POLL_INTERVAL = 1.0
+RECEIPT_TIMEOUT = 300
+# A transaction the node has not known for this long is considered dropped
+RECEIPT_DROP_AFTER = 120
+# Depth --watch waits for when mint_confirmations is not set; the same as truffle-config.js
+DEFAULT_CONFIRMATIONS = 2
+
+DRY_RUN_PRICE_WORKERS = 16
+
+PIPELINE_MODES = ('staged', 'overlapped')
+PIPELINE_QUEUE_SIZE = 64
+PIPELINE_UPLOAD_GROUP = 16
+PIPELINE_MINT_GROUP = 50
+
+JOURNAL_FILE = 'mint_journal.jsonl'
+JOURNAL_LOCK = threading.Lock()
+JOURNAL_STATES = ('discovered', 'uploaded', 'metadata_written', 'mint_sent', 'reverted', 'dropped', 'reorged', 'confirmed', 'finalized')
+MINT_JOURNAL_STATES = ('mint_sent', 'reverted', 'dropped', 'reorged', 'confirmed', 'finalized')
+MINTED_JOURNAL_STATES = ('confirmed', 'finalized')
+# States after which the receipt watcher stops following a token
+FINAL_JOURNAL_STATES = ('finalized', 'dropped', 'reverted')
+
+PROFILE_FILE = 'profile.jsonl'
+PROFILE_METRICS_FILE = 'profile.prom'
+# Generated scripts append their spans to the file named here; unset when --profile is off
+PROFILE_ENV_VAR = 'MINT_PROFILE_FILE'
+PROFILE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Numeric span fields exported as Prometheus counters
+PROFILE_COUNTERS = {'bytes': 'bytes', 'gasUsed': 'gas_used', 'tokens': 'tokens', 'calls': 'rpc_calls'}
+
+# Headless runs (--jobs) answer every yes/no prompt from the job's policy instead of input();
+# deploy_delay replaces the pause before deployment. None keeps the interactive prompts.
+PROMPT_POLICY = None
+JOB_POLICY_KEYS = ('create_metadata', 'upload', 'upload_manifest', 'transact', 'use_existing_contract', 'deploy', 'deploy_delay')
+DEPLOY_DELAY = 10
+JOB_LOG_FILE = 'job.log'
+JOB_REPORT_FILE = 'job_report.json'
+# Generated upload scripts space out their requests to the Arweave gateway to this rate when set
+ARWEAVE_RATE_ENV_VAR = 'MINT_ARWEAVE_REQUESTS_PER_SECOND'
+
+# Networks by name: chain_id, optionally network_id (when the node's net_version differs from the
+# chain id), rpc_url (Infura otherwise) and fee settings that override the top-level ones for
+# that network. The "networks" key of contract_parameters.json adds to these.
+NETWORKS = {
+    "mainnet": {"chain_id": 1},
+    "goerli": {"chain_id": 5},
+    "sepolia": {"chain_id": 11155111},
+    "ganache": {"chain_id": 1337},
+    "anvil": {"chain_id": 31337},
+}
+# Names end up in truffle-config.js keys, --network arguments and file names
+NETWORK_NAME_REGEX = re.compile(r'^[A-Za-z0-9_-]+$')
+# truffle migrate and record_deployment rewrite the shared artifact files
+ARTIFACT_LOCK = threading.Lock()
+
+METADATA_STORAGE_MODES = ('onchain', 'manifest', 'sstore2')
+MANIFEST_FILE = 'metadata_manifest.json'
+MANIFEST_CONTENT_TYPE = 'application/x.arweave-manifest+json'
 
 def check_contract_parameters():
     # Load user configuration
@@ -18,7 +174,10 @@ def check_contract_parameters():
         sys.exit(1)
 
     # Verify that the user provided all the necessary information
-    required_keys = ['to_address', 'network_choice', 'token_name', 'token_symbol', 'contract_name', 'creator_earnings', 'gas_price']
+    required_keys = ['to_address', 'network_choice', 'token_name', 'token_symbol', 'contract_name', 'creator_earnings']
+    # A fixed gas price is only needed when fees are not derived from the network
+    if contract_parameters.get('fee_strategy', 'legacy') == 'legacy':
+        required_keys.append('gas_price')
     if not all(key in contract_parameters and contract_parameters[key] for key in required_keys):
         print("All configuration details must be provided in 'contract_parameters.json'.")
         sys.exit(1)
@@ -30,6 +189,24 @@ def check_contract_parameters():
 
     print("User configuration valid.")
 
+def confirm(question, policy_key):
+    # A yes/no prompt; in a job the answer comes from the job's policy and is echoed to its log
+    if PROMPT_POLICY is None:
+        return input(question).strip().lower() == 'y'
+    if policy_key not in PROMPT_POLICY:
+        print(f"{question.strip()}\nThe job policy has no answer for \"{policy_key}\".")
+        sys.exit(1)
+    answer = bool(PROMPT_POLICY[policy_key])
+    print(f"{question.strip()} {'y' if answer else 'n'} (policy \"{policy_key}\")")
+    return answer
+
+def ask(question, env_key):
+    # Keys are never part of a policy: a job reads them from the .env file in its directory
+    if PROMPT_POLICY is not None:
+        print(f"{env_key} is missing from the '.env' file of the job.")
+        sys.exit(1)
+    return input(question).strip()
+
 def create_eth_env_file():
     env_file = '.env'
     infura_key_exists = False
@@ -48,7 +225,7 @@ def create_eth_env_file():
 
     # Prompt for Infura API key if it doesn't exist
     if not infura_key_exists:
-        infura_api_key = input("Enter your Infura API Key: ").strip()
+        infura_api_key = ask("Enter your Infura API Key: ", 'INFURA_API_KEY')
         with open(env_file, 'a') as file:
             file.write(f"INFURA_API_KEY={infura_api_key}\n")
         print("Infura API key added to '.env' file.")
@@ -57,7 +234,7 @@ def create_eth_env_file():
 
     # Prompt for Mnemonic if it doesn't exist
     if not mnemonic_exists:
-        mnemonic = input("Enter your Mnemonic: ").strip()
+        mnemonic = ask("Enter your Mnemonic: ", 'MNEMONIC')
         with open(env_file, 'a') as file:
             file.write(f"MNEMONIC={mnemonic}\n")
         print("Mnemonic added to '.env' file.")
@@ -78,7 +255,7 @@ def create_arweave_env_file():
                 return
 
     print("\n\"image\" field in metadata is not a valid URL. Arweave Key required.")
-    arweave_key_input = input("Enter your Arweave Key: ").strip()
+    arweave_key_input = ask("Enter your Arweave Key: ", 'ARWEAVE_KEY')
 
     try:
         # Parse and then stringify the JSON object
@@ -93,14 +270,20 @@ def create_arweave_env_file():
 
     print("Arweave key added to '.env' file.")
 
+def register_networks(networks):
+    # Adds the "networks" of contract_parameters.json to NETWORKS, replacing built-ins of the same name
+    for name, network in networks.items():
+        if not NETWORK_NAME_REGEX.match(name) or not isinstance(network, dict) or not isinstance(network.get('chain_id'), int):
+            print(f"Invalid network \"{name}\": names may only contain letters, digits, \"-\" and \"_\", and every network needs an integer chain_id.")
+            sys.exit(1)
+        NETWORKS[name.lower()] = network
+
 def get_network_id(network_name):
-    network_ids = {
-        "mainnet": "1",
-        "goerli": "5",
-        "sepolia": "11155111",
-        # Add other networks as needed
-    }
-    return network_ids.get(network_name.lower())
+    # Truffle artifacts record deployments by network id, which is the chain id unless set apart
+    network = NETWORKS.get(network_name.lower())
+    if network is None:
+        return None
+    return str(network.get('network_id', network['chain_id']))
 
 def check_for_existing_contract(contract_name, network_id):
     artifact_path = f'./build/contracts/{contract_name}.json'
@@ -117,16 +300,17 @@ def check_for_existing_contract(contract_name, network_id):
         print("Contract artifact file not found or invalid.")
         return None
 
+# Simple URL validation, compiled once since it runs for every token on every scan
+URL_REGEX = re.compile(
+    r'^(?:http|ftp)s?://'  # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]*[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
+    r'localhost|'  # localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
+    r'(?::\d+)?'  # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
 def isValidURL(url):
-    # Simple URL validation
-    regex = re.compile(
-        r'^(?:http|ftp)s?://'  # http:// or https://
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]*[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
-        r'localhost|'  # localhost...
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-        r'(?::\d+)?'  # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    return re.match(regex, url) is not None
+    return URL_REGEX.match(url) is not None
 
 def get_content_type(file_path):
     extension = file_path.split('.')[-1].lower()
@@ -145,6 +329,167 @@ def get_content_type(file_path):
         'gltf': 'model/gltf+json'
     }.get(extension, 'application/octet-stream')
 
+def record_journal(token_ids, state, **fields):
+    # Append-only JSONL: one line per token, flushed and fsynced so a crash keeps every finished step
+    if not token_ids:
+        return
+    # The overlapped pipeline journals from several threads; keep each batch of lines together
+    with JOURNAL_LOCK, open(JOURNAL_FILE, 'a+b') as journal_file:
+        # Start on a fresh line if a previous crash left a partial entry behind
+        if journal_file.tell() > 0:
+            journal_file.seek(-1, os.SEEK_END)
+            if journal_file.read(1) != b"\n":
+                journal_file.write(b"\n")
+        for token_id in token_ids:
+            entry = {"tokenId": token_id, "state": state, "time": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+            entry.update(fields)
+            journal_file.write((json.dumps(entry) + "\n").encode('utf-8'))
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+
+def load_journal(network_choice=None, contract_address=None):
+    # Replay the journal into the furthest state each token reached. Mint states only count
+    # for the given network and contract, since a new deployment starts minting from scratch.
+    # Among mint states the latest wins, so a reorged or dropped mint undoes its confirmation.
+    states = {}
+    try:
+        with open(JOURNAL_FILE, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a partial last line
+                    continue
+                if entry['state'] in MINT_JOURNAL_STATES:
+                    if entry.get('network') != network_choice:
+                        continue
+                    if (entry.get('contract') or '').lower() != (contract_address or '').lower():
+                        continue
+                current = states.get(entry['tokenId'])
+                if (current is None or JOURNAL_STATES.index(entry['state']) >= JOURNAL_STATES.index(current['state'])
+                        or (entry['state'] in MINT_JOURNAL_STATES and current['state'] in MINT_JOURNAL_STATES)):
+                    states[entry['tokenId']] = entry
+    except FileNotFoundError:
+        pass
+    return states
+
+class ProfileSpan:
+    def __init__(self, profiler, name, fields):
+        self.profiler = profiler
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.fields['error'] = exc_type.__name__
+        self.profiler.record(self.name, self.started_at, time.perf_counter() - self.started, **self.fields)
+        return False
+
+class NullSpan:
+    # Handed out while profiling is off, so an unprofiled run pays for one attribute check per span
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Profiler:
+    # Timing spans for --profile, one JSON line each in PROFILE_FILE: {"span", "source", "start"
+    # (epoch seconds), "seconds", ...fields}. The generated scripts append their own spans to the
+    # same file. finish() turns every span into Prometheus histograms and counters.
+    def __init__(self):
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def start(self, path=PROFILE_FILE):
+        self.path = os.path.abspath(path)
+        # Line buffered, so every span is a single append and never interleaves with the scripts' lines
+        self._file = open(self.path, 'w', buffering=1)
+        os.environ[PROFILE_ENV_VAR] = self.path
+        atexit.register(self.finish)
+
+    def span(self, name, **fields):
+        if self.path is None:
+            return NULL_SPAN
+        return ProfileSpan(self, name, fields)
+
+    def record(self, name, started_at, seconds, **fields):
+        if self.path is None:
+            return
+        entry = {"span": name, "source": "python", "start": round(started_at, 6), "seconds": round(seconds, 6)}
+        entry.update(fields)
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+
+    def finish(self, metrics_path=PROFILE_METRICS_FILE):
+        if self.path is None:
+            return
+        with self._lock:
+            self._file.close()
+        path = self.path
+        self.path = None
+        os.environ.pop(PROFILE_ENV_VAR, None)
+
+        histograms = {}
+        counters = {}
+        with open(path, 'r') as profile_file:
+            for line in profile_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                key = (entry['span'], entry.get('source', 'python'))
+                histogram = histograms.setdefault(key, {"buckets": [0] * len(PROFILE_BUCKETS), "sum": 0.0, "count": 0, "seconds": []})
+                for index, bound in enumerate(PROFILE_BUCKETS):
+                    if entry['seconds'] <= bound:
+                        histogram['buckets'][index] += 1
+                histogram['sum'] += entry['seconds']
+                histogram['count'] += 1
+                histogram['seconds'].append(entry['seconds'])
+                for field, metric in PROFILE_COUNTERS.items():
+                    if isinstance(entry.get(field), (int, float)):
+                        counters[(metric, key)] = counters.get((metric, key), 0) + entry[field]
+
+        lines = ["# HELP miy_span_seconds Duration of profiled stages and operations.", "# TYPE miy_span_seconds histogram"]
+        for (span, source), histogram in sorted(histograms.items()):
+            labels = f'span="{span}",source="{source}"'
+            lines.extend(f'miy_span_seconds_bucket{{{labels},le="{bound}"}} {count}' for bound, count in zip(PROFILE_BUCKETS, histogram['buckets']))
+            lines.append(f'miy_span_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'miy_span_seconds_sum{{{labels}}} {histogram["sum"]:.6f}')
+            lines.append(f'miy_span_seconds_count{{{labels}}} {histogram["count"]}')
+        for metric in sorted(set(PROFILE_COUNTERS.values())):
+            series = sorted((key, value) for (name, key), value in counters.items() if name == metric)
+            if series:
+                lines.append(f"# TYPE miy_span_{metric}_total counter")
+                lines.extend(f'miy_span_{metric}_total{{span="{span}",source="{source}"}} {value}' for (span, source), value in series)
+        # Written whole and renamed into place, as the node_exporter textfile collector expects
+        temp_path = f"{metrics_path}.tmp"
+        with open(temp_path, 'w') as metrics_file:
+            metrics_file.write("\n".join(lines) + "\n")
+        os.replace(temp_path, metrics_path)
+
+        print(f"\nProfile: {path}, metrics: {os.path.abspath(metrics_path)}")
+        print(f"{'span':<28}{'source':<8}{'count':>8}{'total s':>10}{'p50 s':>10}{'p95 s':>10}")
+        for (span, source), histogram in sorted(histograms.items(), key=lambda item: -item[1]['sum']):
+            seconds = sorted(histogram['seconds'])
+            print(f"{span:<28}{source:<8}{histogram['count']:>8}{histogram['sum']:>10.3f}{seconds[len(seconds) // 2]:>10.3f}{seconds[min(len(seconds) - 1, len(seconds) * 95 // 100)]:>10.3f}")
+
+PROFILER = Profiler()
+
 def create_default_metadata(file_name, arweave_url=None):
     return {
         "name": f"NFT for {file_name}",
@@ -152,53 +497,164 @@ def create_default_metadata(file_name, arweave_url=None):
         "image": arweave_url if arweave_url else "None",  # We'll update this URL later
     }
 
-def process_files(directory_path):
-    supported_formats = ['jpg', 'png', 'gif', 'svg', 'mp4', 'webm', 'mp3', 'wav', 'ogg', 'glb', 'gltf']
-    files_to_process = []
+def load_collection_index(index_path):
+    try:
+        with open(index_path, 'r') as index_file:
+            return json.load(index_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_collection_index(index, index_path):
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, 'w') as index_file:
+        # json.dumps uses the C encoder; json.dump would stream through the much slower Python one
+        index_file.write(json.dumps(index, separators=(',', ':')))
+    os.replace(temp_path, index_path)
+
+def process_files(directory_path, index_path=COLLECTION_INDEX_FILE):
+    # One CollectionEntry per numbered media file. Metadata is taken from the on-disk index
+    # when neither the media file nor its JSON changed (same mtime and size) since the last
+    # scan, so warm scans skip reading and parsing every metadata file.
+    collection = []
+    old_index = load_collection_index(index_path)
+    new_index = {}
+    index_changed = False
 
-    for file in os.listdir(directory_path):
+    # One directory pass gives every entry's stat, including the metadata files
+    entries = {}
+    with os.scandir(directory_path) as scanner:
+        for entry in scanner:
+            entries[entry.name] = entry
+
+    for file, entry in entries.items():
         file_ext = file.split('.')[-1].lower()
-        metadata_needs_upload = False
-        if file_ext in supported_formats:
-            token_id = os.path.splitext(file)[0]
-            if token_id.isdigit():
-                metadata_file = f"{token_id}.json"
-                metadata_path = os.path.join(directory_path, metadata_file)
-                metadata = {}
+        if file_ext not in SUPPORTED_FORMATS:
+            continue
+        token_id = os.path.splitext(file)[0]
+        if not token_id.isdigit():
+            continue
+
+        metadata_file = f"{token_id}.json"
+        metadata_entry = entries.get(metadata_file)
+        file_path = os.path.join(directory_path, file)
+        file_stat = entry.stat()
+        if metadata_entry is not None:
+            metadata_stat = metadata_entry.stat()
+            fingerprint = [file_stat.st_mtime_ns, file_stat.st_size, metadata_stat.st_mtime_ns, metadata_stat.st_size]
+            cached = old_index.get(file_path)
+            if cached is not None and cached['fingerprint'] == fingerprint:
+                metadata = cached['metadata']
+                has_valid_url = cached['has_valid_url']
+            else:
+                with open(metadata_entry.path, 'r') as md_file:
+                    metadata = json.load(md_file)
+                has_valid_url = 'image' in metadata and isValidURL(metadata['image'])
+                index_changed = True
+            new_index[file_path] = {'fingerprint': fingerprint, 'metadata': metadata, 'has_valid_url': has_valid_url}
+            skip_upload = has_valid_url  # Valid URL, skip upload
+            metadata_needs_upload = not has_valid_url
+        else:
+            if confirm(f"\nMetadata \"{metadata_file}\" does not exist. Create boilerplate metadata? (y/n): ", 'create_metadata'):
+                # Create default metadata if JSON file does not exist
+                metadata = create_default_metadata(file, None)
                 skip_upload = False
-                if os.path.exists(metadata_path):
-                    with open(metadata_path, 'r') as md_file:
-                        metadata = json.load(md_file)
-                    if 'image' in metadata and isValidURL(metadata['image']):
-                        skip_upload = True  # Valid URL, skip upload
-                    if 'image' not in metadata or not isValidURL(metadata['image']):
-                        metadata_needs_upload = True
-                else:
-                    if input(f"\nMetadata \"{metadata_file}\" does not exist. Create boilerplate metadata? (y/n): ").strip().lower() == 'y':
-                        # Create default metadata if JSON file does not exist
-                        metadata = create_default_metadata(file, None)
-                        metadata_needs_upload = True
-                    else:
-                        sys.exit(f"Metadata file for \"{metadata_file}\" not found. Please create a JSON file with the same name as the image file or remove the file from the images directory.")
-                
-                # Construct the full file path
-                file_path = os.path.join(directory_path, file)
-                content_type = get_content_type(file_path)
-                files_to_process.append((file, int(token_id), metadata, skip_upload, content_type, metadata_needs_upload))
-
-    return files_to_process
-
-def check_node_npm():
+                metadata_needs_upload = True
+            else:
+                sys.exit(f"Metadata file for \"{metadata_file}\" not found. Please create a JSON file with the same name as the image file or remove the file from the images directory.")
+
+        content_type = get_content_type(file_path)
+        collection.append(CollectionEntry(file, int(token_id), metadata, skip_upload, content_type, metadata_needs_upload))
+
+    if index_changed or len(new_index) != len(old_index):
+        save_collection_index(new_index, index_path)
+    return collection
+
+def run_probe_command(command):
+    # Returns (succeeded, output or exception) without raising, so probes can run side by side
     try:
-        node_version = subprocess.check_output('node --version', shell=True).decode('utf-8').strip()
-        npm_version = subprocess.check_output('npm --version', shell=True).decode('utf-8').strip()
-        print(f"Node.js version: {node_version}, npm version: {npm_version}")
+        return True, subprocess.check_output(command, shell=True, stderr=subprocess.DEVNULL).decode('utf-8').strip()
     except Exception as e:
-        print(f"Error: {e}")
-        print("Node.js and npm are required. Please install or ensure they are added to PATH.")
-        print("See https://nodejs.org/en/download/.")
+        return False, e
+
+def get_optional_npm_packages(contract_parameters):
+    # Bundling needs arbundles and the sidecar needs web3; nobody else installs them
+    packages = []
+    if contract_parameters.get('upload_bundle_size_mb', 0):
+        packages.append('arbundles')
+    if contract_parameters.get('use_sidecar', False):
+        packages.append('web3')
+    return packages
+
+def get_npm_package_checks(optional_packages=()):
+    return NPM_PACKAGE_CHECKS + [OPTIONAL_NPM_PACKAGE_CHECKS[name] for name in sorted(set(optional_packages))]
+
+def probe_toolchain(optional_packages=()):
+    # Every check is an independent process start, so run them all at once
+    commands = {"node": "node --version", "npm": "npm --version"}
+    commands.update({package["name"]: package["command"] for package in get_npm_package_checks(optional_packages)})
+    with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+        futures = {name: executor.submit(run_probe_command, command) for name, command in commands.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+def get_toolchain_fingerprint(optional_packages=()):
+    # Stat-only stand-ins for what the probe depends on: the packages checked, the tool binaries
+    # (a node or npm upgrade replaces them) and the installed package tree
+    parts = [sorted(set(optional_packages))]
+    for tool in ("node", "npm", "truffle"):
+        tool_path = shutil.which(tool)
+        if tool_path:
+            tool_path = os.path.realpath(tool_path)
+            tool_stat = os.stat(tool_path)
+            parts.append([tool, tool_path, tool_stat.st_mtime_ns, tool_stat.st_size])
+        else:
+            parts.append([tool, None])
+    for path in ("package.json", "package-lock.json", os.path.join("node_modules", ".package-lock.json")):
+        if os.path.exists(path):
+            path_stat = os.stat(path)
+            parts.append([path, path_stat.st_mtime_ns, path_stat.st_size])
+        else:
+            parts.append([path, None])
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+def check_toolchain(optional_packages=()):
+    fingerprint = get_toolchain_fingerprint(optional_packages)
+    try:
+        with open(TOOLCHAIN_CACHE_FILE, 'r') as cache_file:
+            cache = json.load(cache_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+
+    if cache.get("fingerprint") == fingerprint:
+        print(f"Node.js version: {cache['node_version']}, npm version: {cache['npm_version']} (cached)")
+        print("npm packages are installed (cached).")
+        return
+
+    probe_results = probe_toolchain(optional_packages)
+    if not check_node_npm(probe_results):
+        return
+    check_npm_packages(probe_results, optional_packages)
+
+    # Only a fully working toolchain is cached; installing packages changes the fingerprint
+    cache = {
+        "fingerprint": get_toolchain_fingerprint(optional_packages),
+        "node_version": probe_results["node"][1],
+        "npm_version": probe_results["npm"][1],
+    }
+    with open(TOOLCHAIN_CACHE_FILE, 'w') as cache_file:
+        json.dump(cache, cache_file, indent=4)
+
+def check_node_npm(probe_results):
+    for name in ("node", "npm"):
+        succeeded, error = probe_results[name]
+        if not succeeded:
+            print(f"Error: {error}")
+            print("Node.js and npm are required. Please install or ensure they are added to PATH.")
+            print("See https://nodejs.org/en/download/.")
+            return False
+    print(f"Node.js version: {probe_results['node'][1]}, npm version: {probe_results['npm'][1]}")
+    return True
 
-def install_npm_packages():
+def install_npm_packages(optional_packages=()):
     # List of npm packages to install
     npm_packages = [
         "truffle",
@@ -207,6 +663,7 @@ def install_npm_packages():
         "@openzeppelin/contracts@latest",
         "arweave"
     ]
+    npm_packages += [OPTIONAL_NPM_PACKAGE_CHECKS[name]["install"] for name in sorted(set(optional_packages))]
 
     try:
         # Install all npm packages
@@ -216,30 +673,20 @@ def install_npm_packages():
         print(f"Failed to install npm packages: {e}")
         sys.exit(1)
 
-def check_npm_packages():
-    # List of npm packages to check
-    npm_packages = [
-        {"name": "truffle", "command": "truffle version"},
-        {"name": "@truffle/hdwallet-provider", "command": "npm list @truffle/hdwallet-provider"},
-        {"name": "dotenv", "command": "npm list dotenv"},
-        {"name": "@openzeppelin/contracts", "command": "npm list @openzeppelin/contracts"},
-        {"name": "arweave", "command": "npm list arweave"}
-    ]
-
+def check_npm_packages(probe_results, optional_packages=()):
     all_installed = True
 
-    for package in npm_packages:
-        try:
-            # Check if each package is installed
-            subprocess.check_output(package["command"], shell=True)
+    for package in get_npm_package_checks(optional_packages):
+        succeeded, error = probe_results[package["name"]]
+        if succeeded:
             print(f"{package['name']} is installed.")
-        except Exception as e:
-            print(f"{package['name']} not found: {e}")
+        else:
+            print(f"{package['name']} not found: {error}")
             all_installed = False
 
     if not all_installed:
         print("Not all npm packages are installed. Installing missing packages now.")
-        install_npm_packages()
+        install_npm_packages(optional_packages)
 
 def init_truffle_project():
     if not os.path.exists('truffle-config.js'):
@@ -252,26 +699,36 @@ def init_truffle_project():
     else:
         print("Truffle project already initialized.")
 
-def overwrite_truffle_config(network_choice, gas_price):
+def overwrite_truffle_config(networks, mint_accounts=1):
+    # networks maps each network name to (fees, rpc_url); every one of them gets an entry, so
+    # truffle can run against each with --network
+    network_entries = []
+    for network_choice, (fees, rpc_url) in networks.items():
+        # An explicit RPC URL (e.g. a local Anvil or Ganache node) takes precedence over Infura
+        if rpc_url:
+            network_url = json.dumps(rpc_url)
+        else:
+            network_url = f"`https://{network_choice}.infura.io/v3/${{process.env.INFURA_API_KEY}}`"
+
+        # fees is {'gasPrice': wei} or {'maxFeePerGas': wei, 'maxPriorityFeePerGas': wei}; gas
+        # limits are left to Truffle's per-call estimation
+        fee_settings = ''.join(f"\n            {name}: {value}," for name, value in fees.items())
+        network_entries.append(f"""        {json.dumps(network_choice)}: {{
+            // Derives one account per mint shard; the first deploys and owns the contract
+            provider: () => new HDWalletProvider(process.env.MNEMONIC, {network_url}, 0, {int(mint_accounts)}),
+            network_id: '*', // Use '*' for any network (Wildcard){fee_settings}
+            confirmations: 2,
+            timeoutBlocks: 200,
+            skipDryRun: true
+        }},""")
+
     config_content = f"""
 require('dotenv').config();
 const HDWalletProvider = require('@truffle/hdwallet-provider');
 
-// Construct network URL within the JavaScript context
-const network_url = `https://{network_choice}.infura.io/v3/${{process.env.INFURA_API_KEY}}`;
-
 module.exports = {{
     networks: {{
-        {network_choice}: {{
-            provider: () => new HDWalletProvider(process.env.MNEMONIC, network_url),
-            network_id: '*', // Use '*' for any network (Wildcard)
-            gas: 8000000,
-            gasPrice: {gas_price},
-            confirmations: 2,
-            timeoutBlocks: 200,
-            skipDryRun: true
-        }},
-        // Other network configurations can be added here
+{chr(10).join(network_entries)}
     }},
 
     // Set default mocha options here, use special reporters, etc.
@@ -282,7 +739,7 @@ module.exports = {{
     // Configure your compilers
     compilers: {{
         solc: {{
-            version: '0.8.21', // Use the version of Solidity you prefer
+            version: '{SOLC_VERSION}', // Part of the compile cache key
             // Other compiler settings...
         }}
     }},
@@ -302,25 +759,14 @@ def is_valid_ethereum_address(address):
     # Ethereum addresses have 42 characters: '0x' followed by 40 hexadecimal characters
     return re.match(r'^0x[a-fA-F0-9]{40}$', address) is not None
 
-def create_script_initial_migrations():
-    migrations_script_content = """
-const Migrations = artifacts.require("Migrations");
-
-module.exports = function (deployer) {
-    deployer.deploy(Migrations);
-};
-"""
-
-    with open('./migrations/1_initial_migrations.js', 'w', encoding='utf-8') as file:
-        file.write(migrations_script_content)
-    print("Initial migrations script created successfully.")
-
-def create_script_deploy_contracts(contract_name):
+def create_script_deploy_contracts(contract_name, constructor_args=None):
+    # Constructor arguments are passed through to deployer.deploy as JSON literals
+    deploy_args = ''.join(f", {json.dumps(arg)}" for arg in (constructor_args or []))
     deploy_script_content = f"""
 const {contract_name} = artifacts.require("{contract_name}");
 
 module.exports = function (deployer) {{
-    deployer.deploy({contract_name});
+    deployer.deploy({contract_name}{deploy_args});
     // Additional contracts can be deployed here
 }};
 """
@@ -329,66 +775,776 @@ module.exports = function (deployer) {{
         file.write(deploy_script_content)
     print(f"Deployment script for {contract_name} created successfully.")
 
-def create_script_mint(contract_name, to_address, token_data):
+def estimate_mint_gas(token_uri, metadata_storage='onchain'):
+    # Rough upper bound for minting one token: ownership, balance, royalty and Transfer event,
+    # plus whatever it costs to keep the token URI around in the chosen storage layout
+    uri_length = len(token_uri.encode('utf-8'))
+    if metadata_storage == 'manifest':
+        # tokenURI is derived from the base URI, so nothing per token is stored or sent
+        return MINT_BASE_GAS
+    if metadata_storage == 'sstore2':
+        # One slot for the pointer plus a contract creation whose code is the URI
+        return MINT_BASE_GAS + STORAGE_SLOT_GAS + CREATE_GAS + (CODE_DEPOSIT_BYTE_GAS + CALLDATA_BYTE_GAS) * uri_length
+    # One storage slot for the string length and one per 32 bytes of URI, plus calldata
+    storage_slots = 1 + (uri_length + 31) // 32
+    return MINT_BASE_GAS + STORAGE_SLOT_GAS * storage_slots + CALLDATA_BYTE_GAS * uri_length
+
+def chunk_token_data(token_data, gas_limit, metadata_storage='onchain'):
+    # Split token data into consecutive chunks whose estimated gas stays below gas_limit
+    chunks = []
+    current_chunk = []
+    current_gas = BATCH_BASE_GAS
+    for data in token_data:
+        token_gas = estimate_mint_gas(json.dumps(data['metadata'], separators=(',', ':')), metadata_storage)
+        if current_chunk and current_gas + token_gas > gas_limit:
+            chunks.append(current_chunk)
+            current_chunk = []
+            current_gas = BATCH_BASE_GAS
+        current_chunk.append(data)
+        current_gas += token_gas
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+def get_consecutive_range(token_data):
+    # Consecutive mode requires token ids to form one unbroken range
+    token_ids = sorted(data['tokenId'] for data in token_data)
+    if not token_ids:
+        print("Error: consecutive mint mode requires at least one token.")
+        sys.exit(1)
+    if token_ids != list(range(token_ids[0], token_ids[0] + len(token_ids))):
+        print("Error: consecutive mint mode requires token ids without gaps.")
+        sys.exit(1)
+    return token_ids[0], len(token_ids)
+
+JS_COMMON = """
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+// Set by main.py --profile (PROFILE_ENV_VAR); spans go to the same JSONL file as Python's
+const PROFILE_PATH = process.env.MINT_PROFILE_FILE;
+const PROCESS_STARTED_AT = Date.now() - process.uptime() * 1000;
+
+// Appends one timing span that began at startedAt (a Date.now() value); a no-op unless profiling
+function profileSpan(name, startedAt, fields) {
+    if (!PROFILE_PATH) {
+        return;
+    }
+    fs.appendFileSync(PROFILE_PATH, JSON.stringify(Object.assign(
+        { span: name, source: 'js', start: startedAt / 1000, seconds: (Date.now() - startedAt) / 1000 }, fields)) + '\\n');
+}
+"""
+
+MINT_PIPELINE_JS = """
+const RECEIPT_POLL_INTERVAL_MS = 1000;
+const FEE_HISTORY_BLOCKS = 20;
+const MIN_PRIORITY_FEE = 1000000000n;
+
+// Raw JSON-RPC call through the wallet provider, which signs eth_sendTransaction locally
+function rpc(web3, method, params) {
+    const provider = web3.currentProvider;
+    const send = (provider.sendAsync || provider.send).bind(provider);
+    return new Promise((resolve, reject) => {
+        send({ jsonrpc: '2.0', id: Date.now(), method: method, params: params }, (error, response) => {
+            if (error) {
+                reject(error);
+            } else if (response.error) {
+                reject(new Error(response.error.message));
+            } else {
+                resolve(response.result);
+            }
+        });
+    });
+}
+
+// Fee policy ({strategy, gasPrice, percentile, maxFeePerGas, bumpPercent, stuckAfterSeconds}) as
+// built by get_fee_policy in main.py; fee values are BigInts. The JS side of the same rules.
+function capFees(fees, policy) {
+    if (!policy.maxFeePerGas) {
+        return fees;
+    }
+    const ceiling = BigInt(policy.maxFeePerGas);
+    if (fees.gasPrice !== undefined) {
+        return { gasPrice: fees.gasPrice < ceiling ? fees.gasPrice : ceiling };
+    }
+    const maxFeePerGas = fees.maxFeePerGas < ceiling ? fees.maxFeePerGas : ceiling;
+    const maxPriorityFeePerGas = fees.maxPriorityFeePerGas < maxFeePerGas ? fees.maxPriorityFeePerGas : maxFeePerGas;
+    return { maxFeePerGas: maxFeePerGas, maxPriorityFeePerGas: maxPriorityFeePerGas };
+}
+
+async function suggestFees(web3, policy) {
+    if (policy.strategy === 'legacy') {
+        return capFees({ gasPrice: BigInt(policy.gasPrice) }, policy);
+    }
+    // The last base fee in the history is the one the next block will charge
+    const history = await rpc(web3, 'eth_feeHistory', [web3.utils.toHex(FEE_HISTORY_BLOCKS), 'latest', [policy.percentile]]);
+    const nextBaseFee = BigInt(history.baseFeePerGas[history.baseFeePerGas.length - 1]);
+    const rewards = (history.reward || []).map(reward => BigInt(reward[0])).sort((a, b) => (a < b ? -1 : a > b ? 1 : 0));
+    const priorityFee = rewards.length ? rewards[Math.floor(rewards.length / 2)] : MIN_PRIORITY_FEE;
+    return capFees({ maxFeePerGas: 2n * nextBaseFee + priorityFee, maxPriorityFeePerGas: priorityFee }, policy);
+}
+
+// Replacement fees for a stuck transaction, or null when the ceiling leaves no room to bump
+function bumpFees(fees, policy) {
+    const bump = value => value * BigInt(100 + policy.bumpPercent) / 100n + 1n;
+    const bumped = capFees(fees.gasPrice !== undefined
+        ? { gasPrice: bump(fees.gasPrice) }
+        : { maxFeePerGas: bump(fees.maxFeePerGas), maxPriorityFeePerGas: bump(fees.maxPriorityFeePerGas) }, policy);
+    const current = fees.gasPrice !== undefined ? fees.gasPrice : fees.maxFeePerGas;
+    const next = bumped.gasPrice !== undefined ? bumped.gasPrice : bumped.maxFeePerGas;
+    return next > current ? bumped : null;
+}
+
+function feeFields(web3, fees) {
+    if (fees.gasPrice !== undefined) {
+        return { gasPrice: web3.utils.toHex(fees.gasPrice.toString()) };
+    }
+    return {
+        type: '0x2',
+        maxFeePerGas: web3.utils.toHex(fees.maxFeePerGas.toString()),
+        maxPriorityFeePerGas: web3.utils.toHex(fees.maxPriorityFeePerGas.toString())
+    };
+}
+
+// Sends jobs ({tokenIds, method, args}) with locally assigned nonces, keeping up to
+// options.window transactions pending at once. Fees come from options.feePolicy; a
+// transaction still pending after feePolicy.stuckAfterSeconds is replaced at the same nonce
+// with bumped fees. Failed or dropped jobs are re-queued with the same token ids until
+// options.maxAttempts. options.onSent(job, hash) and options.onConfirmed(job, receipt)
+// report progress; onSent is called again for every replacement.
+async function mintPipelined(web3, contract, fromAddress, jobs, options) {
+    const window = Math.max(1, options.window || 1);
+    const maxAttempts = options.maxAttempts || 3;
+    const feePolicy = options.feePolicy;
+    const stuckAfterMs = feePolicy.stuckAfterSeconds * 1000;
+    const queue = jobs.map(job => Object.assign({ attempts: 0, nonce: null }, job));
+    const freeNonces = [];
+    const summary = { mintedCount: 0, gasUsed: 0, failed: [] };
+    let nextNonce = await web3.eth.getTransactionCount(fromAddress, 'pending');
+
+    function takeNonce() {
+        // Reuse nonces of transactions that never reached the node first, so no gap blocks the queue
+        if (freeNonces.length) {
+            freeNonces.sort((a, b) => a - b);
+            return freeNonces.shift();
+        }
+        return nextNonce++;
+    }
+
+    // Fee suggestions are shared by all jobs and refreshed at most every few seconds
+    let cachedFees = null;
+    let cachedFeesAt = 0;
+    async function currentFees() {
+        if (!cachedFees || Date.now() - cachedFeesAt > 15000) {
+            cachedFees = await suggestFees(web3, feePolicy);
+            cachedFeesAt = Date.now();
+        }
+        return cachedFees;
+    }
+
+    function sendTransaction(nonce, transaction, fees) {
+        return rpc(web3, 'eth_sendTransaction', [Object.assign({
+            from: fromAddress,
+            nonce: web3.utils.toHex(nonce)
+        }, feeFields(web3, fees), transaction)]);
+    }
+
+    function retryOrFail(job, error) {
+        if (job.attempts < maxAttempts) {
+            console.error('Re-queueing token ids', job.tokenIds.join(','), 'after error:', error.message || error);
+            queue.unshift(job);
+            return;
+        }
+        console.error('Failed to mint NFT:', job.tokenIds.join(','), error);
+        summary.failed.push(...job.tokenIds);
+        if (job.nonce !== null) {
+            freeNonces.push(job.nonce);
+            job.nonce = null;
+        }
+    }
+
+    // Any of the hashes may be mined: the original or one of its fee-bumped replacements
+    async function waitForReceipt(hashes, timeoutMs) {
+        const deadline = Date.now() + timeoutMs;
+        while (Date.now() < deadline) {
+            for (const hash of hashes) {
+                const receipt = await web3.eth.getTransactionReceipt(hash);
+                if (receipt) {
+                    return receipt;
+                }
+            }
+            await sleep(RECEIPT_POLL_INTERVAL_MS);
+        }
+        return null;
+    }
+
+    async function runJob(job) {
+        job.attempts++;
+        const nonce = job.nonce !== null ? job.nonce : takeNonce();
+        job.nonce = null;
+        const startedAt = Date.now();
+
+        let hash;
+        let fees;
+        let transaction;
+        try {
+            if (!job.gas) {
+                const estimate = await contract.methods[job.method](...job.args).estimateGas({ from: fromAddress });
+                job.gas = Math.ceil(estimate * 1.2);
+            }
+            fees = await currentFees();
+            transaction = {
+                to: contract.options.address,
+                data: contract.methods[job.method](...job.args).encodeABI(),
+                gas: web3.utils.toHex(job.gas)
+            };
+            console.log('Minting token ids', job.tokenIds.join(','), 'with nonce', nonce);
+            hash = await sendTransaction(nonce, transaction, fees);
+        } catch (error) {
+            if (/nonce too low/i.test(error.message || '')) {
+                // Something else used this nonce; resynchronise with the node instead of reusing it
+                nextNonce = Math.max(nextNonce, await web3.eth.getTransactionCount(fromAddress, 'pending'));
+            } else {
+                freeNonces.push(nonce);
+            }
+            return retryOrFail(job, error);
+        }
+        console.log('Transaction hash:', hash);
+        const sentAt = Date.now();
+        profileSpan('mint_send', startedAt, { tokens: job.tokenIds.length });
+        if (options.onSent) {
+            options.onSent(job, hash);
+        }
+
+        const hashes = [hash];
+        for (;;) {
+            const receipt = await waitForReceipt(hashes, stuckAfterMs);
+            if (receipt && receipt.status) {
+                profileSpan('mint_tx', sentAt, { tokens: job.tokenIds.length, gasUsed: receipt.gasUsed, replacements: hashes.length - 1 });
+                summary.mintedCount += job.tokenIds.length;
+                summary.gasUsed += receipt.gasUsed;
+                console.log('Confirmed token ids', job.tokenIds.join(','), 'in block', receipt.blockNumber, 'gas used:', receipt.gasUsed);
+                if (options.onConfirmed) {
+                    options.onConfirmed(job, receipt);
+                }
+                return;
+            }
+            if (receipt) {
+                // Reverted: the nonce is spent, so the retry gets a fresh one
+                profileSpan('mint_tx', sentAt, { tokens: job.tokenIds.length, gasUsed: receipt.gasUsed, error: 'reverted' });
+                return retryOrFail(job, new Error(`transaction ${receipt.transactionHash} reverted`));
+            }
+            const known = await Promise.all(hashes.map(pendingHash => web3.eth.getTransaction(pendingHash)));
+            if (!known.some(pendingTransaction => pendingTransaction)) {
+                // Dropped from the mempool: resend the same tokens with the same nonce
+                profileSpan('mint_tx', sentAt, { tokens: job.tokenIds.length, error: 'dropped' });
+                job.nonce = nonce;
+                return retryOrFail(job, new Error(`transaction ${hashes[hashes.length - 1]} was dropped`));
+            }
+            const bumped = bumpFees(fees, feePolicy);
+            if (!bumped) {
+                console.log('Transaction', hashes[hashes.length - 1], 'still pending at the fee ceiling, waiting...');
+                continue;
+            }
+            try {
+                const replacement = await sendTransaction(nonce, transaction, bumped);
+                fees = bumped;
+                hashes.push(replacement);
+                console.log('Replaced stuck transaction', hashes[hashes.length - 2], 'with', replacement, 'at higher fees');
+                if (options.onSent) {
+                    options.onSent(job, replacement);
+                }
+            } catch (error) {
+                console.error('Fee bump for nonce', nonce, 'was rejected:', error.message || error);
+            }
+        }
+    }
+
+    async function fillNonceGap(nonce) {
+        // A nonce left unused by a job that gave up would block every later transaction
+        try {
+            const hash = await sendTransaction(nonce, { to: fromAddress, value: '0x0', gas: web3.utils.toHex(21000) }, await currentFees());
+            console.log('Filled nonce gap', nonce, 'with transaction', hash);
+        } catch (error) {
+            console.error('Failed to fill nonce gap', nonce, error);
+        }
+    }
+
+    await new Promise(resolve => {
+        const inFlight = new Set();
+        function pump() {
+            while (inFlight.size < window && (queue.length || freeNonces.length)) {
+                const task = queue.length ? runJob(queue.shift()) : fillNonceGap(takeNonce());
+                inFlight.add(task);
+                task.catch(error => console.error('Unexpected mint error:', error)).finally(() => {
+                    inFlight.delete(task);
+                    pump();
+                });
+            }
+            if (!inFlight.size) {
+                resolve();
+            }
+        }
+        pump();
+    });
+    return summary;
+}
+
+// accounts[0] owns the contract: it grants minter rights to the other accounts and tops up
+// every one whose balance cannot cover its share of the jobs at the highest allowed fee
+async function prepareShards(web3, contract, accounts, shards, feePolicy) {
+    const owner = accounts[0];
+    for (const account of accounts.slice(1)) {
+        if (!(await contract.methods.isMinter(account).call())) {
+            console.log('Granting minter rights to', account);
+            await contract.methods.setMinter(account, true).send(Object.assign({ from: owner }, feeFields(web3, await suggestFees(web3, feePolicy))));
+        }
+    }
+
+    const fees = await suggestFees(web3, feePolicy);
+    const maxPrice = fees.gasPrice !== undefined ? fees.gasPrice : fees.maxFeePerGas;
+    await Promise.all(accounts.slice(1).map(async (account, index) => {
+        let gas = 0n;
+        for (const job of shards[index + 1]) {
+            try {
+                // Estimated as the owner, like the Python engine does. Kept on the job so
+                // mintPipelined does not estimate it again
+                job.gas = Math.ceil((await contract.methods[job.method](...job.args).estimateGas({ from: owner })) * 1.2);
+                gas += BigInt(job.gas);
+            } catch (error) {
+                // Left for mintPipelined to retry and report
+            }
+        }
+        const balance = BigInt(await web3.eth.getBalance(account));
+        if (balance < gas * maxPrice) {
+            const topUp = gas * maxPrice - balance;
+            console.log('Funding', account, 'with', web3.utils.fromWei(topUp.toString(), 'ether'), 'ETH');
+            await web3.eth.sendTransaction(Object.assign({ from: owner, to: account, value: web3.utils.toHex(topUp.toString()) }, feeFields(web3, fees)));
+        }
+    }));
+}
+
+// Deals jobs round-robin to accounts, which mint in parallel through their own mintPipelined
+// nonce lanes; the summaries are merged
+async function mintSharded(web3, contract, accounts, jobs, options) {
+    accounts = accounts.slice(0, Math.max(1, Math.min(accounts.length, jobs.length)));
+    if (accounts.length === 1) {
+        return mintPipelined(web3, contract, accounts[0], jobs, options);
+    }
+    const shards = accounts.map((account, index) => jobs.filter((job, jobIndex) => jobIndex % accounts.length === index));
+    await prepareShards(web3, contract, accounts, shards, options.feePolicy);
+    const summaries = await Promise.all(accounts.map((account, index) => mintPipelined(web3, contract, account, shards[index], options)));
+    return summaries.reduce((total, summary) => ({
+        mintedCount: total.mintedCount + summary.mintedCount,
+        gasUsed: total.gasUsed + summary.gasUsed,
+        failed: total.failed.concat(summary.failed)
+    }), { mintedCount: 0, gasUsed: 0, failed: [] });
+}
+"""
+
+MINT_JOURNAL_JS = """
+// Start on a fresh line if a previous crash left a partial entry behind
+function terminateJournal() {
+    if (!fs.existsSync(JOURNAL_PATH) || fs.statSync(JOURNAL_PATH).size === 0) {
+        return;
+    }
+    const fd = fs.openSync(JOURNAL_PATH, 'r');
+    const lastByte = Buffer.alloc(1);
+    fs.readSync(fd, lastByte, 0, 1, fs.fstatSync(fd).size - 1);
+    fs.closeSync(fd);
+    if (lastByte[0] !== 10) {
+        fs.appendFileSync(JOURNAL_PATH, '\\n');
+    }
+}
+terminateJournal();
+
+// Append one line per token and fsync, so a crash never loses a sent transaction hash
+function recordJournal(tokenIds, state, fields) {
+    const lines = tokenIds.map(tokenId => JSON.stringify(Object.assign(
+        { tokenId: tokenId, state: state, time: new Date().toISOString() }, fields))).join('\\n') + '\\n';
+    const fd = fs.openSync(JOURNAL_PATH, 'a');
+    try {
+        fs.writeSync(fd, lines);
+        fs.fsyncSync(fd);
+    } finally {
+        fs.closeSync(fd);
+    }
+}
+
+// Tokens the journal saw sent but never confirmed may have landed anyway; ask the chain
+async function reconcileMinted(ownerOf, tokenIds) {
+    const minted = new Set();
+    await Promise.all(tokenIds.map(async tokenId => {
+        try {
+            await ownerOf(tokenId);
+            minted.add(tokenId);
+        } catch (error) {
+            // ownerOf reverts for tokens that do not exist yet
+        }
+    }));
+    return minted;
+}
+"""
+
+def build_token_chunks(token_data, mint_mode, batch_gas_limit, metadata_storage):
+    # Each chunk becomes one contract call: a single mint, a mintBatch, or setTokenURIs for
+    # consecutive mode, where the tokens themselves were minted at deployment
+    if mint_mode == 'lazy':
+        # Tokens are minted by whoever redeems their voucher, at their expense
+        return []
+    if metadata_storage == 'manifest':
+        # Metadata lives behind the base URI, so only token ids are needed
+        token_data = [{'tokenId': data['tokenId'], 'metadata': {}} for data in token_data]
+    if mint_mode == 'consecutive' and metadata_storage == 'manifest':
+        # Tokens were minted at deployment and need no URIs, only a base URI update
+        return []
+    if mint_mode == 'single':
+        return [[data] for data in token_data]
+    return chunk_token_data(token_data, batch_gas_limit, metadata_storage)
+
+def create_script_mint(contract_name, to_address, token_data, mint_mode='single', batch_gas_limit=DEFAULT_BATCH_GAS_LIMIT, pipeline_window=1, fee_policy=None, metadata_storage='onchain', base_uri=None, network_choice=None, reconcile_ids=None, mint_accounts=1):
     # Ensure token_data is a non-empty list
     if not token_data or not isinstance(token_data, list):
         print("Error: token_data is not defined or not a list.")
         sys.exit(1)
 
-    mint_script = f"""
-const {contract_name} = artifacts.require('{contract_name}');
+    if mint_mode not in MINT_MODES:
+        print(f"Error: unknown mint mode \"{mint_mode}\". Choose one of {', '.join(MINT_MODES)}.")
+        sys.exit(1)
 
-module.exports = async function(callback) {{
-    const contractInstance = await {contract_name}.deployed();
-    const tokenData = {json.dumps(token_data)};
-    const toAddress = '{to_address}';
-    for (const data of tokenData) {{
-        try {{
-            const tokenId = data.tokenId;
-            const tokenMetadata = data.metadata;
-            const tokenURI = JSON.stringify(tokenMetadata);
+    token_chunks = build_token_chunks(token_data, mint_mode, batch_gas_limit, metadata_storage)
+    method = MINT_METHODS[mint_mode]
+    call_args = MANIFEST_CALL_ARGS.get(mint_mode, '[]') if metadata_storage == 'manifest' else MINT_CALL_ARGS[mint_mode]
+
+    # Point an existing contract at the current manifest before minting
+    base_uri_update = ""
+    if base_uri:
+        base_uri_update = f"""
+    const baseURI = {json.dumps(base_uri)};
+    if ((await contractInstance.baseURI()) !== baseURI) {{
+        console.log('Updating base URI to', baseURI);
+        await contractInstance.setBaseURI(baseURI);
+    }}
+"""
+
+    # In consecutive mode every token exists from deployment, so ownerOf says nothing about progress
+    reconcile = ""
+    if reconcile_ids and mint_mode != 'consecutive':
+        reconcile = f"""
+    const alreadyMinted = await reconcileMinted(tokenId => contractInstance.ownerOf(tokenId), {json.dumps(sorted(reconcile_ids))});
+    if (alreadyMinted.size) {{
+        console.log('Already minted on chain:', [...alreadyMinted].join(','));
+        recordJournal([...alreadyMinted], 'confirmed', Object.assign({{ reconciled: true }}, journalFields));
+        tokenChunks = tokenChunks.map(chunk => chunk.filter(data => !alreadyMinted.has(data.tokenId))).filter(chunk => chunk.length);
+    }}
+"""
 
-            console.log('Minting token id ', tokenId, ' to ', toAddress);
-            const tx = await contractInstance.mint(toAddress, tokenId, tokenURI);
+    # truffle's sequential sends only know the static gas price from the config and the first
+    # account, so EIP-1559 fees, stuck-transaction replacement and sharding go through the
+    # pipeline even with a window of 1
+    use_pipeline = pipeline_window > 1 or (fee_policy or {}).get('strategy') == 'eip1559' or mint_accounts > 1
+    if use_pipeline:
+        mint_loop = f"""
+    const contract = new web3.eth.Contract({contract_name}.abi, contractInstance.address);
+    const accounts = (await web3.eth.getAccounts()).slice(0, {int(mint_accounts)});
+    const jobs = tokenChunks.map(chunk => {{
+        const tokenIds = chunk.map(data => data.tokenId);
+        const tokenURIs = chunk.map(data => JSON.stringify(data.metadata));
+        return {{ tokenIds: tokenIds, method: '{method}', args: {call_args} }};
+    }});
+    const summary = await mintSharded(web3, contract, accounts, jobs, {{
+        window: {int(pipeline_window)},
+        feePolicy: {json.dumps(fee_policy)},
+        onSent: (job, hash) => recordJournal(job.tokenIds, 'mint_sent', Object.assign({{ tx: hash }}, journalFields)),
+        onConfirmed: (job, receipt) => recordJournal(job.tokenIds, 'confirmed', Object.assign({{ tx: receipt.transactionHash }}, journalFields))
+    }});
+    mintedCount = summary.mintedCount;
+    totalGasUsed = summary.gasUsed;
+    if (summary.failed.length) {{
+        console.error('Token ids that could not be minted:', summary.failed.join(','));
+    }}"""
+    else:
+        mint_loop = f"""
+    for (const chunk of tokenChunks) {{
+        const tokenIds = chunk.map(data => data.tokenId);
+        const tokenURIs = chunk.map(data => JSON.stringify(data.metadata));
+        const startedAt = Date.now();
+        try {{
+            console.log('Minting token ids ', tokenIds.join(','), ' to ', toAddress);
+            const tx = await contractInstance.{method}(...{call_args})
+                .on('transactionHash', hash => recordJournal(tokenIds, 'mint_sent', Object.assign({{ tx: hash }}, journalFields)));
+            recordJournal(tokenIds, 'confirmed', Object.assign({{ tx: tx.tx }}, journalFields));
+            profileSpan('mint_tx', startedAt, {{ tokens: tokenIds.length, gasUsed: tx.receipt.gasUsed }});
 
             // Log the transaction hash
-            console.log('Transaction hash:', tx.tx, '\\n');
+            console.log('Transaction hash:', tx.tx, ' Gas per token:', Math.round(tx.receipt.gasUsed / tokenIds.length), '\\n');
+            mintedCount += tokenIds.length;
+            totalGasUsed += tx.receipt.gasUsed;
         }} catch (error) {{
+            profileSpan('mint_tx', startedAt, {{ tokens: tokenIds.length, error: 'failed' }});
             console.error('Failed to mint NFT:', error);
         }}
+    }}"""
+
+    mint_script = f"""
+const fs = require('fs');
+const {contract_name} = artifacts.require('{contract_name}');
+const JOURNAL_PATH = {json.dumps(os.path.abspath(JOURNAL_FILE))};
+{MINT_JOURNAL_JS}{JS_COMMON}{MINT_PIPELINE_JS if use_pipeline else ''}
+module.exports = async function(callback) {{
+    // Includes truffle's own startup and network connection
+    profileSpan('script_startup', PROCESS_STARTED_AT, {{ script: {json.dumps(get_mint_script_path(network_choice))} }});
+    const contractInstance = await {contract_name}.deployed();
+    const journalFields = {{ network: {json.dumps(network_choice)}, contract: contractInstance.address }};
+    let tokenChunks = {json.dumps(token_chunks)};
+    const toAddress = '{to_address}';
+    const startedAt = Date.now();
+    let mintedCount = 0;
+    let totalGasUsed = 0;
+{reconcile}{base_uri_update}{mint_loop}
+
+    const elapsedSeconds = (Date.now() - startedAt) / 1000;
+    if (mintedCount > 0) {{
+        console.log('Minted', mintedCount, 'tokens in', elapsedSeconds.toFixed(1), 's:',
+            (mintedCount / elapsedSeconds).toFixed(2), 'tokens/sec,', Math.round(totalGasUsed / mintedCount), 'gas per token');
     }}
     callback();
 }};
 """
 
-    with open('mint.js', 'w') as file:
+    with open(get_mint_script_path(network_choice), 'w') as file:
         file.write(mint_script)
 
-def create_contract_token(token_name, token_symbol, contract_name, creator_earnings):
-    contract_content = f"""
-// SPDX-License-Identifier: MIT
-pragma solidity ^0.8.0;
+def get_mint_script_path(network_choice=None):
+    # One script per network, so truffle can mint on several networks at once
+    return f'mint.{network_choice}.js' if network_choice else 'mint.js'
+
+def create_contract_token(token_name, token_symbol, contract_name, creator_earnings, mint_mode='single', first_token_id=0, metadata_storage='onchain'):
+    consecutive = mint_mode == 'consecutive'
+    lazy = mint_mode == 'lazy'
+    manifest = metadata_storage == 'manifest'
 
-import "@openzeppelin/contracts/token/ERC721/extensions/ERC721Royalty.sol";
-import "@openzeppelin/contracts/access/Ownable.sol";
+    def store_uri(token_id, token_uri):
+        # Statement that records a token URI in the chosen storage layout
+        if metadata_storage == 'sstore2':
+            return f"_tokenURIPointers[{token_id}] = _writeData(bytes({token_uri}));"
+        return f"_tokenURIs[{token_id}] = {token_uri};"
 
-contract {contract_name} is ERC721Royalty, Ownable {{
-    mapping(uint256 => string) private _tokenURIs;
-    constructor() ERC721("{token_name}", "{token_symbol}") Ownable(msg.sender) {{}}
+    imports = ['"@openzeppelin/contracts/token/ERC721/extensions/ERC721Royalty.sol"']
+    bases = ['ERC721Royalty']
+    if consecutive:
+        imports.append('"@openzeppelin/contracts/token/ERC721/extensions/ERC721Consecutive.sol"')
+        bases.append('ERC721Consecutive')
+    if lazy:
+        imports.append('"@openzeppelin/contracts/utils/cryptography/EIP712.sol"')
+        imports.append('"@openzeppelin/contracts/utils/cryptography/ECDSA.sol"')
+        bases.append('EIP712')
+    imports.append('"@openzeppelin/contracts/access/Ownable.sol"')
+    bases.append('Ownable')
 
-    function mint(address to, uint256 tokenId, string memory newTokenURI) public onlyOwner {{
-        _mint(to, tokenId);
-        _tokenURIs[tokenId] = newTokenURI;
-        _setTokenRoyalty(tokenId, msg.sender, {creator_earnings});
+    if manifest:
+        state = "    string private _baseTokenURI;"
+    elif metadata_storage == 'sstore2':
+        state = "    mapping(uint256 => address) private _tokenURIPointers;"
+    else:
+        state = "    mapping(uint256 => string) private _tokenURIs;"
+    # Accounts besides the owner that may mint, so minting can be sharded over several nonces
+    state += """
+    mapping(address => bool) private _minters;
+
+    modifier onlyMinter() {
+        require(msg.sender == owner() || _minters[msg.sender], "Caller is not a minter");
+        _;
+    }"""
+    if lazy:
+        # Must match the struct hash that sign_vouchers computes
+        fields = get_voucher_fields(metadata_storage)
+        state += f"""
+
+    struct NFTVoucher {{
+{chr(10).join(f"        {field_type} {name};" for name, field_type in fields)}
     }}
 
-    function tokenURI(uint256 tokenId) public view override returns (string memory) {{
+    bytes32 private constant VOUCHER_TYPEHASH = keccak256("{get_voucher_type(metadata_storage)}");"""
+
+    # ERC721Consecutive only allows batch minting during construction, so in consecutive mode
+    # the whole collection is minted by the constructor with ERC-2309 ConsecutiveTransfer events
+    constructor_params = []
+    constructor_body = []
+    if consecutive:
+        constructor_params.append("address to, uint96 quantity")
+        constructor_body.append(f"""        _setDefaultRoyalty(msg.sender, {creator_earnings});
+        while (quantity > 0) {{
+            uint96 batchSize = quantity > _maxBatchSize() ? _maxBatchSize() : quantity;
+            _mintConsecutive(to, batchSize);
+            quantity -= batchSize;
+        }}""")
+    if manifest:
+        constructor_params.append("string memory baseTokenURI")
+        constructor_body.append("        _baseTokenURI = baseTokenURI;")
+    # Vouchers are signed for the EIP-712 domain of the token name, see get_voucher_domain
+    eip712 = f' EIP712("{token_name}", "{VOUCHER_DOMAIN_VERSION}")' if lazy else ''
+    if constructor_body:
+        constructor = f"""    constructor({', '.join(constructor_params)}) ERC721("{token_name}", "{token_symbol}"){eip712} Ownable(msg.sender) {{
+{chr(10).join(constructor_body)}
+    }}"""
+    else:
+        constructor = f"""    constructor() ERC721("{token_name}", "{token_symbol}"){eip712} Ownable(msg.sender) {{}}"""
+
+    uri_param = "" if manifest else ", string memory newTokenURI"
+    uri_statement = "" if manifest else f"\n        {store_uri('tokenId', 'newTokenURI')}"
+    # Royalties go to the owner whichever minter sends the transaction
+    functions = [f"""    function mint(address to, uint256 tokenId{uri_param}) public onlyMinter {{
+        _mint(to, tokenId);{uri_statement}
+        _setTokenRoyalty(tokenId, owner(), {creator_earnings});
+    }}"""]
+
+    if mint_mode == 'batch':
+        uris_param = "" if manifest else ", string[] calldata newTokenURIs"
+        length_check = "" if manifest else """
+        require(tokenIds.length == newTokenURIs.length, "Token ids and URIs length mismatch");"""
+        uri_statement = "" if manifest else f"\n            {store_uri('tokenIds[i]', 'newTokenURIs[i]')}"
+        functions.append(f"""    function mintBatch(address to, uint256[] calldata tokenIds{uris_param}) public onlyMinter {{{length_check}
+        address royaltyReceiver = owner();
+        for (uint256 i = 0; i < tokenIds.length; i++) {{
+            _mint(to, tokenIds[i]);{uri_statement}
+            _setTokenRoyalty(tokenIds[i], royaltyReceiver, {creator_earnings});
+        }}
+    }}""")
+
+    if lazy:
+        # Anyone holding a voucher signed by the owner or a minter can mint its token to
+        # themselves, paying at least minPrice, which is forwarded to the owner
+        hash_fields = ", ".join(f"keccak256(bytes(voucher.{name}))" if field_type == 'string' else f"voucher.{name}" for name, field_type in fields)
+        uri_statement = "" if manifest else f"\n        {store_uri('voucher.tokenId', 'voucher.uri')}"
+        functions.append(f"""    function redeem(NFTVoucher calldata voucher, bytes calldata signature) public payable returns (uint256) {{
+        bytes32 digest = _hashTypedDataV4(keccak256(abi.encode(VOUCHER_TYPEHASH, {hash_fields})));
+        require(isMinter(ECDSA.recover(digest, signature)), "Invalid voucher signature");
+        require(msg.value >= voucher.minPrice, "Insufficient payment");
+        _mint(msg.sender, voucher.tokenId);{uri_statement}
+        _setTokenRoyalty(voucher.tokenId, owner(), {creator_earnings});
+        if (msg.value > 0) {{
+            (bool sent, ) = payable(owner()).call{{value: msg.value}}("");
+            require(sent, "Payment transfer failed");
+        }}
+        return voucher.tokenId;
+    }}""")
+
+    functions.append("""    function setMinter(address account, bool allowed) public onlyOwner {
+        _minters[account] = allowed;
+    }
+
+    function isMinter(address account) public view returns (bool) {
+        return account == owner() || _minters[account];
+    }""")
+
+    if consecutive and not manifest:
+        functions.append(f"""    function setTokenURIs(uint256[] calldata tokenIds, string[] calldata newTokenURIs) public onlyMinter {{
+        require(tokenIds.length == newTokenURIs.length, "Token ids and URIs length mismatch");
+        for (uint256 i = 0; i < tokenIds.length; i++) {{
+            require(_ownerOf(tokenIds[i]) != address(0), "ERC721: URI set of nonexistent token");
+            {store_uri('tokenIds[i]', 'newTokenURIs[i]')}
+        }}
+    }}""")
+
+    if manifest:
+        # The inherited tokenURI returns baseURI + tokenId, which resolves through the Arweave path manifest
+        functions.append("""    function baseURI() public view returns (string memory) {
+        return _baseTokenURI;
+    }
+
+    function setBaseURI(string memory newBaseURI) public onlyOwner {
+        _baseTokenURI = newBaseURI;
+    }
+
+    function _baseURI() internal view override returns (string memory) {
+        return _baseTokenURI;
+    }""")
+    elif metadata_storage == 'sstore2':
+        # SSTORE2: each URI is deployed as the code of a data contract, which is far cheaper
+        # per byte than storage slots. The code starts with STOP so it can never be executed.
+        functions.append("""    function tokenURI(uint256 tokenId) public view override returns (string memory) {
+        require(ownerOf(tokenId) != address(0), "ERC721: query for nonexistent token");
+        address pointer = _tokenURIPointers[tokenId];
+        if (pointer == address(0)) {
+            return "";
+        }
+        return string(_readData(pointer));
+    }
+
+    function _writeData(bytes memory data) private returns (address pointer) {
+        bytes memory runtimeCode = abi.encodePacked(hex"00", data);
+        bytes memory creationCode = abi.encodePacked(hex"63", uint32(runtimeCode.length), hex"80600E6000396000F3", runtimeCode);
+        assembly {
+            pointer := create(0, add(creationCode, 32), mload(creationCode))
+        }
+        require(pointer != address(0), "Metadata write failed");
+    }
+
+    function _readData(address pointer) private view returns (bytes memory data) {
+        uint256 size = pointer.code.length - 1;
+        data = new bytes(size);
+        assembly {
+            extcodecopy(pointer, add(data, 32), 1, size)
+        }
+    }""")
+    else:
+        functions.append("""    function tokenURI(uint256 tokenId) public view override returns (string memory) {
         require(ownerOf(tokenId) != address(0), "ERC721: query for nonexistent token");
         return _tokenURIs[tokenId];
+    }""")
+
+    if consecutive:
+        functions.append(f"""    function _firstConsecutiveId() internal pure override returns (uint96) {{
+        return {first_token_id};
+    }}
+
+    function _ownerOf(uint256 tokenId) internal view override(ERC721, ERC721Consecutive) returns (address) {{
+        return super._ownerOf(tokenId);
     }}
+
+    function _update(address to, uint256 tokenId, address auth) internal override(ERC721, ERC721Consecutive) returns (address) {{
+        return super._update(to, tokenId, auth);
+    }}
+
+    function supportsInterface(bytes4 interfaceId) public view override(ERC721, ERC721Royalty) returns (bool) {{
+        return super.supportsInterface(interfaceId);
+    }}""")
+
+    import_lines = "\n".join(f"import {path};" for path in imports)
+    function_block = "\n\n".join(functions)
+    contract_content = f"""
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.0;
+
+{import_lines}
+
+contract {contract_name} is {', '.join(bases)} {{
+{state}
+{constructor}
+
+{function_block}
 }}
 """
-    
+
+    write_contract_file(contract_name, contract_content)
+
+def generate_token_contract(contract_name, token_name, token_symbol, creator_earnings, to_address, token_data, mint_mode='single', metadata_storage='onchain', base_uri=None):
+    # Writes the contract and its migration, and returns the constructor arguments
+    constructor_args = []
+    first_token_id = 0
+    if mint_mode == 'consecutive':
+        # The whole collection is minted to to_address by the constructor
+        first_token_id, quantity = get_consecutive_range(token_data)
+        constructor_args = [to_address, quantity]
+    if metadata_storage == 'manifest':
+        constructor_args.append(base_uri)
+    create_contract_token(token_name, token_symbol, contract_name, creator_earnings, mint_mode, first_token_id, metadata_storage)
+    create_script_deploy_contracts(contract_name, constructor_args)
+    return constructor_args
+
+def write_contract_file(contract_name, contract_content):
     contracts_dir = './contracts'
     os.makedirs(contracts_dir, exist_ok=True)
     contract_file_path = os.path.join(contracts_dir, f'{contract_name}.sol')
@@ -396,164 +1552,2513 @@ contract {contract_name} is ERC721Royalty, Ownable {{
         file.write(contract_content)
     print(f"Contract {contract_file_path} created successfully.")
 
-def create_contract_migrations():
-    contract_content = """
-    // SPDX-License-Identifier: MIT
-    pragma solidity >=0.4.21 <0.9.0;
+def parse_arweave_gateway(gateway):
+    # Split a gateway URL such as "http://localhost:1984" into the parts Arweave.init expects
+    parsed = urlparse(gateway)
+    protocol = parsed.scheme or 'https'
+    port = parsed.port or (443 if protocol == 'https' else 80)
+    return {"host": parsed.hostname, "port": port, "protocol": protocol}
 
-    contract Migrations {
-        address public owner;
-        uint public last_completed_migration;
+ARWEAVE_UPLOAD_JS = """
+const { createHash } = require('crypto');
+const merkle = require('arweave/node/lib/merkle');
+const Transaction = require('arweave/node/lib/transaction').default;
+const RETRY_BASE_DELAY_MS = 1000;
+const CHUNK_RETRIES = 5;
+// Upper bound on what ANS-104 adds per item: signature, owner, tags and the bundle index entry
+const DATA_ITEM_OVERHEAD = 1200;
 
-        modifier restricted() {
-            require(msg.sender == owner, "This function is restricted to the contract's owner");
-            _;
+// Counting semaphore shared by all workers so the number of chunk requests in flight stays capped
+function createSemaphore(limit) {
+    let active = 0;
+    const waiting = [];
+    return {
+        async acquire() {
+            if (active < limit) {
+                active++;
+                return;
+            }
+            await new Promise(resolve => waiting.push(resolve));
+        },
+        release() {
+            const next = waiting.shift();
+            if (next) {
+                next();
+            } else {
+                active--;
+            }
         }
+    };
+}
 
-        constructor() {
-            owner = msg.sender;
-        }
+// Set by main.py for jobs under --jobs (ARWEAVE_RATE_ENV_VAR): this process's share of the queue's
+// request rate to the gateway
+const ARWEAVE_REQUESTS_PER_SECOND = Number(process.env.MINT_ARWEAVE_REQUESTS_PER_SECOND) || 0;
 
-        function setCompleted(uint completed) public restricted {
-            last_completed_migration = completed;
-        }
+// Spaces out every GET and POST the arweave client sends (prices, transactions, chunks and
+// status checks) to at most requestsPerSecond
+function throttleArweaveApi(api, requestsPerSecond) {
+    const interval = 1000 / requestsPerSecond;
+    let nextSlot = 0;
+    for (const method of ['get', 'post']) {
+        const send = api[method].bind(api);
+        api[method] = async (...args) => {
+            const now = Date.now();
+            const slot = Math.max(now, nextSlot);
+            nextSlot = slot + interval;
+            if (slot > now) {
+                await sleep(slot - now);
+            }
+            return send(...args);
+        };
+    }
+}
 
-        function upgrade(address new_address) public restricted {
-            Migrations upgraded = Migrations(new_address);
-            upgraded.setCompleted(last_completed_migration);
+// Chunk layout of arweave's merkle.chunkData, derived from the size alone: 256 KiB chunks,
+// except that the last two are evened out when the final one would be under 32 KiB
+function chunkRanges(size) {
+    const ranges = [];
+    let cursor = 0;
+    while (size - cursor >= merkle.MAX_CHUNK_SIZE) {
+        let chunkSize = merkle.MAX_CHUNK_SIZE;
+        const nextChunkSize = size - cursor - merkle.MAX_CHUNK_SIZE;
+        if (nextChunkSize > 0 && nextChunkSize < merkle.MIN_CHUNK_SIZE) {
+            chunkSize = Math.ceil((size - cursor) / 2);
         }
+        ranges.push([cursor, cursor + chunkSize]);
+        cursor += chunkSize;
     }
-    """
+    ranges.push([cursor, size]);
+    return ranges;
+}
 
-    # Write the contract to a .sol file in the contracts directory
-    contracts_dir = './contracts'
-    os.makedirs(contracts_dir, exist_ok=True)  # Ensure the contracts directory exists
-    contract_file_path = os.path.join(contracts_dir, 'Migrations.sol')
+async function readRange(fileHandle, range) {
+    const buffer = Buffer.allocUnsafe(range[1] - range[0]);
+    const { bytesRead } = await fileHandle.read(buffer, 0, buffer.length, range[0]);
+    if (bytesRead !== buffer.length) {
+        throw new Error(`Short read at offset ${range[0]}: file changed during upload`);
+    }
+    return buffer;
+}
 
-    with open(contract_file_path, 'w', encoding='utf-8') as file:
-        file.write(contract_content)
-    print(f"Migrations contract created successfully at {contract_file_path}")
+// Same result as merkle.generateTransactionChunks, but each chunk is read from disk, hashed
+// and dropped, so only the tree of hashes stays in memory
+async function streamTransactionChunks(fileHandle, size) {
+    const chunks = [];
+    for (const range of chunkRanges(size)) {
+        const data = await readRange(fileHandle, range);
+        chunks.push({ dataHash: createHash('sha256').update(data).digest(), minByteRange: range[0], maxByteRange: range[1] });
+    }
+    const root = await merkle.buildLayers(await merkle.generateLeaves(chunks));
+    const proofs = merkle.generateProofs(root);
+    // A zero-length last chunk is part of the root but is never uploaded
+    const lastChunk = chunks[chunks.length - 1];
+    if (lastChunk.maxByteRange === lastChunk.minByteRange) {
+        chunks.pop();
+        proofs.pop();
+    }
+    return { data_root: root.id, chunks: chunks, proofs: proofs };
+}
 
-def create_script_arweave(files_to_upload):
-    files_with_types = [{"path": file_path, "type": content_type} for file_path, content_type in files_to_upload]
+async function postChunk(arweave, transaction, fileHandle, index) {
+    const chunk = transaction.chunks.chunks[index];
+    const proof = transaction.chunks.proofs[index];
+    const data = await readRange(fileHandle, [chunk.minByteRange, chunk.maxByteRange]);
+    const body = {
+        data_root: transaction.data_root,
+        data_size: transaction.data_size,
+        data_path: Arweave.utils.bufferTob64Url(proof.proof),
+        offset: proof.offset.toString(),
+        chunk: Arweave.utils.bufferTob64Url(data)
+    };
+    const startedAt = Date.now();
+    for (let attempt = 0; ; attempt++) {
+        let response;
+        try {
+            response = await arweave.api.post('chunk', body);
+        } catch (error) {
+            response = { status: 0, data: error.message || String(error) };
+        }
+        if (response.status === 200) {
+            profileSpan('upload_chunk', startedAt, { bytes: data.length, attempts: attempt + 1 });
+            return;
+        }
+        if (attempt >= CHUNK_RETRIES) {
+            throw new Error(`Chunk ${index} of ${transaction.id} failed with status ${response.status}: ${JSON.stringify(response.data)}`);
+        }
+        await sleep(RETRY_BASE_DELAY_MS * 2 ** attempt);
+    }
+}
 
-    arweave_script = f"""
-const Arweave = require('arweave');
-const fs = require('fs');
-require('dotenv').config();
+// Uploads a large file without reading it into memory: the data root is built from streamed
+// chunk hashes, the header is posted without data, and chunks are read back from disk one at
+// a time as they are posted. Memory use is bounded by the chunks in flight.
+async function uploadFileStreamed(arweave, arweaveKey, fileInfo, chunkSlots, size) {
+    const fileHandle = await fs.promises.open(fileInfo.path, 'r');
+    try {
+        const transactionChunks = await streamTransactionChunks(fileHandle, size);
+        // createTransaction insists on the data itself, so the header is built directly, as
+        // arweave-stream-tx does, from the data root and size computed while streaming
+        const transaction = new Transaction({
+            format: 2,
+            owner: arweaveKey.n,
+            last_tx: await arweave.transactions.getTransactionAnchor(),
+            reward: await arweave.transactions.getPrice(size),
+            data_size: size.toString(),
+            data_root: Arweave.utils.bufferTob64Url(transactionChunks.data_root),
+        });
+        transaction.chunks = transactionChunks;
+        transaction.addTag('Content-Type', fileInfo.type);
+        await arweave.transactions.sign(transaction, arweaveKey);
 
-async function uploadImages(files) {{
-    const arweave = Arweave.init({{ host: 'arweave.net', port: 443, protocol: 'https' }});
+        const response = await arweave.api.post('tx', transaction);
+        if (response.status !== 200 && response.status !== 208) {
+            throw new Error(`Posting transaction header failed with status ${response.status}: ${JSON.stringify(response.data)}`);
+        }
 
-    let arweaveKey = JSON.parse(process.env.ARWEAVE_KEY);
-    let uploaded = [];
+        const posts = [];
+        let failed = false;
+        for (let index = 0; index < transaction.chunks.chunks.length && !failed; index++) {
+            await chunkSlots.acquire();
+            const post = postChunk(arweave, transaction, fileHandle, index).finally(() => chunkSlots.release());
+            // Stop queueing chunks once one has failed for good; Promise.all below reports the error
+            post.catch(() => { failed = true; });
+            posts.push(post);
+        }
+        await Promise.all(posts);
+        return transaction.id;
+    } finally {
+        await fileHandle.close();
+    }
+}
 
-    for (let fileInfo of files) {{
-        try {{
-            const data = fs.readFileSync(fileInfo.path);
-            let transaction = await arweave.createTransaction({{ data: data }}, arweaveKey);
-            transaction.addTag('Content-Type', fileInfo.type);
-            await arweave.transactions.sign(transaction, arweaveKey);
-
-            let uploader = await arweave.transactions.getUploader(transaction);
-            while (!uploader.isComplete) {{
-                await uploader.uploadChunk();
-            }}
-            uploaded.push({{file: fileInfo.path, id: transaction.id}});
-        }} catch (error) {{
-            console.error('Error uploading file:', fileInfo.path, error);
-        }}
-    }}
-    return uploaded;
-}}
+async function uploadTransaction(arweave, transaction, chunkSlots) {
+    let uploader = await arweave.transactions.getUploader(transaction);
+    while (!uploader.isComplete) {
+        await chunkSlots.acquire();
+        const chunk = transaction.chunks.chunks[uploader.uploadedChunks];
+        const startedAt = Date.now();
+        try {
+            await uploader.uploadChunk();
+        } finally {
+            chunkSlots.release();
+        }
+        profileSpan('upload_chunk', startedAt, { bytes: chunk ? chunk.maxByteRange - chunk.minByteRange : 0 });
+    }
+}
+
+async function uploadFile(arweave, arweaveKey, fileInfo, chunkSlots, size, streamThreshold) {
+    if (size >= streamThreshold) {
+        return uploadFileStreamed(arweave, arweaveKey, fileInfo, chunkSlots, size);
+    }
+    const data = fs.readFileSync(fileInfo.path);
+    let transaction = await arweave.createTransaction({ data: data }, arweaveKey);
+    transaction.addTag('Content-Type', fileInfo.type);
+    await arweave.transactions.sign(transaction, arweaveKey);
+    await uploadTransaction(arweave, transaction, chunkSlots);
+    return transaction.id;
+}
+
+// ANS-104: every file becomes a signed data item and all of them are posted as one bundle
+// transaction. Returns the data item ids in file order; gateways serve each item by its id.
+async function uploadBundle(arweave, arweaveKey, bundleFiles, chunkSlots) {
+    // Only needed when bundling is enabled
+    const { ArweaveSigner, bundleAndSignData, createData } = require('arbundles');
+    const signer = new ArweaveSigner(arweaveKey);
+    const items = bundleFiles.map(fileInfo => createData(fs.readFileSync(fileInfo.path), signer, { tags: [{ name: 'Content-Type', value: fileInfo.type }] }));
+    const bundle = await bundleAndSignData(items, signer);
+    const transaction = await bundle.toTransaction({}, arweave, arweaveKey);
+    await arweave.transactions.sign(transaction, arweaveKey);
+    await uploadTransaction(arweave, transaction, chunkSlots);
+    console.error(`Bundle ${transaction.id}: ${bundleFiles.length} files, ${transaction.data_size} bytes`);
+    return bundle.getIds();
+}
+
+async function uploadWithRetry(description, maxRetries, upload) {
+    for (let attempt = 0; ; attempt++) {
+        try {
+            return await upload();
+        } catch (error) {
+            if (attempt >= maxRetries) {
+                throw error;
+            }
+            // Exponential backoff with jitter so failing workers don't retry in lockstep
+            const delay = RETRY_BASE_DELAY_MS * 2 ** attempt + Math.floor(Math.random() * RETRY_BASE_DELAY_MS);
+            console.error(`Retrying ${description} in ${delay}ms (attempt ${attempt + 1} of ${maxRetries}):`, error.message || error);
+            await sleep(delay);
+        }
+    }
+}
+
+// Groups file indexes into upload units. With options.bundleMaxBytes set, files under
+// options.bundleItemMaxBytes are packed in order into bundles of at most bundleMaxBytes;
+// every other file is uploaded on its own.
+function planUploads(files, sizes, options) {
+    const units = [];
+    let bundle = null;
+    for (let index = 0; index < files.length; index++) {
+        if (!options.bundleMaxBytes || sizes[index] >= options.bundleItemMaxBytes) {
+            units.push({ indexes: [index], bundled: false });
+            continue;
+        }
+        const itemBytes = sizes[index] + DATA_ITEM_OVERHEAD;
+        if (!bundle || bundle.bytes + itemBytes > options.bundleMaxBytes) {
+            bundle = { indexes: [], bundled: true, bytes: 0 };
+            units.push(bundle);
+        }
+        bundle.indexes.push(index);
+        bundle.bytes += itemBytes;
+    }
+    return units;
+}
+
+// Uploads files ({path, type}) with options.concurrency workers and at most
+// options.maxInflightChunks chunk requests in flight. Files of options.streamThreshold bytes
+// or more are streamed from disk, and small files may be bundled (see planUploads).
+// options.onUploaded({file, id}) is called as each file finishes.
+async function uploadImages(files, options) {
+    const arweave = Arweave.init(options.gateway);
+    if (ARWEAVE_REQUESTS_PER_SECOND) {
+        throttleArweaveApi(arweave.api, ARWEAVE_REQUESTS_PER_SECOND);
+    }
+
+    let arweaveKey = JSON.parse(process.env.ARWEAVE_KEY);
+    const chunkSlots = createSemaphore(Math.max(1, options.maxInflightChunks));
+    const sizes = files.map(fileInfo => fs.statSync(fileInfo.path).size);
+    const units = planUploads(files, sizes, options);
+    const results = new Array(files.length);
+    let nextUnit = 0;
+
+    async function worker() {
+        while (nextUnit < units.length) {
+            const unit = units[nextUnit++];
+            const unitFiles = unit.indexes.map(index => files[index]);
+            const description = unit.bundled ? `bundle of ${unitFiles.length} files starting at ${unitFiles[0].path}` : unitFiles[0].path;
+            const unitFields = { files: unitFiles.length, bytes: unit.indexes.reduce((total, index) => total + sizes[index], 0) };
+            const startedAt = Date.now();
+            try {
+                const ids = await uploadWithRetry(description, options.maxRetries, async () => {
+                    if (unit.bundled) {
+                        return uploadBundle(arweave, arweaveKey, unitFiles, chunkSlots);
+                    }
+                    return [await uploadFile(arweave, arweaveKey, unitFiles[0], chunkSlots, sizes[unit.indexes[0]], options.streamThreshold)];
+                });
+                profileSpan(unit.bundled ? 'upload_bundle' : 'upload_file', startedAt, unitFields);
+                unit.indexes.forEach((index, position) => {
+                    results[index] = {file: files[index].path, id: ids[position]};
+                    if (options.onUploaded) {
+                        options.onUploaded(results[index]);
+                    }
+                });
+            } catch (error) {
+                profileSpan(unit.bundled ? 'upload_bundle' : 'upload_file', startedAt, Object.assign({ error: 'failed' }, unitFields));
+                console.error('Error uploading', description, error);
+            }
+        }
+    }
+
+    const workers = [];
+    for (let i = 0; i < Math.min(Math.max(1, options.concurrency), units.length); i++) {
+        workers.push(worker());
+    }
+    await Promise.all(workers);
 
-uploadImages({json.dumps(files_with_types)}).then(uploaded => console.log(JSON.stringify(uploaded))).catch(console.error);
+    // Keep the original file order and drop files that failed every attempt
+    return results.filter(result => result !== undefined);
+}
+"""
+
+def get_arweave_upload_options(concurrency=1, max_inflight_chunks=8, max_retries=3, gateway=DEFAULT_ARWEAVE_GATEWAY, bundle_max_bytes=0):
+    return {
+        "concurrency": max(1, int(concurrency)),
+        "maxInflightChunks": max(1, int(max_inflight_chunks)),
+        "maxRetries": max(0, int(max_retries)),
+        "gateway": parse_arweave_gateway(gateway),
+        "streamThreshold": STREAM_UPLOAD_THRESHOLD,
+        "bundleMaxBytes": max(0, int(bundle_max_bytes)),
+        "bundleItemMaxBytes": BUNDLE_ITEM_MAX_SIZE,
+    }
+
+def create_script_arweave(files_to_upload, concurrency=1, max_inflight_chunks=8, max_retries=3, gateway=DEFAULT_ARWEAVE_GATEWAY, bundle_max_bytes=0):
+    files_with_types = [{"path": file_path, "type": content_type} for file_path, content_type in files_to_upload]
+    upload_options = get_arweave_upload_options(concurrency, max_inflight_chunks, max_retries, gateway, bundle_max_bytes)
+
+    arweave_script = f"""
+const Arweave = require('arweave');
+const fs = require('fs');
+require('dotenv').config();
+{JS_COMMON}{ARWEAVE_UPLOAD_JS}
+profileSpan('script_startup', PROCESS_STARTED_AT, {{ script: 'upload_to_arweave.js' }});
+uploadImages({json.dumps(files_with_types)}, {json.dumps(upload_options)}).then(uploaded => console.log(JSON.stringify(uploaded))).catch(console.error);
 """
 
     with open('upload_to_arweave.js', 'w') as file:
         file.write(arweave_script)
 
-def upload_to_arweave(files_to_upload, images_directory):
-    create_script_arweave(files_to_upload)
+def hash_file(file_path, block_size=1024 * 1024):
+    # Stream the file through the hash so large media never has to fit in memory
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_upload_cache():
+    # Cache layout: {gateway: {sha256 of file content: Arweave transaction id}}
+    try:
+        with open(UPLOAD_CACHE_FILE, 'r') as cache_file:
+            return json.load(cache_file)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        print(f"Upload cache '{UPLOAD_CACHE_FILE}' is not valid JSON. Ignoring it.")
+        return {}
+
+def save_upload_cache(cache):
+    # Write to a temporary file first so a crash never leaves a truncated cache behind
+    temp_path = f"{UPLOAD_CACHE_FILE}.tmp"
+    with open(temp_path, 'w') as cache_file:
+        json.dump(cache, cache_file, indent=4)
+    os.replace(temp_path, UPLOAD_CACHE_FILE)
+
+def optimize_png(data):
+    # Lossless: metadata chunks are dropped and the image data is recompressed at the highest
+    # zlib level with each strategy, keeping the smallest. The pixels and filters are unchanged.
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+    chunks = []
+    image_data = []
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(data):
+        length, chunk_type = struct.unpack_from('>I4s', data, offset)
+        body = data[offset + 8:offset + 8 + length]
+        offset += 12 + length
+        if chunk_type == b'IDAT':
+            if not image_data:
+                chunks.append((chunk_type, None))
+            image_data.append(body)
+        elif chunk_type not in PNG_STRIPPED_CHUNKS:
+            chunks.append((chunk_type, body))
+        if chunk_type == b'IEND':
+            break
+    if not image_data:
+        return data
+
+    raw = zlib.decompress(b''.join(image_data))
+    candidates = []
+    for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+        candidates.append(compressor.compress(raw) + compressor.flush())
+    compressed = min(candidates, key=len)
+
+    output = [PNG_SIGNATURE]
+    for chunk_type, body in chunks:
+        body = compressed if body is None else body
+        output.append(struct.pack('>I4s', len(body), chunk_type) + body + struct.pack('>I', zlib.crc32(chunk_type + body)))
+    optimized = b''.join(output)
+    return optimized if len(optimized) < len(data) else data
+
+def optimize_jpeg(file_path):
+    # jpegtran rewrites the Huffman tables without touching the image; skipped when not installed
+    if not shutil.which('jpegtran'):
+        return None
+    completed = subprocess.run(['jpegtran', '-copy', 'all', '-optimize', file_path], capture_output=True)
+    return completed.stdout if completed.returncode == 0 and completed.stdout else None
+
+SVG_COMMENT_REGEX = re.compile(rb'<!--.*?-->', re.DOTALL)
+SVG_TAG_GAP_REGEX = re.compile(rb'>\s+<')
+# Whitespace between tags is significant inside these
+SVG_TEXT_REGEX = re.compile(rb'<(?:text|tspan|textPath|style|script)\b|xml:space')
+
+def minify_svg(data):
+    # Comments and whitespace between tags only. The result must still parse, or the original is kept.
+    if b'<![CDATA[' in data:
+        return data
+    minified = SVG_COMMENT_REGEX.sub(b'', data).strip()
+    if not SVG_TEXT_REGEX.search(minified):
+        minified = SVG_TAG_GAP_REGEX.sub(b'><', minified)
+    try:
+        ElementTree.fromstring(minified)
+    except ElementTree.ParseError:
+        return data
+    return minified if len(minified) < len(data) else data
+
+def validate_gltf(gltf, bin_length=None):
+    # Returns a description of the first problem found, or None
+    if not str(gltf.get('asset', {}).get('version', '')).startswith('2.'):
+        return "asset.version is not 2.x"
+    buffers = gltf.get('buffers', [])
+    for index, buffer in enumerate(buffers):
+        uri = buffer.get('uri')
+        if uri is None:
+            if index != 0 or bin_length is None:
+                return f"buffer {index} has no uri and there is no binary chunk"
+            if buffer.get('byteLength', 0) > bin_length:
+                return f"buffer {index} is longer than the binary chunk"
+        elif not uri.startswith('data:'):
+            # Only the model file itself is uploaded
+            return f"buffer {index} references external file {uri}"
+    for index, image in enumerate(gltf.get('images', [])):
+        if 'uri' in image and not image['uri'].startswith('data:'):
+            return f"image {index} references external file {image['uri']}"
+    for index, view in enumerate(gltf.get('bufferViews', [])):
+        if view.get('buffer', -1) >= len(buffers) or view.get('buffer', -1) < 0:
+            return f"bufferView {index} points at a missing buffer"
+        if view.get('byteOffset', 0) + view.get('byteLength', 0) > buffers[view['buffer']].get('byteLength', 0):
+            return f"bufferView {index} runs past the end of its buffer"
+    return None
+
+def validate_glb(data):
+    if len(data) < 20 or data[:4] != b'glTF':
+        return "not a binary glTF file"
+    version, length = struct.unpack_from('<II', data, 4)
+    if version != 2:
+        return f"glTF version {version} is not supported"
+    if length != len(data):
+        return f"header length {length} does not match the file size {len(data)}"
+    gltf = None
+    bin_length = None
+    offset = 12
+    while offset < length:
+        if offset + 8 > length:
+            return "truncated chunk header"
+        chunk_length, chunk_type = struct.unpack_from('<II', data, offset)
+        if offset + 8 + chunk_length > length:
+            return "truncated chunk"
+        if gltf is None:
+            if chunk_type != GLB_JSON_CHUNK:
+                return "the first chunk is not JSON"
+            try:
+                gltf = json.loads(data[offset + 8:offset + 8 + chunk_length])
+            except ValueError:
+                return "the JSON chunk is not valid JSON"
+        elif chunk_type == GLB_BIN_CHUNK and bin_length is None:
+            bin_length = chunk_length
+        offset += 8 + chunk_length
+    if gltf is None:
+        return "missing JSON chunk"
+    return validate_gltf(gltf, bin_length)
+
+def preprocess_file(file_path, content_hash):
+    # Runs in a worker process. Writes the optimized file to PREPROCESS_DIR, named by the content
+    # hash of the original, and returns (output name or None when unchanged, error or None).
+    extension = file_path.split('.')[-1].lower()
+    with open(file_path, 'rb') as media_file:
+        data = media_file.read()
+    optimized = data
+    if extension == 'png':
+        try:
+            optimized = optimize_png(data)
+        except (zlib.error, struct.error):
+            return None, "PNG image data could not be decoded"
+    elif extension in ('jpg', 'jpeg'):
+        optimized = optimize_jpeg(file_path) or data
+    elif extension == 'svg':
+        optimized = minify_svg(data)
+    elif extension == 'glb':
+        return None, validate_glb(data)
+    elif extension == 'gltf':
+        try:
+            gltf = json.loads(data)
+        except ValueError:
+            return None, "not valid JSON"
+        error = validate_gltf(gltf)
+        if error:
+            return None, error
+        optimized = json.dumps(gltf, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    if len(optimized) >= len(data):
+        return None, None
+    output_name = f"{content_hash}.{extension}"
+    temp_path = os.path.join(PREPROCESS_DIR, f"{output_name}.tmp")
+    with open(temp_path, 'wb') as output_file:
+        output_file.write(optimized)
+    os.replace(temp_path, os.path.join(PREPROCESS_DIR, output_name))
+    return output_name, None
+
+def load_preprocess_index():
+    # Index layout: {sha256 of original content: {"file": output name or null, "inputBytes", "outputBytes"}}
+    try:
+        with open(PREPROCESS_INDEX_FILE, 'r') as index_file:
+            return json.load(index_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def preprocess_media(files, workers=None):
+    # Shrinks files before upload on a process pool. Returns the files to upload in the same
+    # order, with optimized copies substituted, and {upload path: [original paths]}.
+    os.makedirs(PREPROCESS_DIR, exist_ok=True)
+    index = load_preprocess_index()
+    started = time.perf_counter()
+
+    hashes = [hash_file(file_path) for file_path, _ in files]
+    pending = {}
+    for (file_path, _), content_hash in zip(files, hashes):
+        cached = index.get(content_hash)
+        if cached is None or (cached['file'] and not os.path.exists(os.path.join(PREPROCESS_DIR, cached['file']))):
+            pending.setdefault(content_hash, file_path)
+
+    workers = workers or os.cpu_count() or 1
+    errors = []
+    processed_bytes = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            # Small files are handed out in chunks so process round trips do not dominate
+            chunksize = max(1, len(pending) // (workers * 4))
+            results = executor.map(preprocess_file, pending.values(), pending.keys(), chunksize=chunksize)
+            for (content_hash, file_path), (output_name, error) in zip(pending.items(), results):
+                if error:
+                    errors.append(f"{os.path.basename(file_path)}: {error}")
+                    continue
+                input_bytes = os.path.getsize(file_path)
+                processed_bytes += input_bytes
+                output_bytes = os.path.getsize(os.path.join(PREPROCESS_DIR, output_name)) if output_name else input_bytes
+                index[content_hash] = {"file": output_name, "inputBytes": input_bytes, "outputBytes": output_bytes}
+        temp_path = f"{PREPROCESS_INDEX_FILE}.tmp"
+        with open(temp_path, 'w') as index_file:
+            json.dump(index, index_file, indent=4)
+        os.replace(temp_path, PREPROCESS_INDEX_FILE)
+    if errors:
+        print("Invalid media files:\n  " + "\n  ".join(errors))
+        sys.exit(1)
+
+    upload_files = []
+    original_paths = {}
+    for (file_path, content_type), content_hash in zip(files, hashes):
+        output_name = index[content_hash]['file']
+        upload_path = os.path.abspath(os.path.join(PREPROCESS_DIR, output_name)) if output_name else file_path
+        if upload_path not in original_paths:
+            # The file keeps its format, so the content type of the output matches the original's
+            upload_files.append((upload_path, get_content_type(upload_path) if output_name else content_type))
+        original_paths.setdefault(upload_path, []).append(file_path)
+
+    elapsed = time.perf_counter() - started
+    PROFILER.record('preprocess', time.time() - elapsed, elapsed, files=len(files), bytes=processed_bytes)
+    input_total = sum(index[content_hash]['inputBytes'] for content_hash in set(hashes))
+    output_total = sum(index[content_hash]['outputBytes'] for content_hash in set(hashes))
+    saved = input_total - output_total
+    print(f"Preprocessed {len(files)} file(s), {len(files) - len(pending)} reused: {input_total} -> {output_total} bytes, "
+          f"saved {saved} ({saved / input_total * 100 if input_total else 0:.1f}%).")
+    if pending and elapsed:
+        print(f"Processed {processed_bytes / 1024 / 1024:.1f} MiB in {elapsed:.2f}s on {min(workers, len(pending))} worker(s): "
+              f"{processed_bytes / 1024 / 1024 / elapsed / min(workers, len(pending)):.1f} MiB/s per core.")
+    return upload_files, original_paths
+
+def upload_to_arweave(files_to_upload, images_directory, concurrency=1, max_inflight_chunks=8, max_retries=3, gateway=DEFAULT_ARWEAVE_GATEWAY, bundle_max_bytes=0, sidecar=None):
+    gateway = gateway.rstrip('/')
+    cache = load_upload_cache()
+    gateway_cache = cache.setdefault(gateway, {})
+
+    # Resolve files against the cache and group byte-identical files so each is uploaded once
+    uploaded_urls = {}
+    pending = {}
+    for file_path, content_type in files_to_upload:
+        content_hash = hash_file(file_path)
+        file_name = os.path.basename(file_path)
+        if content_hash in gateway_cache:
+            arweave_url = f"{gateway}/{gateway_cache[content_hash]}"
+            uploaded_urls[os.path.join(images_directory, file_name)] = arweave_url
+            print("Reusing previous upload of", file_name, "from cache:", arweave_url)
+        else:
+            pending.setdefault(content_hash, []).append((file_path, content_type))
+
+    if not pending:
+        return uploaded_urls
+
+    unique_files = [duplicates[0] for duplicates in pending.values()]
+    hash_by_path = {duplicates[0][0]: content_hash for content_hash, duplicates in pending.items()}
     
     try:
-        arweave_output = subprocess.check_output(['node', 'upload_to_arweave.js']).decode('utf-8').strip()
-        uploaded_info = json.loads(arweave_output)
+        if sidecar:
+            progress = {"done": 0}
+            def report_upload(event):
+                progress["done"] += 1
+                print(f"Uploaded {os.path.basename(event['file'])} ({progress['done']}/{len(unique_files)})")
+            uploaded_info = sidecar.call('upload', {
+                "files": [{"path": file_path, "type": content_type} for file_path, content_type in unique_files],
+                "options": get_arweave_upload_options(concurrency, max_inflight_chunks, max_retries, gateway, bundle_max_bytes),
+            }, on_event=report_upload)
+        else:
+            create_script_arweave(unique_files, concurrency, max_inflight_chunks, max_retries, gateway, bundle_max_bytes)
+            with PROFILER.span('upload_script', files=len(unique_files)):
+                arweave_output = subprocess.check_output(['node', 'upload_to_arweave.js']).decode('utf-8').strip()
+            uploaded_info = json.loads(arweave_output)
 
-        uploaded_urls = {}
+        # Record every finished upload before anything else can fail
         for info in uploaded_info:
-            file_name = os.path.basename(info['file'])
-            file_path = os.path.join(images_directory, file_name)
-            arweave_url = f"https://arweave.net/{info['id']}"
-            uploaded_urls[file_path] = arweave_url
-            print("Uploaded", file_name, "to Arweave:", arweave_url)
+            gateway_cache[hash_by_path[info['file']]] = info['id']
+        save_upload_cache(cache)
+
+        for info in uploaded_info:
+            arweave_url = f"{gateway}/{info['id']}"
+            for file_path, _ in pending[hash_by_path[info['file']]]:
+                file_name = os.path.basename(file_path)
+                uploaded_urls[os.path.join(images_directory, file_name)] = arweave_url
+                print("Uploaded", file_name, "to Arweave:", arweave_url)
         return uploaded_urls
     except Exception as e:
         print(f"Failed to upload to Arweave: {e}")
         sys.exit(1)
 
+def upload_metadata_manifest(token_ids, images_directory, concurrency=1, max_inflight_chunks=8, max_retries=3, gateway=DEFAULT_ARWEAVE_GATEWAY, bundle_max_bytes=0, sidecar=None):
+    # Upload each <id>.json and then an Arweave path manifest mapping "<id>" to its transaction,
+    # so "<gateway>/<manifest id>/<id>" serves the metadata and the contract only stores the base URI
+    metadata_files = [(os.path.join(images_directory, f"{token_id}.json"), 'application/json') for token_id in token_ids]
+    uploaded_urls = upload_to_arweave(metadata_files, images_directory, concurrency, max_inflight_chunks, max_retries, gateway, bundle_max_bytes, sidecar)
+
+    paths = {}
+    for token_id, (metadata_path, _) in zip(token_ids, metadata_files):
+        if metadata_path not in uploaded_urls:
+            print(f"Failed to upload metadata for token {token_id}. Aborting manifest creation.")
+            sys.exit(1)
+        paths[str(token_id)] = {"id": uploaded_urls[metadata_path].rsplit('/', 1)[-1]}
+
+    manifest = {"manifest": "arweave/paths", "version": "0.1.0", "paths": paths}
+    with open(MANIFEST_FILE, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+
+    manifest_path = os.path.abspath(MANIFEST_FILE)
+    manifest_urls = upload_to_arweave([(manifest_path, MANIFEST_CONTENT_TYPE)], os.path.dirname(manifest_path), concurrency, max_inflight_chunks, max_retries, gateway, bundle_max_bytes, sidecar)
+    if manifest_path not in manifest_urls:
+        print("Failed to upload metadata manifest.")
+        sys.exit(1)
+    base_uri = f"{manifest_urls[manifest_path]}/"
+    print("Metadata manifest available at", base_uri)
+    return base_uri
+
+def get_compile_cache_key():
+    # Everything the bytecode depends on: the generated sources, the compiler version and the
+    # OpenZeppelin release they import. Constructor arguments are ABI-encoded after the bytecode
+    # at deploy time, and first_token_id is baked into the source, so neither needs its own part.
+    digest = hashlib.sha256()
+    digest.update(f"solc {SOLC_VERSION}\n".encode('utf-8'))
+    try:
+        with open(os.path.join('node_modules', '@openzeppelin', 'contracts', 'package.json'), 'r') as package_file:
+            digest.update(f"openzeppelin {json.load(package_file).get('version')}\n".encode('utf-8'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        digest.update(b"openzeppelin unknown\n")
+    for source_name in sorted(os.listdir('contracts')):
+        if source_name.endswith('.sol'):
+            with open(os.path.join('contracts', source_name), 'rb') as source_file:
+                digest.update(source_name.encode('utf-8') + b"\n" + source_file.read())
+    return digest.hexdigest()
+
+def copy_artifacts(source_directory, target_directory, keep_networks):
+    # keep_networks preserves the deployments already recorded in the target artifacts, the way
+    # truffle compile does when it rewrites them
+    os.makedirs(target_directory, exist_ok=True)
+    for artifact_name in os.listdir(source_directory):
+        if not artifact_name.endswith('.json'):
+            continue
+        with open(os.path.join(source_directory, artifact_name), 'r') as artifact_file:
+            artifact = json.load(artifact_file)
+        artifact['networks'] = {}
+        target_path = os.path.join(target_directory, artifact_name)
+        if keep_networks and os.path.exists(target_path):
+            with open(target_path, 'r') as target_file:
+                artifact['networks'] = json.load(target_file).get('networks', {})
+        with open(target_path, 'w') as target_file:
+            json.dump(artifact, target_file, indent=2)
+
+def compile_contracts():
+    # Reuse artifacts from an earlier compilation of identical sources; otherwise compile with Truffle.
+    # Deploys to several networks call this at once: the first compiles and the rest hit the cache.
+    with ARTIFACT_LOCK:
+        cache_directory = os.path.join(COMPILE_CACHE_DIR, get_compile_cache_key())
+        build_directory = os.path.join('build', 'contracts')
+        if os.path.isdir(cache_directory):
+            copy_artifacts(cache_directory, build_directory, keep_networks=True)
+            print("Compilation skipped, artifacts restored from the compile cache.")
+            return
+
+        try:
+            with PROFILER.span('truffle_compile'):
+                subprocess.check_call('truffle compile --all', shell=True)
+            print("Compilation complete.")
+        except subprocess.CalledProcessError as e:
+            print(f"Failed to compile contracts: {e}")
+            sys.exit(1)
+
+        # Fill the cache entry under a temporary name so an interrupted copy is never used
+        partial_directory = f"{cache_directory}.partial"
+        shutil.rmtree(partial_directory, ignore_errors=True)
+        copy_artifacts(build_directory, partial_directory, keep_networks=False)
+        os.replace(partial_directory, cache_directory)
+
 def deploy_contracts(network_choice):
     print("\nDeploying a new contract...\n")
+    compile_contracts()
     
-    # Compile the contract using Truffle
+    # Run only the token's deploy script: artifacts are already compiled, and no Migrations
+    # contract is deployed just to record migration progress
     try:
-        subprocess.check_call('truffle compile --all', shell=True)
-        print("Compilation complete.")
+        with ARTIFACT_LOCK, PROFILER.span('truffle_migrate', network=network_choice):
+            subprocess.check_call(f'truffle migrate --reset --f 2 --to 2 --compile-none --network {network_choice}', shell=True)
+        print("Contract has been deployed.")
     except subprocess.CalledProcessError as e:
-        print(f"Failed to compile contracts: {e}")
+        print(f"Failed to deploy contracts: {e}")
         sys.exit(1)
-    
-    # Deploy the contract to the blockchain using Truffle
+
+def create_script_sidecar():
+    # One long-lived node process that serves upload, deploy and mint requests as
+    # line-delimited JSON-RPC 2.0 on stdin/stdout, so truffle, web3 and arweave are
+    # imported and the wallet provider is built once per run instead of once per stage
+    call_arg_tables = {
+        "uri": MINT_CALL_ARGS,
+        "manifest": MANIFEST_CALL_ARGS,
+    }
+    call_args_js = ",\n".join(
+        f"    {table}: {{ " + ", ".join(f"{mode}: (toAddress, tokenIds, tokenURIs) => {expression}" for mode, expression in modes.items()) + " }"
+        for table, modes in call_arg_tables.items()
+    )
+
+    sidecar_script = f"""
+require('dotenv').config();
+const Arweave = require('arweave');
+const HDWalletProvider = require('@truffle/hdwallet-provider');
+const Web3 = require('web3');
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+
+const JOURNAL_PATH = {json.dumps(os.path.abspath(JOURNAL_FILE))};
+const CALL_ARGS = {{
+{call_args_js}
+}};
+
+// stdout carries protocol messages only; all logging goes to stderr
+function writeMessage(message) {{
+    process.stdout.write(JSON.stringify(message) + '\\n');
+}}
+console.log = console.error;
+console.info = console.error;
+{JS_COMMON}{ARWEAVE_UPLOAD_JS}{MINT_JOURNAL_JS}{MINT_PIPELINE_JS}
+// One provider per network URL, so requests for several networks can run at once
+const connections = {{}};
+
+// A provider is rebuilt only when a request needs more accounts than it derived
+function connect(params) {{
+    const accounts = params.accounts || 1;
+    const networkUrl = params.rpcUrl || `https://${{params.network}}.infura.io/v3/${{process.env.INFURA_API_KEY}}`;
+    let connection = connections[networkUrl];
+    if (!connection || accounts > connection.accounts) {{
+        if (connection) {{
+            connection.provider.engine.stop();
+        }}
+        const provider = new HDWalletProvider(process.env.MNEMONIC, networkUrl, 0, accounts);
+        connection = connections[networkUrl] = {{ provider: provider, accounts: accounts, web3: new Web3(provider) }};
+    }}
+    return connection.web3;
+}}
+
+function artifactPath(contractName) {{
+    return path.join('build', 'contracts', `${{contractName}}.json`);
+}}
+
+function readArtifact(contractName) {{
+    return JSON.parse(fs.readFileSync(artifactPath(contractName), 'utf8'));
+}}
+
+const methods = {{
+    async upload(params, emit) {{
+        // The sidecar starts before the upload prompt, which may add ARWEAVE_KEY to .env
+        require('dotenv').config({{ override: true }});
+        const options = Object.assign({{}}, params.options, {{
+            onUploaded: result => emit({{ type: 'uploaded', file: result.file, id: result.id }})
+        }});
+        return uploadImages(params.files, options);
+    }},
+
+    async deploy(params, emit) {{
+        const web3 = connect(params);
+        const artifact = readArtifact(params.contractName);
+        const fromAddress = (await web3.eth.getAccounts())[0];
+        const deployment = new web3.eth.Contract(artifact.abi).deploy({{ data: artifact.bytecode, arguments: params.constructorArgs || [] }});
+        const gas = Math.ceil((await deployment.estimateGas({{ from: fromAddress }})) * 1.2);
+        let transactionHash = null;
+        const fees = feeFields(web3, await suggestFees(web3, params.feePolicy));
+        const instance = await deployment.send(Object.assign({{ from: fromAddress, gas: gas }}, fees))
+            .on('transactionHash', hash => {{
+                transactionHash = hash;
+                emit({{ type: 'deploy_sent', tx: hash }});
+            }});
+
+        // The caller records the deployment in the artifact, alongside those on other networks
+        const networkId = String(await web3.eth.net.getId());
+        return {{ address: instance.options.address, networkId: networkId, tx: transactionHash }};
+    }},
+
+    async mint(params, emit) {{
+        const web3 = connect(params);
+        const artifact = readArtifact(params.contractName);
+        const networkId = String(await web3.eth.net.getId());
+        const contract = new web3.eth.Contract(artifact.abi, artifact.networks[networkId].address);
+        const accounts = (await web3.eth.getAccounts()).slice(0, params.accounts || 1);
+        const fromAddress = accounts[0];
+        const journalFields = {{ network: params.network, contract: contract.options.address }};
+        let tokenChunks = params.tokenChunks;
+
+        if (params.reconcileIds && params.reconcileIds.length) {{
+            const alreadyMinted = await reconcileMinted(tokenId => contract.methods.ownerOf(tokenId).call(), params.reconcileIds);
+            if (alreadyMinted.size) {{
+                recordJournal([...alreadyMinted], 'confirmed', Object.assign({{ reconciled: true }}, journalFields));
+                emit({{ type: 'reconciled', tokenIds: [...alreadyMinted] }});
+                tokenChunks = tokenChunks.map(chunk => chunk.filter(data => !alreadyMinted.has(data.tokenId))).filter(chunk => chunk.length);
+            }}
+        }}
+
+        if (params.baseURI && (await contract.methods.baseURI().call()) !== params.baseURI) {{
+            const fees = feeFields(web3, await suggestFees(web3, params.feePolicy));
+            await contract.methods.setBaseURI(params.baseURI).send(Object.assign({{ from: fromAddress }}, fees));
+        }}
+
+        const buildArgs = CALL_ARGS[params.callArgs][params.mintMode];
+        const jobs = tokenChunks.map(chunk => {{
+            const tokenIds = chunk.map(data => data.tokenId);
+            const tokenURIs = chunk.map(data => JSON.stringify(data.metadata));
+            return {{ tokenIds: tokenIds, method: params.method, args: buildArgs(params.toAddress, tokenIds, tokenURIs) }};
+        }});
+        return mintSharded(web3, contract, accounts, jobs, {{
+            window: params.window,
+            feePolicy: params.feePolicy,
+            onSent: (job, hash) => {{
+                recordJournal(job.tokenIds, 'mint_sent', Object.assign({{ tx: hash }}, journalFields));
+                emit({{ type: 'mint_sent', tokenIds: job.tokenIds, tx: hash }});
+            }},
+            onConfirmed: (job, receipt) => {{
+                recordJournal(job.tokenIds, 'confirmed', Object.assign({{ tx: receipt.transactionHash }}, journalFields));
+                emit({{ type: 'confirmed', tokenIds: job.tokenIds, tx: receipt.transactionHash, gasUsed: receipt.gasUsed }});
+            }}
+        }});
+    }},
+
+    async shutdown() {{
+        setImmediate(shutdown);
+        return true;
+    }}
+}};
+
+function shutdown() {{
+    for (const connection of Object.values(connections)) {{
+        connection.provider.engine.stop();
+    }}
+    process.exit(0);
+}}
+
+profileSpan('script_startup', PROCESS_STARTED_AT, {{ script: '{SIDECAR_SCRIPT}' }});
+readline.createInterface({{ input: process.stdin }}).on('line', line => {{
+    let request;
+    try {{
+        request = JSON.parse(line);
+    }} catch (error) {{
+        writeMessage({{ jsonrpc: '2.0', id: null, error: {{ code: -32700, message: 'Parse error' }} }});
+        return;
+    }}
+    const emit = event => writeMessage({{ jsonrpc: '2.0', method: 'event', params: Object.assign({{ requestId: request.id }}, event) }});
+    const handler = methods[request.method];
+    if (!handler) {{
+        writeMessage({{ jsonrpc: '2.0', id: request.id, error: {{ code: -32601, message: `Unknown method ${{request.method}}` }} }});
+        return;
+    }}
+    // Requests run concurrently; responses are matched to requests by id
+    const startedAt = Date.now();
+    handler(request.params || {{}}, emit).then(
+        result => writeMessage({{ jsonrpc: '2.0', id: request.id, result: result }}),
+        error => writeMessage({{ jsonrpc: '2.0', id: request.id, error: {{ code: -32000, message: error.message || String(error) }} }})
+    ).finally(() => profileSpan(`sidecar_${{request.method}}`, startedAt));
+}}).on('close', shutdown);
+"""
+
+    with open(SIDECAR_SCRIPT, 'w') as file:
+        file.write(sidecar_script)
+
+class NodeSidecar:
+    # Client for the process started from create_script_sidecar(). call() may be used from
+    # several threads at once; a reader thread routes responses and events by request id.
+    def __init__(self, script_path=SIDECAR_SCRIPT):
+        self.process = subprocess.Popen(['node', script_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._pending = {}
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_messages, daemon=True)
+        self._reader.start()
+
+    def _read_messages(self):
+        for line in self.process.stdout:
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Ignoring unexpected sidecar output: {line.strip()}")
+                continue
+            if message.get('method') == 'event':
+                request_id = message['params'].get('requestId')
+            else:
+                request_id = message.get('id')
+            with self._lock:
+                response_queue = self._pending.get(request_id)
+            if response_queue is not None:
+                response_queue.put(message)
+
+        # The process is gone; fail every request still waiting for an answer
+        with self._lock:
+            self._closed = True
+            for response_queue in self._pending.values():
+                response_queue.put({'error': {'message': "Node sidecar exited unexpectedly."}})
+
+    def call(self, method, params=None, on_event=None):
+        response_queue = queue.Queue()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Node sidecar is not running.")
+            self._next_id += 1
+            request_id = self._next_id
+            self._pending[request_id] = response_queue
+            try:
+                self.process.stdin.write(json.dumps({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params or {}}) + "\n")
+                self.process.stdin.flush()
+            except OSError as e:
+                # The process died; callers handle RuntimeError as for any failed request
+                self._pending.pop(request_id, None)
+                raise RuntimeError(f"Node sidecar is not running: {e}")
+
+        try:
+            while True:
+                message = response_queue.get()
+                if message.get('method') == 'event':
+                    if on_event:
+                        on_event(message['params'])
+                    continue
+                if 'error' in message:
+                    raise RuntimeError(message['error']['message'])
+                return message['result']
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def close(self):
+        try:
+            self.call('shutdown')
+        except (RuntimeError, OSError):
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+def start_sidecar():
+    create_script_sidecar()
+    sidecar = NodeSidecar()
+    # sys.exit() is used for every fatal error, so shut the process down on the way out
+    atexit.register(sidecar.close)
+    print("Node sidecar started.")
+    return sidecar
+
+def deploy_with_sidecar(sidecar, network_choice, contract_name, constructor_args, fee_policy, rpc_url=None):
+    print("\nDeploying a new contract...\n")
+    compile_contracts()
     try:
-        subprocess.check_call(f'truffle migrate --reset --network {network_choice}', shell=True)
-        print("Contract has been deployed.")
-    except subprocess.CalledProcessError as e:
+        deployment = sidecar.call('deploy', {
+            "contractName": contract_name,
+            "constructorArgs": constructor_args,
+            "feePolicy": fee_policy,
+            "network": network_choice,
+            "rpcUrl": rpc_url,
+        }, on_event=lambda event: print("Deployment transaction hash:", event['tx']))
+        record_deployment(contract_name, deployment['networkId'], deployment['address'], deployment['tx'])
+        print(f"Contract has been deployed at {deployment['address']}.")
+    except RuntimeError as e:
+        print(f"Failed to deploy contracts: {e}")
+        sys.exit(1)
+
+def mint_with_sidecar(sidecar, network_choice, contract_name, to_address, token_data, mint_mode='single', batch_gas_limit=DEFAULT_BATCH_GAS_LIMIT, pipeline_window=1, fee_policy=None, metadata_storage='onchain', base_uri=None, reconcile_ids=None, rpc_url=None, mint_accounts=1):
+    def report_mint(event):
+        token_ids = ','.join(str(token_id) for token_id in event.get('tokenIds', []))
+        if event['type'] == 'mint_sent':
+            print(f"Minting token ids {token_ids}: transaction hash {event['tx']}")
+        elif event['type'] == 'confirmed':
+            print(f"Confirmed token ids {token_ids}, gas used: {event['gasUsed']}")
+        elif event['type'] == 'reconciled':
+            print(f"Already minted on chain: {token_ids}")
+
+    started = time.perf_counter()
+    try:
+        summary = sidecar.call('mint', {
+            "contractName": contract_name,
+            "toAddress": to_address,
+            "tokenChunks": build_token_chunks(token_data, mint_mode, batch_gas_limit, metadata_storage),
+            "mintMode": mint_mode,
+            "method": MINT_METHODS[mint_mode],
+            "callArgs": 'manifest' if metadata_storage == 'manifest' else 'uri',
+            "window": pipeline_window,
+            "feePolicy": fee_policy,
+            "accounts": mint_accounts,
+            "baseURI": base_uri,
+            "reconcileIds": sorted(reconcile_ids or []),
+            "network": network_choice,
+            "rpcUrl": rpc_url,
+        }, on_event=report_mint)
+    except RuntimeError as e:
+        print(f"Failed to mint NFT: {e}")
+        sys.exit(1)
+
+    print_mint_summary(summary, time.perf_counter() - started)
+
+def print_mint_summary(summary, elapsed):
+    if summary['mintedCount']:
+        print(f"Minted {summary['mintedCount']} tokens in {elapsed:.1f}s: {summary['mintedCount'] / elapsed:.2f} tokens/sec, {round(summary['gasUsed'] / summary['mintedCount'])} gas per token")
+    if summary['failed']:
+        print(f"Token ids that could not be minted: {','.join(str(token_id) for token_id in summary['failed'])}")
+
+def record_deployment(contract_name, network_id, address, transaction_hash):
+    # Record the deployment the way truffle migrate does, so later runs find the contract
+    artifact_path = os.path.join('build', 'contracts', f'{contract_name}.json')
+    with ARTIFACT_LOCK:
+        with open(artifact_path, 'r') as artifact_file:
+            artifact = json.load(artifact_file)
+        artifact.setdefault('networks', {})[str(network_id)] = {"events": {}, "links": {}, "address": address, "transactionHash": transaction_hash}
+        with open(artifact_path, 'w') as artifact_file:
+            json.dump(artifact, artifact_file, indent=2)
+
+def read_env_file(env_file='.env'):
+    # The subset of dotenv syntax create_eth_env_file writes: KEY=value, optionally quoted
+    env = {}
+    with open(env_file, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            env[key.strip()] = value.strip().strip('"').strip("'")
+    return env
+
+def get_rpc_endpoint(network_choice, rpc_url=None, env=None):
+    if rpc_url:
+        return rpc_url
+    return f"https://{network_choice}.infura.io/v3/{(env or {}).get('INFURA_API_KEY', '')}"
+
+class RpcError(RuntimeError):
+    def __init__(self, error):
+        super().__init__(error.get('message', str(error)))
+        self.code = error.get('code')
+
+class RateLimiter:
+    # Token bucket refilled at rate tokens a second and holding at most one second's worth. Its
+    # state is in shared memory, so the job processes started by run_jobs draw on one budget.
+    def __init__(self, rate, context=multiprocessing):
+        self.rate = rate
+        self._lock = context.Lock()
+        self._tokens = context.RawValue('d', rate)
+        self._updated = context.RawValue('d', time.monotonic())
+
+    def acquire(self, count=1):
+        # Takes all count tokens at once, going into debt when the bucket holds fewer, and
+        # sleeps until the debt is paid off
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.rate, self._tokens.value + (now - self._updated.value) * self.rate) - count
+            self._tokens.value = tokens
+            self._updated.value = now
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+# Set in job processes when the job queue caps the request rate of the RPC endpoints
+RPC_RATE_LIMITER = None
+
+class JsonRpcClient:
+    # JSON-RPC over pooled keep-alive HTTP connections. Sockets are reused across requests so
+    # only the first request pays for the TCP and TLS handshakes, and batch() sends many calls
+    # in a single round trip.
+    def __init__(self, url, pool_size=4, timeout=60):
+        parsed = urlparse(url)
+        self.connection_class = HTTPSConnection if parsed.scheme == 'https' else HTTPConnection
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else '')
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.call_count = 0
+        self.request_count = 0
+
+    def _post(self, payload):
+        calls = len(payload) if isinstance(payload, list) else 1
+        if RPC_RATE_LIMITER:
+            # Endpoints count every call of a batch against their limits
+            RPC_RATE_LIMITER.acquire(calls)
+        with PROFILER.span('rpc_request', calls=calls):
+            return self._send(payload)
+
+    def _send(self, payload):
+        body = json.dumps(payload).encode('utf-8')
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in range(2):
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+            try:
+                connection.request('POST', self.path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (HTTPException, OSError):
+                connection.close()
+                # A pooled socket may have been closed by the server while idle; retry once on a new one
+                if attempt:
+                    raise
+                continue
+            try:
+                self._pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+            with self._lock:
+                self.request_count += 1
+            if response.status != 200:
+                raise RuntimeError(f"RPC endpoint returned HTTP {response.status}: {data[:200].decode('utf-8', 'replace')}")
+            return json.loads(data)
+
+    def _take_ids(self, count):
+        with self._lock:
+            first_id = self._next_id
+            self._next_id += count
+            self.call_count += count
+        return range(first_id, first_id + count)
+
+    def call(self, method, params=None):
+        request_id = self._take_ids(1)[0]
+        response = self._post({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params or []})
+        if 'error' in response:
+            raise RpcError(response['error'])
+        return response['result']
+
+    def batch(self, calls, raise_errors=True):
+        # calls is a list of (method, params); results come back in the same order. With
+        # raise_errors=False a failed call yields its RpcError in place of a result.
+        results = []
+        for start in range(0, len(calls), RPC_BATCH_SIZE):
+            chunk = calls[start:start + RPC_BATCH_SIZE]
+            request_ids = self._take_ids(len(chunk))
+            payload = [{"jsonrpc": "2.0", "id": request_id, "method": method, "params": params} for request_id, (method, params) in zip(request_ids, chunk)]
+            response = self._post(payload)
+            if isinstance(response, dict):
+                # Endpoints without batch support answer with a single error object
+                raise RpcError(response.get('error', {"message": "Unexpected batch response."}))
+            by_id = {item.get('id'): item for item in response}
+            for request_id in request_ids:
+                item = by_id.get(request_id, {"error": {"message": "Missing response in batch."}})
+                if 'error' in item:
+                    if raise_errors:
+                        raise RpcError(item['error'])
+                    results.append(RpcError(item['error']))
+                else:
+                    results.append(item['result'])
+        return results
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+def get_fee_policy(contract_parameters):
+    # camelCase so the same dict can be handed to the JS mint pipeline; wei amounts are strings
+    # because JSON numbers lose precision in JS above 2**53
+    max_fee_gwei = contract_parameters.get('max_fee_gwei')
+    return {
+        "strategy": contract_parameters.get('fee_strategy', 'legacy'),
+        "gasPrice": str(contract_parameters.get('gas_price') or 0),
+        "percentile": contract_parameters.get('fee_percentile', 50),
+        "maxFeePerGas": str(int(max_fee_gwei * 10 ** 9)) if max_fee_gwei else None,
+        "bumpPercent": contract_parameters.get('fee_bump_percent', 15),
+        "stuckAfterSeconds": contract_parameters.get('fee_stuck_after_seconds', 60),
+    }
+
+def cap_fees(fees, fee_policy):
+    # max_fee_gwei is a hard ceiling on what any transaction may pay per unit of gas
+    if not fee_policy['maxFeePerGas']:
+        return fees
+    ceiling = int(fee_policy['maxFeePerGas'])
+    if 'gasPrice' in fees:
+        return {'gasPrice': min(fees['gasPrice'], ceiling)}
+    max_fee = min(fees['maxFeePerGas'], ceiling)
+    return {'maxFeePerGas': max_fee, 'maxPriorityFeePerGas': min(fees['maxPriorityFeePerGas'], max_fee)}
+
+def get_fee_history_call(fee_policy):
+    return ('eth_feeHistory', [hex(FEE_HISTORY_BLOCKS), 'latest', [fee_policy['percentile']]])
+
+def fees_from_history(fee_history, fee_policy):
+    # The priority fee is the median over recent blocks of the tip paid at the target percentile.
+    # The max fee leaves room for the base fee to double before the transaction is mined.
+    if fee_policy['strategy'] == 'legacy':
+        return cap_fees({'gasPrice': int(fee_policy['gasPrice'])}, fee_policy)
+    next_base_fee = int(fee_history['baseFeePerGas'][-1], 16)
+    rewards = sorted(int(reward[0], 16) for reward in fee_history.get('reward') or [])
+    priority_fee = rewards[len(rewards) // 2] if rewards else MIN_PRIORITY_FEE
+    return cap_fees({'maxFeePerGas': 2 * next_base_fee + priority_fee, 'maxPriorityFeePerGas': priority_fee}, fee_policy)
+
+def bump_fees(fees, fee_policy):
+    # Replacement fees for a stuck transaction, or None when the ceiling leaves no room to bump
+    bumped = cap_fees({name: value * (100 + fee_policy['bumpPercent']) // 100 + 1 for name, value in fees.items()}, fee_policy)
+    price_field = 'gasPrice' if 'gasPrice' in fees else 'maxFeePerGas'
+    return bumped if bumped[price_field] > fees[price_field] else None
+
+def suggest_fees(network_choice, fee_policy, rpc_url=None):
+    # Fees baked into the generated truffle config
+    if fee_policy['strategy'] == 'legacy':
+        return fees_from_history(None, fee_policy)
+    rpc = JsonRpcClient(get_rpc_endpoint(network_choice, rpc_url, read_env_file()))
+    try:
+        method, params = get_fee_history_call(fee_policy)
+        return fees_from_history(rpc.call(method, params), fee_policy)
+    except (RuntimeError, OSError) as e:
+        print(f"Failed to read fee history: {e}")
+        sys.exit(1)
+    finally:
+        rpc.close()
+
+def get_abi_types(inputs):
+    types = []
+    for param in inputs:
+        if param['type'].startswith('tuple'):
+            types.append('(' + ','.join(get_abi_types(param['components'])) + ')' + param['type'][len('tuple'):])
+        else:
+            types.append(param['type'])
+    return types
+
+def find_abi_entry(abi, entry_type, name=None, arg_count=None):
+    for entry in abi:
+        if entry.get('type') != entry_type or (name and entry.get('name') != name):
+            continue
+        if arg_count is None or len(entry.get('inputs', [])) == arg_count:
+            return entry
+    return None
+
+def encode_function_call(abi, name, args):
+    entry = find_abi_entry(abi, 'function', name, len(args))
+    if entry is None:
+        raise ValueError(f"Function {name} with {len(args)} arguments not found in the contract ABI.")
+    types = get_abi_types(entry['inputs'])
+    selector = keccak(text=f"{name}({','.join(types)})")[:4]
+    return '0x' + (selector + eth_abi.encode(types, args)).hex()
+
+def decode_function_result(abi, name, data):
+    entry = find_abi_entry(abi, 'function', name)
+    return eth_abi.decode(get_abi_types(entry['outputs']), bytes.fromhex(data[2:]))
+
+def get_mint_call_args(mint_mode, metadata_storage, to_address, token_ids, token_uris):
+    # Python counterpart of MINT_CALL_ARGS and MANIFEST_CALL_ARGS
+    if metadata_storage == 'manifest':
+        return {'single': [to_address, token_ids[0]], 'batch': [to_address, token_ids]}[mint_mode]
+    return {'single': [to_address, token_ids[0], token_uris[0]], 'batch': [to_address, token_ids, token_uris], 'consecutive': [token_ids, token_uris]}[mint_mode]
+
+class PythonTxEngine:
+    # Deploys and mints without truffle: transactions are signed locally with the first account
+    # of the .env mnemonic (the same account HDWalletProvider uses) and sent as raw transactions.
+    # Jobs are sent in waves of up to `window` transactions; each wave costs one batched request
+    # for gas estimates, fees and the nonce, one for the sends, and one per receipt poll.
+    def __init__(self, rpc_url, mnemonic, fee_policy, account_index=0):
+        if Account is None:
+            print("The python transaction engine requires eth-account. Install it with: pip install -r requirements.txt")
+            sys.exit(1)
+        Account.enable_unaudited_hdwallet_features()
+        self.account = Account.from_mnemonic(mnemonic, account_path=f"m/44'/60'/0'/0/{account_index}")
+        self.address = self.account.address
+        self.fee_policy = fee_policy
+        self.rpc_url = rpc_url
+        self.mnemonic = mnemonic
+        self.rpc = JsonRpcClient(rpc_url)
+        chain_id, network_id = self.rpc.batch([('eth_chainId', []), ('net_version', [])])
+        self.chain_id = int(chain_id, 16)
+        self.network_id = network_id
+        self._shards = [self]
+
+    def get_shards(self, count):
+        # Engines for the first `count` accounts of the mnemonic, starting with this one. Each
+        # signs with its own key and keeps its own nonce lane and connection pool.
+        while len(self._shards) < count:
+            self._shards.append(PythonTxEngine(self.rpc_url, self.mnemonic, self.fee_policy, len(self._shards)))
+        return self._shards[:count]
+
+    def sign(self, job, fees):
+        # fees holds gasPrice for a legacy transaction, or the two EIP-1559 fields for a type 2 one
+        transaction = {"nonce": job['nonce'], "gas": job['gas'], "value": job.get('value', 0), "data": job['data'], "chainId": self.chain_id}
+        transaction.update(fees)
+        if job.get('to'):
+            transaction['to'] = job['to']
+        signed = self.account.sign_transaction(transaction)
+        raw_transaction = getattr(signed, 'raw_transaction', None) or signed.rawTransaction
+        return '0x' + bytes(raw_transaction).hex()
+
+    def send_signed(self, jobs_with_fees):
+        # One batched eth_sendRawTransaction for [(job, fees)]; returns hashes or RpcErrors
+        return self.rpc.batch([('eth_sendRawTransaction', [self.sign(job, fees)]) for job, fees in jobs_with_fees], raise_errors=False)
+
+    def replace_stuck(self, jobs, on_sent=None):
+        replacements = []
+        for job in jobs:
+            job['sentAt'] = time.monotonic()
+            bumped = bump_fees(job['fees'], self.fee_policy)
+            if bumped is None:
+                print(f"Transaction {job['hashes'][-1]} still pending at the fee ceiling, waiting...")
+            else:
+                replacements.append((job, bumped))
+        for (job, fees), result in zip(replacements, self.send_signed(replacements)):
+            if isinstance(result, RpcError):
+                print(f"Fee bump for nonce {job['nonce']} was rejected: {result}")
+                continue
+            print(f"Replaced stuck transaction {job['hashes'][-1]} with {result} at higher fees")
+            job['fees'] = fees
+            job['hashes'].append(result)
+            if on_sent:
+                on_sent(job, result)
+
+    def wait_for_receipts(self, jobs, on_sent=None):
+        # Receipts for every hash a job has been sent under, polled in one batch per round. A
+        # job still pending after stuckAfterSeconds is replaced at its nonce with bumped fees.
+        receipts = [None] * len(jobs)
+        deadline = time.monotonic() + RECEIPT_TIMEOUT
+        while True:
+            waiting = [index for index, receipt in enumerate(receipts) if receipt is None]
+            calls = [(index, ('eth_getTransactionReceipt', [transaction_hash])) for index in waiting for transaction_hash in jobs[index]['hashes']]
+            for (index, _), receipt in zip(calls, self.rpc.batch([call for _, call in calls])):
+                if receipt:
+                    receipts[index] = receipt
+            waiting = [index for index in waiting if receipts[index] is None]
+            if not waiting or time.monotonic() > deadline:
+                break
+            now = time.monotonic()
+            self.replace_stuck([jobs[index] for index in waiting if now - jobs[index]['sentAt'] >= self.fee_policy['stuckAfterSeconds']], on_sent)
+            time.sleep(RECEIPT_POLL_INTERVAL)
+        return receipts
+
+    def fill_nonce_gaps(self, nonces, fees):
+        # A nonce that was assigned but never reached the node blocks every later transaction;
+        # fill it with a zero-value transfer to ourselves
+        if not nonces:
+            return
+        print(f"Filling nonce gap(s) {', '.join(str(nonce) for nonce in nonces)}")
+        fillers = [{"to": self.address, "data": '0x', "gas": 21000, "nonce": nonce, "fees": fees} for nonce in nonces]
+        sent = []
+        for filler, result in zip(fillers, self.send_signed([(filler, fees) for filler in fillers])):
+            if not isinstance(result, RpcError):
+                sent.append(dict(filler, hashes=[result], sentAt=time.monotonic()))
+        self.wait_for_receipts(sent)
+
+    def send_jobs(self, jobs, window=1, max_attempts=3, on_sent=None, on_confirmed=None):
+        # jobs are dicts with tokenIds, data, an optional to (None deploys a contract) and an
+        # optional description for log messages
+        pending = deque(dict(job, attempts=0) for job in jobs)
+        summary = {"mintedCount": 0, "gasUsed": 0, "failed": []}
+        eip1559 = self.fee_policy['strategy'] == 'eip1559'
+
+        def retry_or_fail(job, error):
+            description = job.get('description') or f"token ids {','.join(str(token_id) for token_id in job['tokenIds'])}"
+            if job['attempts'] < max_attempts:
+                print(f"Re-queueing {description} after error: {error}")
+                pending.append(job)
+            else:
+                print(f"Giving up on {description}: {error}")
+                summary['failed'].extend(job['tokenIds'])
+
+        while pending:
+            wave = [pending.popleft() for _ in range(min(max(1, window), len(pending)))]
+            estimate_calls = [('eth_estimateGas', [{key: value for key, value in (("from", self.address), ("to", job.get('to')), ("data", job['data']), ("value", hex(job['value']) if job.get('value') else None)) if value}]) for job in wave]
+            # Fees and the nonce ride along in the same batch as the gas estimates
+            extra_calls = [('eth_getTransactionCount', [self.address, 'pending'])] + ([get_fee_history_call(self.fee_policy)] if eip1559 else [])
+            results = self.rpc.batch(estimate_calls + extra_calls, raise_errors=False)
+            for result in results[len(wave):]:
+                if isinstance(result, RpcError):
+                    raise result
+            next_nonce = int(results[len(wave)], 16)
+            fees = fees_from_history(results[len(wave) + 1] if eip1559 else None, self.fee_policy)
+
+            ready = []
+            for job, estimate in zip(wave, results):
+                job['attempts'] += 1
+                if isinstance(estimate, RpcError):
+                    retry_or_fail(job, estimate)
+                    continue
+                job['gas'] = math.ceil(int(estimate, 16) * 1.2)
+                job['nonce'] = next_nonce
+                job['fees'] = fees
+                next_nonce += 1
+                ready.append(job)
+            if not ready:
+                continue
+
+            sent = []
+            unsent_nonces = []
+            for job, result in zip(ready, self.send_signed([(job, fees) for job in ready])):
+                if isinstance(result, RpcError):
+                    unsent_nonces.append(job['nonce'])
+                    retry_or_fail(job, result)
+                    continue
+                job['hashes'] = [result]
+                job['sentAt'] = time.monotonic()
+                sent.append(job)
+                if on_sent:
+                    on_sent(job, result)
+            if sent:
+                self.fill_nonce_gaps([nonce for nonce in unsent_nonces if nonce < sent[-1]['nonce']], fees)
+
+            for job, receipt in zip(sent, self.wait_for_receipts(sent, on_sent)):
+                if receipt is None:
+                    # Possibly still pending: leave it in the journal as sent so the next run checks it
+                    print(f"No receipt for {job['hashes'][-1]} after {RECEIPT_TIMEOUT}s.")
+                    summary['failed'].extend(job['tokenIds'])
+                elif int(receipt['status'], 16) != 1:
+                    retry_or_fail(job, f"transaction {receipt['transactionHash']} reverted")
+                else:
+                    summary['mintedCount'] += len(job['tokenIds'])
+                    summary['gasUsed'] += int(receipt['gasUsed'], 16)
+                    if on_confirmed:
+                        on_confirmed(job, receipt)
+        return summary
+
+    def deploy(self, artifact, constructor_args):
+        constructor = find_abi_entry(artifact['abi'], 'constructor')
+        encoded_args = eth_abi.encode(get_abi_types(constructor['inputs']), constructor_args) if constructor else b''
+        deployment = {}
+        def store_receipt(job, receipt):
+            deployment.update(address=receipt['contractAddress'], transactionHash=receipt['transactionHash'])
+        self.send_jobs([{"tokenIds": [], "to": None, "data": artifact['bytecode'] + encoded_args.hex(), "description": "contract deployment"}], max_attempts=1,
+                       on_sent=lambda job, transaction_hash: print("Deployment transaction hash:", transaction_hash), on_confirmed=store_receipt)
+        return deployment
+
+    def find_minted(self, contract_address, abi, token_ids):
+        # ownerOf reverts for tokens that do not exist, so every successful call is a minted token
+        calls = [('eth_call', [{"to": contract_address, "data": encode_function_call(abi, 'ownerOf', [token_id])}, 'latest']) for token_id in token_ids]
+        return {token_id for token_id, result in zip(token_ids, self.rpc.batch(calls, raise_errors=False)) if not isinstance(result, RpcError)}
+
+def start_python_engine(network_choice, fee_policy, rpc_url=None):
+    env = read_env_file()
+    try:
+        engine = PythonTxEngine(get_rpc_endpoint(network_choice, rpc_url, env), env.get('MNEMONIC', ''), fee_policy)
+    except (RuntimeError, OSError) as e:
+        print(f"Failed to connect to the RPC endpoint: {e}")
+        sys.exit(1)
+    print(f"Python transaction engine connected to chain {engine.chain_id} as {engine.address}.")
+    return engine
+
+def deploy_with_python_engine(engine, contract_name, constructor_args):
+    print("\nDeploying a new contract...\n")
+    compile_contracts()
+    with open(os.path.join('build', 'contracts', f'{contract_name}.json'), 'r') as artifact_file:
+        artifact = json.load(artifact_file)
+    try:
+        deployment = engine.deploy(artifact, constructor_args)
+    except (RuntimeError, OSError) as e:
         print(f"Failed to deploy contracts: {e}")
         sys.exit(1)
+    if not deployment:
+        print("Failed to deploy contracts: the deployment transaction did not succeed.")
+        sys.exit(1)
+    record_deployment(contract_name, engine.network_id, deployment['address'], deployment['transactionHash'])
+    print(f"Contract has been deployed at {deployment['address']}.")
+
+def get_token_uri(metadata):
+    # Same encoding as JSON.stringify in the truffle mint script
+    return json.dumps(metadata, separators=(',', ':'), ensure_ascii=False)
+
+def build_mint_jobs(abi, contract_address, to_address, token_chunks, mint_mode, metadata_storage):
+    jobs = []
+    for chunk in token_chunks:
+        token_ids = [data['tokenId'] for data in chunk]
+        token_uris = [get_token_uri(data['metadata']) for data in chunk]
+        args = get_mint_call_args(mint_mode, metadata_storage, to_address, token_ids, token_uris)
+        jobs.append({"tokenIds": token_ids, "to": contract_address, "data": encode_function_call(abi, MINT_METHODS[mint_mode], args)})
+    return jobs
+
+def prepare_shards(engine, shards, contract_address, abi, shard_jobs):
+    # The owner grants minter rights to the other shard accounts and tops up every one whose
+    # balance cannot cover its share of the jobs at the highest fee the policy allows
+    accounts = [shard.address for shard in shards[1:]]
+    is_minter = engine.rpc.batch([('eth_call', [{"to": contract_address, "data": encode_function_call(abi, 'isMinter', [account])}, 'latest']) for account in accounts])
+    grants = [{"tokenIds": [], "to": contract_address, "data": encode_function_call(abi, 'setMinter', [account, True]), "description": f"minter grant for {account}"}
+              for account, result in zip(accounts, is_minter) if not decode_function_result(abi, 'isMinter', result)[0]]
+    if grants:
+        print(f"Granting minter rights to {len(grants)} account(s)...")
+        engine.send_jobs(grants, window=len(grants), max_attempts=1)
+
+    _, max_price = get_gas_prices(engine.rpc, engine.fee_policy)
+    # Estimated as the owner: an unfunded account may not be able to estimate at all, and the
+    # only difference for a minter is one extra storage read, well inside the 20% margin
+    estimate_calls = [('eth_estimateGas', [{"from": engine.address, "to": job['to'], "data": job['data']}]) for jobs in shard_jobs[1:] for job in jobs]
+    results = engine.rpc.batch(estimate_calls + [('eth_getBalance', [account, 'latest']) for account in accounts], raise_errors=False)
+    estimates = iter(results[:len(estimate_calls)])
+    balances = results[len(estimate_calls):]
+    for balance in balances:
+        if isinstance(balance, RpcError):
+            raise balance
+    needed = []
+    for jobs in shard_jobs[1:]:
+        # Jobs that fail to estimate (e.g. already minted) are left for send_jobs to report
+        needed.append(sum(math.ceil(int(estimate, 16) * 1.2) for estimate in (next(estimates) for _ in jobs) if not isinstance(estimate, RpcError)) * max_price)
+    top_ups = [{"tokenIds": [], "to": account, "data": '0x', "value": amount - int(balance, 16), "description": f"funding of {account}"}
+               for account, amount, balance in zip(accounts, needed, balances) if int(balance, 16) < amount]
+    if top_ups:
+        print(f"Funding {len(top_ups)} minter account(s) with {format_units(sum(job['value'] for job in top_ups), 18)} ETH from {engine.address}...")
+        engine.send_jobs(top_ups, window=len(top_ups), max_attempts=1)
+
+def mint_with_python_engine(engine, network_choice, contract_name, to_address, token_data, mint_mode='single', batch_gas_limit=DEFAULT_BATCH_GAS_LIMIT, pipeline_window=1, metadata_storage='onchain', base_uri=None, reconcile_ids=None, mint_accounts=1):
+    with open(os.path.join('build', 'contracts', f'{contract_name}.json'), 'r') as artifact_file:
+        artifact = json.load(artifact_file)
+    abi = artifact['abi']
+    contract_address = artifact['networks'][str(engine.network_id)]['address']
+    journal_fields = {"network": network_choice, "contract": contract_address}
+    token_chunks = build_token_chunks(token_data, mint_mode, batch_gas_limit, metadata_storage)
+
+    started = time.perf_counter()
+    try:
+        if reconcile_ids:
+            already_minted = engine.find_minted(contract_address, abi, sorted(reconcile_ids))
+            if already_minted:
+                print(f"Already minted on chain: {','.join(str(token_id) for token_id in sorted(already_minted))}")
+                record_journal(sorted(already_minted), 'confirmed', reconciled=True, **journal_fields)
+                token_chunks = [chunk for chunk in ([data for data in chunk if data['tokenId'] not in already_minted] for chunk in token_chunks) if chunk]
+
+        if base_uri:
+            current_base_uri = engine.rpc.call('eth_call', [{"to": contract_address, "data": encode_function_call(abi, 'baseURI', [])}, 'latest'])
+            if decode_function_result(abi, 'baseURI', current_base_uri)[0] != base_uri:
+                engine.send_jobs([{"tokenIds": [], "to": contract_address, "data": encode_function_call(abi, 'setBaseURI', [base_uri]), "description": "base URI update"}], max_attempts=1)
+
+        jobs = build_mint_jobs(abi, contract_address, to_address, token_chunks, mint_mode, metadata_storage)
+
+        def journal_sent(job, transaction_hash):
+            print(f"Minting token ids {','.join(str(token_id) for token_id in job['tokenIds'])}: transaction hash {transaction_hash}")
+            record_journal(job['tokenIds'], 'mint_sent', tx=transaction_hash, **journal_fields)
+            # Replacements keep the time of the first send
+            job.setdefault('profileSentAt', (time.time(), time.perf_counter()))
+
+        def journal_confirmed(job, receipt):
+            record_journal(job['tokenIds'], 'confirmed', tx=receipt['transactionHash'], **journal_fields)
+            sent_at, sent = job.pop('profileSentAt')
+            PROFILER.record('mint_tx', sent_at, time.perf_counter() - sent, tokens=len(job['tokenIds']), gasUsed=int(receipt['gasUsed'], 16), replacements=len(job['hashes']) - 1)
+
+        # Jobs are dealt round-robin to the shard accounts, which send in parallel
+        shards = engine.get_shards(max(1, min(mint_accounts, len(jobs))))
+        shard_jobs = [jobs[index::len(shards)] for index in range(len(shards))]
+        if len(shards) > 1:
+            prepare_shards(engine, shards, contract_address, abi, shard_jobs)
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            shard_summaries = list(executor.map(lambda shard, jobs: shard.send_jobs(jobs, pipeline_window, on_sent=journal_sent, on_confirmed=journal_confirmed), shards, shard_jobs))
+        summary = {"mintedCount": sum(shard_summary['mintedCount'] for shard_summary in shard_summaries),
+                   "gasUsed": sum(shard_summary['gasUsed'] for shard_summary in shard_summaries),
+                   "failed": [token_id for shard_summary in shard_summaries for token_id in shard_summary['failed']]}
+    except (RuntimeError, OSError) as e:
+        print(f"Failed to mint NFT: {e}")
+        sys.exit(1)
+
+    print_mint_summary(summary, time.perf_counter() - started)
+    print(f"{sum(shard.rpc.call_count for shard in shards)} JSON-RPC calls sent in {sum(shard.rpc.request_count for shard in shards)} HTTP requests.")
+
+def get_voucher_fields(metadata_storage):
+    # Members of the NFTVoucher struct; in manifest mode the URI comes from the base URI instead
+    fields = [('tokenId', 'uint256'), ('minPrice', 'uint256')]
+    if metadata_storage != 'manifest':
+        fields.append(('uri', 'string'))
+    return fields
+
+def get_voucher_type(metadata_storage):
+    return f"NFTVoucher({','.join(f'{field_type} {name}' for name, field_type in get_voucher_fields(metadata_storage))})"
+
+def get_voucher_domain(token_name, chain_id, contract_address):
+    return {"name": token_name, "version": VOUCHER_DOMAIN_VERSION, "chainId": chain_id, "verifyingContract": contract_address}
+
+def get_domain_separator(domain):
+    return keccak(keccak(text=EIP712_DOMAIN_TYPE) + keccak(text=domain['name']) + keccak(text=domain['version'])
+                  + domain['chainId'].to_bytes(32, 'big') + bytes.fromhex(domain['verifyingContract'][2:]).rjust(32, b'\0'))
+
+def get_voucher_digest(domain_separator, type_hash, voucher):
+    # The EIP-712 hash that redeem recovers the signer from. Encoded by hand since every
+    # voucher has the same static layout; sign_typed_data would re-derive it for each one.
+    encoded = type_hash + int(voucher['tokenId']).to_bytes(32, 'big') + int(voucher['minPrice']).to_bytes(32, 'big')
+    if 'uri' in voucher:
+        encoded += keccak(text=voucher['uri'])
+    return keccak(b'\x19\x01' + domain_separator + keccak(encoded))
+
+def sign_voucher_chunk(private_key, domain_separator, type_hash, vouchers):
+    # Runs in a worker process and returns the signatures in voucher order
+    key = eth_keys.PrivateKey(private_key)
+    signatures = []
+    for voucher in vouchers:
+        signature = key.sign_msg_hash(get_voucher_digest(domain_separator, type_hash, voucher))
+        # r, s, v with v as 27 or 28, the form ECDSA.recover accepts
+        signatures.append('0x' + (signature.r.to_bytes(32, 'big') + signature.s.to_bytes(32, 'big') + bytes([signature.v + 27])).hex())
+    return signatures
+
+def sign_vouchers(private_key, domain, token_data, min_price=0, metadata_storage='onchain', workers=None):
+    # Signs one voucher per token, offline, on a process pool. eth-keys signs a few hundred per
+    # second per core in pure python and several thousand when coincurve is installed.
+    type_hash = keccak(text=get_voucher_type(metadata_storage))
+    domain_separator = get_domain_separator(domain)
+    vouchers = []
+    for data in token_data:
+        # minPrice is a string so JavaScript can read wei amounts without losing precision
+        voucher = {"tokenId": data['tokenId'], "minPrice": str(min_price)}
+        if metadata_storage != 'manifest':
+            voucher['uri'] = get_token_uri(data['metadata'])
+        vouchers.append(voucher)
+
+    chunks = [vouchers[index:index + VOUCHER_SIGN_CHUNK] for index in range(0, len(vouchers), VOUCHER_SIGN_CHUNK)]
+    sign_chunk = partial(sign_voucher_chunk, private_key, domain_separator, type_hash)
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(sign_chunk, chunks))
+    else:
+        results = [sign_chunk(chunk) for chunk in chunks]
+    for voucher, signature in zip(vouchers, (signature for signatures in results for signature in signatures)):
+        voucher['signature'] = signature
+    return vouchers
+
+def recover_voucher_signer(domain, voucher, metadata_storage='onchain'):
+    # Offline counterpart of the check in redeem
+    digest = get_voucher_digest(get_domain_separator(domain), keccak(text=get_voucher_type(metadata_storage)), voucher)
+    signature = bytes.fromhex(voucher['signature'][2:])
+    return eth_keys.Signature(signature[:64] + bytes([signature[64] - 27])).recover_public_key_from_msg_hash(digest).to_checksum_address()
+
+def get_redeem_call_args(voucher, metadata_storage='onchain'):
+    # Arguments of redeem(voucher, signature) for encode_function_call
+    values = tuple(voucher['uri'] if name == 'uri' else int(voucher[name]) for name, _ in get_voucher_fields(metadata_storage))
+    return [values, bytes.fromhex(voucher['signature'][2:])]
+
+def write_vouchers(voucher_path, domain, metadata_storage, signer, vouchers):
+    # One compact document: the EIP-712 domain and types once, then an entry per token that a
+    # claim page passes to redeem as is
+    document = {
+        "domain": domain,
+        "primaryType": "NFTVoucher",
+        "types": {"NFTVoucher": [{"name": name, "type": field_type} for name, field_type in get_voucher_fields(metadata_storage)]},
+        "signer": signer,
+        "vouchers": vouchers,
+    }
+    temp_path = f"{voucher_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as voucher_file:
+        json.dump(document, voucher_file, separators=(',', ':'), ensure_ascii=False)
+    os.replace(temp_path, voucher_path)
+
+def create_vouchers(network_choice, contract_address, token_name, token_data, min_price=0, metadata_storage='onchain', workers=None):
+    if Account is None:
+        print("Lazy minting requires eth-account to sign vouchers. Install it with: pip install -r requirements.txt")
+        sys.exit(1)
+    # Signed by the owner, the first account of the mnemonic, which redeem accepts like any minter
+    Account.enable_unaudited_hdwallet_features()
+    account = Account.from_mnemonic(read_env_file().get('MNEMONIC', ''), account_path="m/44'/60'/0'/0/0")
+    # The chain id comes from the network registry, so no RPC is needed
+    domain = get_voucher_domain(token_name, NETWORKS[network_choice]['chain_id'], contract_address)
+    voucher_path = VOUCHER_FILE.format(network=network_choice)
+
+    print(f"\nSigning {len(token_data)} voucher(s) for {contract_address}...\n")
+    started = time.perf_counter()
+    with PROFILER.span('sign_vouchers', tokens=len(token_data)):
+        vouchers = sign_vouchers(bytes(account.key), domain, token_data, min_price, metadata_storage, workers)
+    elapsed = time.perf_counter() - started
+    write_vouchers(voucher_path, domain, metadata_storage, account.address, vouchers)
+    print(f"Signed {len(vouchers)} voucher(s) as {account.address} in {elapsed:.2f}s ({len(vouchers) / elapsed if elapsed else 0:.0f}/s).")
+    print(f"Vouchers written to {voucher_path}. Each token is minted when its voucher is passed to redeem.")
+
+class ReceiptWatcher:
+    # Follows the mint transactions journaled for one contract, whichever engine sent them, and
+    # tracks their confirmation depth from a background thread. Each round asks for the head block,
+    # then sends one batched request for every watched receipt, and one for the canonical hashes of
+    # the blocks those receipts name and for whether receipt-less transactions are still known.
+    # Outcomes are journaled per token:
+    #   confirmed  a successful receipt, fewer than `confirmations` blocks deep
+    #   finalized  a successful receipt at least `confirmations` blocks deep on the canonical chain
+    #   reorged    a confirmed mint whose receipt disappeared or now names a non-canonical block
+    #   dropped    no receipt, and the node has not known any of its transactions for drop_after
+    #   reverted   every receipt failed, at least `confirmations` blocks deep
+    # Reorged mints are watched until they are included again or dropped. The next run checks
+    # every token that is not confirmed or finalized with ownerOf before minting it again.
+    def __init__(self, rpc, network_choice, contract_address, confirmations, poll_interval=RECEIPT_POLL_INTERVAL, drop_after=RECEIPT_DROP_AFTER):
+        self.rpc = rpc
+        self.network_choice = network_choice
+        self.contract_address = contract_address
+        self.confirmations = max(1, confirmations)
+        self.poll_interval = poll_interval
+        self.drop_after = drop_after
+        self.head = None
+        self._head_hash = None
+        self._journal_offset = 0
+        self._states = {}
+        self._token_hashes = {}
+        self._transactions = {}
+        self._followed = set()
+        self._polled_at = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read_journal(self):
+        # Only whole lines are consumed; a line still being written is picked up next round
+        try:
+            with open(JOURNAL_FILE, 'rb') as journal_file:
+                journal_file.seek(self._journal_offset)
+                data = journal_file.read()
+        except FileNotFoundError:
+            return False
+        end = data.rfind(b"\n") + 1
+        self._journal_offset += end
+        changed = False
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get('state') not in MINT_JOURNAL_STATES or entry.get('network') != self.network_choice:
+                continue
+            if (entry.get('contract') or '').lower() != self.contract_address.lower():
+                continue
+            token_id = entry['tokenId']
+            self._states[token_id] = entry['state']
+            if entry['state'] == 'confirmed' and not entry.get('tx'):
+                # Reconciled with ownerOf: minted, but there is no transaction left to follow
+                self._token_hashes.pop(token_id, None)
+            elif entry['state'] in ('mint_sent', 'confirmed') and entry['tx'] not in self._token_hashes.get(token_id, ()):
+                self._token_hashes.setdefault(token_id, []).append(entry['tx'])
+                self._transactions.setdefault(entry['tx'], {"receipt": None, "knownAt": time.monotonic()})
+                changed = True
+        return changed
+
+    def _watched_tokens(self):
+        return [token_id for token_id, hashes in self._token_hashes.items() if hashes and self._states.get(token_id) not in FINAL_JOURNAL_STATES]
+
+    def poll(self):
+        with self._lock:
+            changed = self._read_journal()
+            tokens = self._watched_tokens()
+            self._followed.update(tokens)
+            hashes = list(dict.fromkeys(transaction_hash for token_id in tokens for transaction_hash in self._token_hashes[token_id]))
+            latest = self.rpc.call('eth_getBlockByNumber', ['latest', False])
+            now = time.monotonic()
+            # Nothing can have changed without a new head block (a reorg at the same height has a
+            # new hash), except the node forgetting a transaction
+            unchanged = latest['hash'] == self._head_hash and not changed and now - self._polled_at < self.drop_after / 4
+            self.head = int(latest['number'], 16)
+            self._head_hash = latest['hash']
+            if not hashes or unchanged:
+                return
+            self._polled_at = now
+
+            receipts = dict(zip(hashes, self.rpc.batch([('eth_getTransactionReceipt', [transaction_hash]) for transaction_hash in hashes], raise_errors=False)))
+            block_numbers = sorted({int(receipt['blockNumber'], 16) for receipt in receipts.values() if isinstance(receipt, dict)})
+            missing = [transaction_hash for transaction_hash, receipt in receipts.items() if receipt is None]
+            results = self.rpc.batch([('eth_getBlockByNumber', [hex(number), False]) for number in block_numbers]
+                                     + [('eth_getTransactionByHash', [transaction_hash]) for transaction_hash in missing], raise_errors=False)
+            canonical = {number: block['hash'] for number, block in zip(block_numbers, results) if isinstance(block, dict)}
+            for transaction_hash, transaction in zip(missing, results[len(block_numbers):]):
+                if transaction is not None and not isinstance(transaction, RpcError):
+                    self._transactions[transaction_hash]['knownAt'] = now
+
+            for transaction_hash, receipt in receipts.items():
+                if isinstance(receipt, RpcError):
+                    # Unanswered this round; judged on what was seen before
+                    continue
+                if receipt and canonical.get(int(receipt['blockNumber'], 16), receipt['blockHash']) != receipt['blockHash']:
+                    # The node still reports the receipt of a block that is no longer canonical
+                    receipt = None
+                self._transactions[transaction_hash]['receipt'] = receipt
+                if receipt:
+                    self._transactions[transaction_hash]['knownAt'] = now
+
+            updates = {}
+            for token_id in tokens:
+                state, transaction_hash, block_number = self._resolve(token_id, now)
+                if state and state != self._states.get(token_id):
+                    self._states[token_id] = state
+                    updates.setdefault((state, transaction_hash, block_number), []).append(token_id)
+            for (state, transaction_hash, block_number), token_ids in updates.items():
+                fields = {"tx": transaction_hash, "block": block_number} if block_number is not None else {"tx": transaction_hash}
+                record_journal(token_ids, state, network=self.network_choice, contract=self.contract_address, **fields)
+                if state != 'confirmed':
+                    print(f"Token ids {','.join(str(token_id) for token_id in token_ids)} {state}: {transaction_hash}")
+
+    def _resolve(self, token_id, now):
+        # Returns (state, transaction hash, block number), or Nones while the outcome is open
+        hashes = self._token_hashes[token_id]
+        included = [(transaction_hash, self._transactions[transaction_hash]['receipt']) for transaction_hash in hashes if self._transactions[transaction_hash]['receipt']]
+        for transaction_hash, receipt in included:
+            if int(receipt['status'], 16) == 1:
+                block_number = int(receipt['blockNumber'], 16)
+                depth = self.head - block_number + 1
+                return ('finalized' if depth >= self.confirmations else 'confirmed'), transaction_hash, block_number
+        if self._states.get(token_id) == 'confirmed':
+            return 'reorged', hashes[-1], None
+        alive = [transaction_hash for transaction_hash in hashes if not self._transactions[transaction_hash]['receipt'] and now - self._transactions[transaction_hash]['knownAt'] < self.drop_after]
+        if alive:
+            return None, None, None
+        if included:
+            transaction_hash, receipt = included[-1]
+            if self.head - int(receipt['blockNumber'], 16) + 1 >= self.confirmations:
+                return 'reverted', transaction_hash, int(receipt['blockNumber'], 16)
+            return None, None, None
+        return 'dropped', hashes[-1], None
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except (RuntimeError, OSError) as e:
+                print(f"Receipt watcher could not poll the node: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def unresolved(self):
+        with self._lock:
+            return len(self._watched_tokens())
+
+    def finish(self, timeout=RECEIPT_TIMEOUT):
+        # Called once every transaction has been sent. Waits until every watched token reaches a
+        # final state, for as long as the chain keeps producing blocks within `timeout`.
+        print(f"\nWaiting for mints on \"{self.network_choice}\" to reach {self.confirmations} confirmation(s)...")
+        started_at, started = time.time(), time.perf_counter()
+        last_head = self.head
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not self._stop.wait(self.poll_interval):
+            if not self.unresolved():
+                break
+            if self.head != last_head:
+                last_head = self.head
+                deadline = time.monotonic() + timeout
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        try:
+            self.poll()
+        except (RuntimeError, OSError) as e:
+            print(f"Receipt watcher could not poll the node: {e}")
+
+        # Only tokens that were still open at some point; earlier runs' finalized tokens are not counted
+        counts = {}
+        for token_id in self._followed:
+            counts[self._states[token_id]] = counts.get(self._states[token_id], 0) + 1
+        print(f"Receipt watcher on \"{self.network_choice}\": " + ', '.join(f"{count} {state}" for state, count in sorted(counts.items())) + f" at block {self.head}.")
+        PROFILER.record('confirmations', started_at, time.perf_counter() - started, tokens=len(self._followed), network=self.network_choice)
+        return counts
+
+def start_receipt_watcher(network_choice, contract_address, confirmations, rpc_url=None):
+    # A client of its own, so polling never waits behind the engine's sends for a connection
+    rpc = JsonRpcClient(get_rpc_endpoint(network_choice, rpc_url, read_env_file()))
+    return ReceiptWatcher(rpc, network_choice, contract_address, confirmations).start()
+
+def plan_upload_transactions(sizes, bundle_max_bytes=0):
+    # Python counterpart of planUploads in the upload script: one unit per Arweave transaction,
+    # with the indexes into sizes it carries and its data size
+    units = []
+    bundle = None
+    for index, size in enumerate(sizes):
+        if not bundle_max_bytes or size >= BUNDLE_ITEM_MAX_SIZE:
+            units.append({"indexes": [index], "bundled": False, "bytes": size})
+            continue
+        item_bytes = size + DATA_ITEM_OVERHEAD
+        if bundle is None or bundle['bytes'] + item_bytes > bundle_max_bytes:
+            bundle = {"indexes": [], "bundled": True, "bytes": 0}
+            units.append(bundle)
+        bundle['indexes'].append(index)
+        bundle['bytes'] += item_bytes
+    return units
+
+def get_arweave_prices(gateway, byte_counts):
+    # Winston the gateway quotes for one transaction of each distinct size, fetched in parallel
+    def fetch_price(byte_count):
+        with urlopen(f"{gateway}/price/{byte_count}", timeout=60) as response:
+            return byte_count, int(response.read())
+    with ThreadPoolExecutor(max_workers=DRY_RUN_PRICE_WORKERS) as executor:
+        return dict(executor.map(fetch_price, sorted(set(byte_counts))))
+
+def estimate_arweave_cost(items, gateway, bundle_max_bytes=0):
+    # items are (key, content hash, size) for everything a run would upload. Content already in
+    # the upload cache costs nothing, byte-identical items are uploaded once, and bundled items
+    # share their bundle's price by size. Returns ({key: winston}, transaction count, total winston).
+    gateway = gateway.rstrip('/')
+    cached = load_upload_cache().get(gateway, {})
+    unique = {}
+    for key, content_hash, size in items:
+        if content_hash not in cached:
+            unique.setdefault(content_hash, (size, []))[1].append(key)
+    groups = list(unique.values())
+    units = plan_upload_transactions([size for size, _ in groups], bundle_max_bytes)
+    prices = get_arweave_prices(gateway, [unit['bytes'] for unit in units])
+
+    costs = {key: 0 for key, _, _ in items}
+    for unit in units:
+        for index in unit['indexes']:
+            size, keys = groups[index]
+            item_bytes = size + DATA_ITEM_OVERHEAD if unit['bundled'] else size
+            share = prices[unit['bytes']] * item_bytes // max(1, unit['bytes'])
+            for key in keys:
+                costs[key] += share // len(keys)
+    return costs, len(units), sum(prices[unit['bytes']] for unit in units)
+
+def get_gas_prices(rpc, fee_policy):
+    # Wei per gas a transaction is expected to pay at the next block's base fee, and the most
+    # the fee policy lets it pay
+    if fee_policy['strategy'] == 'legacy':
+        gas_price = fees_from_history(None, fee_policy)['gasPrice']
+        return gas_price, gas_price
+    method, params = get_fee_history_call(fee_policy)
+    fee_history = rpc.call(method, params)
+    fees = fees_from_history(fee_history, fee_policy)
+    expected = min(int(fee_history['baseFeePerGas'][-1], 16) + fees['maxPriorityFeePerGas'], fees['maxFeePerGas'])
+    return expected, fees['maxFeePerGas']
+
+def estimate_chain_cost(engine, artifact, constructor_args, contract_address, to_address, token_chunks, mint_mode, metadata_storage):
+    # Gas for the deployment and for every mint transaction, each estimated by the node in batched
+    # eth_estimateGas calls. Without a deployed contract, local nodes that support evm_snapshot get
+    # a throwaway deployment that is reverted afterwards; elsewhere mint gas falls back to the
+    # estimate_mint_gas model. Returns (deployment gas, [gas or RpcError per chunk], source).
+    constructor = find_abi_entry(artifact['abi'], 'constructor')
+    encoded_args = eth_abi.encode(get_abi_types(constructor['inputs']), constructor_args) if constructor else b''
+    deployment_data = artifact['bytecode'] + encoded_args.hex()
+    deployment_gas = int(engine.rpc.call('eth_estimateGas', [{"from": engine.address, "data": deployment_data}]), 16)
+
+    snapshot = None
+    if not contract_address and token_chunks:
+        try:
+            snapshot = engine.rpc.call('evm_snapshot')
+        except RpcError:
+            print("The node does not support evm_snapshot; estimating mint gas from the storage model.")
+        if snapshot:
+            contract_address = engine.deploy(artifact, constructor_args).get('address')
+    try:
+        if not contract_address:
+            chunk_gas = []
+            for chunk in token_chunks:
+                token_gas = sum(estimate_mint_gas(get_token_uri(data['metadata']), metadata_storage) for data in chunk)
+                chunk_gas.append(token_gas + (BATCH_BASE_GAS if mint_mode != 'single' else 0))
+            return deployment_gas, chunk_gas, 'model'
+        jobs = build_mint_jobs(artifact['abi'], contract_address, to_address, token_chunks, mint_mode, metadata_storage)
+        estimates = engine.rpc.batch([('eth_estimateGas', [{"from": engine.address, "to": job['to'], "data": job['data']}]) for job in jobs], raise_errors=False)
+        return deployment_gas, [estimate if isinstance(estimate, RpcError) else int(estimate, 16) for estimate in estimates], 'node'
+    finally:
+        if snapshot:
+            engine.rpc.call('evm_revert', [snapshot])
+
+def format_units(amount, decimals):
+    return f"{amount / 10 ** decimals:.6f}"
+
+def save_project_files(contract_name):
+    # Contents of the files that contract generation and compilation overwrite, None for missing ones
+    build_directory = os.path.join('build', 'contracts')
+    paths = [os.path.join('contracts', f'{contract_name}.sol'), os.path.join('migrations', '2_deploy_contracts.js')]
+    if os.path.isdir(build_directory):
+        paths += [os.path.join(build_directory, name) for name in os.listdir(build_directory)]
+    saved_files = {}
+    for path in paths:
+        try:
+            with open(path, 'rb') as saved_file:
+                saved_files[path] = saved_file.read()
+        except FileNotFoundError:
+            saved_files[path] = None
+    return saved_files, build_directory
+
+def restore_project_files(saved):
+    saved_files, build_directory = saved
+    if os.path.isdir(build_directory):
+        # Artifacts the compilation added are removed along with the rewritten ones
+        for name in os.listdir(build_directory):
+            path = os.path.join(build_directory, name)
+            if path not in saved_files:
+                os.remove(path)
+    for path, content in saved_files.items():
+        if content is None:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            with open(path, 'wb') as restored_file:
+                restored_file.write(content)
+
+def dry_run(engine, network_choice, contract_name, token_name, token_symbol, creator_earnings, to_address, files_to_process, images_directory, mint_mode='single', batch_gas_limit=DEFAULT_BATCH_GAS_LIMIT, metadata_storage='onchain', gateway=DEFAULT_ARWEAVE_GATEWAY, bundle_max_bytes=0, preprocess=False, preprocess_workers=None):
+    # Prices a run without uploading or sending anything: gas for the deployment and every mint
+    # transaction, and the Arweave fee for every file the run would upload
+    print("\nEstimating the cost of this run...\n")
+    started = time.perf_counter()
+    gateway = gateway.rstrip('/')
+    # Uploaded assets are referenced by a URL of the same length as the real one
+    placeholder_url = f"{gateway}/{'x' * ARWEAVE_ID_LENGTH}"
+
+    # Preprocessed files are priced at the size that would actually be uploaded
+    upload_paths = {}
+    if preprocess:
+        files_to_upload = [(os.path.join(images_directory, entry.file), entry.content_type) for entry in files_to_process if not entry.skip_upload]
+        if files_to_upload:
+            _, original_paths = preprocess_media(files_to_upload, preprocess_workers)
+            upload_paths = {original: upload_path for upload_path, originals in original_paths.items() for original in originals}
+
+    upload_items = []
+    token_data = []
+    for entry in files_to_process:
+        metadata = dict(entry.metadata)
+        if not entry.skip_upload:
+            file_path = os.path.join(images_directory, entry.file)
+            file_path = upload_paths.get(file_path, file_path)
+            upload_items.append((entry.token_id, hash_file(file_path), os.path.getsize(file_path)))
+            metadata['image'] = placeholder_url
+        token_data.append({'tokenId': entry.token_id, 'metadata': metadata})
+
+    base_uri = None
+    if metadata_storage == 'manifest':
+        # Every metadata file is uploaded, then one path manifest that points at all of them
+        paths = {}
+        for data in token_data:
+            metadata_bytes = json.dumps(data['metadata'], indent=4).encode('utf-8')
+            upload_items.append((data['tokenId'], hashlib.sha256(metadata_bytes).hexdigest(), len(metadata_bytes)))
+            paths[str(data['tokenId'])] = {"id": 'x' * ARWEAVE_ID_LENGTH}
+        manifest_bytes = json.dumps({"manifest": "arweave/paths", "version": "0.1.0", "paths": paths}, indent=4, sort_keys=True).encode('utf-8')
+        upload_items.append((None, hashlib.sha256(manifest_bytes).hexdigest(), len(manifest_bytes)))
+        base_uri = f"{placeholder_url}/"
+
+    # Mints are estimated against the existing contract when there is one. Generating and
+    # compiling overwrites the project's contract, migration and artifacts, so they are put back.
+    saved = save_project_files(contract_name)
+    try:
+        constructor_args = generate_token_contract(contract_name, token_name, token_symbol, creator_earnings, to_address, token_data, mint_mode, metadata_storage, base_uri)
+        compile_contracts()
+        with open(os.path.join('build', 'contracts', f'{contract_name}.json'), 'r') as artifact_file:
+            artifact = json.load(artifact_file)
+    finally:
+        restore_project_files(saved)
+    contract_address = artifact.get('networks', {}).get(str(engine.network_id), {}).get('address')
+    if contract_address:
+        journal = load_journal(network_choice, contract_address)
+        token_data = [data for data in token_data if journal.get(data['tokenId'], {}).get('state') not in MINTED_JOURNAL_STATES]
+    if mint_mode == 'consecutive' and metadata_storage == 'manifest' and not contract_address:
+        # Every token is minted by the constructor
+        token_chunks = []
+    else:
+        token_chunks = build_token_chunks(token_data, mint_mode, batch_gas_limit, metadata_storage) if token_data else []
+
+    try:
+        expected_price, max_price = get_gas_prices(engine.rpc, engine.fee_policy)
+        deployment_gas, chunk_gas, gas_source = estimate_chain_cost(engine, artifact, constructor_args, contract_address, to_address, token_chunks, mint_mode, metadata_storage)
+    except (RuntimeError, OSError) as e:
+        print(f"Failed to estimate gas: {e}")
+        sys.exit(1)
+    try:
+        arweave_costs, arweave_transactions, arweave_total = estimate_arweave_cost(upload_items, gateway, bundle_max_bytes)
+    except (ValueError, OSError) as e:
+        print(f"Failed to get Arweave prices from {gateway}: {e}")
+        sys.exit(1)
+
+    print(f"{'Token':>10} {'URI bytes':>10} {'Mint gas':>10} {'URI gas':>10} {'ETH':>12} {'AR':>12}")
+    mint_gas_total = 0
+    failed = []
+    for chunk, gas in zip(token_chunks, chunk_gas):
+        if isinstance(gas, RpcError):
+            failed.append((chunk, gas))
+            continue
+        mint_gas_total += gas
+        for data in chunk:
+            token_uri = get_token_uri(data['metadata'])
+            # The share of the mint that pays for keeping the metadata string around
+            uri_gas = estimate_mint_gas(token_uri, metadata_storage) - MINT_BASE_GAS
+            token_gas = gas // len(chunk)
+            print(f"{data['tokenId']:>10} {len(token_uri.encode('utf-8')):>10} {token_gas:>10} {uri_gas:>10} {format_units(token_gas * expected_price, 18):>12} {format_units(arweave_costs.get(data['tokenId'], 0), 12):>12}")
+    for chunk, error in failed:
+        print(f"Could not estimate token ids {','.join(str(data['tokenId']) for data in chunk)}: {error}")
+
+    transaction_count = len(token_chunks) - len(failed)
+    print(f"\nGas price: {format_units(expected_price, 9)} gwei expected, {format_units(max_price, 9)} gwei at most")
+    if contract_address:
+        print(f"Existing contract at {contract_address}; deploying a new one instead would cost:")
+    print(f"Deployment: {deployment_gas} gas, {format_units(deployment_gas * expected_price, 18)} ETH (up to {format_units(deployment_gas * max_price, 18)})")
+    print(f"Minting: {transaction_count} transaction(s), {mint_gas_total} gas ({gas_source} estimate), {format_units(mint_gas_total * expected_price, 18)} ETH (up to {format_units(mint_gas_total * max_price, 18)})")
+    print(f"Arweave: {arweave_transactions} transaction(s), {sum(size for _, _, size in upload_items)} bytes, {format_units(arweave_total, 12)} AR")
+    print(f"\nEstimated in {time.perf_counter() - started:.2f}s with {engine.rpc.call_count} JSON-RPC calls in {engine.rpc.request_count} HTTP requests.")
 
 def mint_nft(network_choice):
     try:
-        subprocess.check_call(f'truffle exec mint.js --network {network_choice}', shell=True)
+        with PROFILER.span('truffle_exec', network=network_choice):
+            subprocess.check_call(f'truffle exec {get_mint_script_path(network_choice)} --network {network_choice}', shell=True)
         print("NFT minting script executed.")
     except subprocess.CalledProcessError as e:
         print(f"Failed to mint NFT: {e}")
         sys.exit(1)
 
-def main():
-    print("\nSetting up environment...\n")
-    check_node_npm()
-    check_npm_packages()
-    init_truffle_project()
+def write_token_metadata(images_directory, token_id, metadata):
+    with open(os.path.join(images_directory, f"{token_id}.json"), 'w') as md_file:
+        json.dump(metadata, md_file, indent=4)
 
-    # Set up Ethereum-related environment
-    check_contract_parameters()    
-    create_eth_env_file()
+def run_overlapped_pipeline(entries, images_directory, upload_files, mint_tokens, upload_group_size=PIPELINE_UPLOAD_GROUP, mint_group_size=PIPELINE_MINT_GROUP, queue_size=PIPELINE_QUEUE_SIZE):
+    # Upload, metadata and mint stages run concurrently and hand tokens on through bounded
+    # queues, so a token is minted as soon as its own asset is on Arweave. A full queue blocks
+    # the stage before it, which keeps a fast uploader from running far ahead of the chain.
+    # upload_files(files) returns {file path: url}; mint_tokens(token_data) mints one group.
+    metadata_queue = queue.Queue(maxsize=queue_size)
+    mint_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    def run_stage(stage, output_queue):
+        try:
+            stage()
+        except BaseException as e:
+            # sys.exit() in a worker thread only ends that thread; hand the failure to the main thread
+            errors.append(e)
+        finally:
+            output_queue.put(None)
+
+    def upload_stage():
+        # Tokens whose metadata already points at an uploaded asset go straight through
+        for entry in entries:
+            if entry.skip_upload:
+                metadata_queue.put((entry, None))
+        pending = [entry for entry in entries if not entry.skip_upload]
+        for start in range(0, len(pending), upload_group_size):
+            group = pending[start:start + upload_group_size]
+            uploaded_urls = upload_files([(os.path.join(images_directory, entry.file), entry.content_type) for entry in group])
+            for entry in group:
+                url = uploaded_urls.get(os.path.join(images_directory, entry.file))
+                if url is None:
+                    print(f"Token {entry.token_id} was not uploaded and will not be minted in this run.")
+                    continue
+                record_journal([entry.token_id], 'uploaded', url=url)
+                metadata_queue.put((entry, url))
+
+    def metadata_stage():
+        while True:
+            item = metadata_queue.get()
+            if item is None or errors:
+                return
+            entry, url = item
+            if url is not None:
+                entry.metadata['image'] = url
+                write_token_metadata(images_directory, entry.token_id, entry.metadata)
+            record_journal([entry.token_id], 'metadata_written')
+            mint_queue.put({'tokenId': entry.token_id, 'metadata': entry.metadata})
+
+    stages = [
+        threading.Thread(target=run_stage, args=(upload_stage, metadata_queue), daemon=True),
+        threading.Thread(target=run_stage, args=(metadata_stage, mint_queue), daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+
+    # Minting runs on the calling thread; each call takes whatever is ready, up to mint_group_size
+    finished = False
+    while not finished and not errors:
+        group = []
+        item = mint_queue.get()
+        while item is not None:
+            group.append(item)
+            if len(group) >= mint_group_size:
+                break
+            try:
+                item = mint_queue.get_nowait()
+            except queue.Empty:
+                break
+        finished = item is None
+        if group:
+            mint_tokens(group)
+
+    if errors:
+        raise errors[0]
+
+def run_on_networks(function, network_choices):
+    # Calls function(network) on a thread per network. A network that fails with sys.exit
+    # ends the run once the others have finished.
+    if len(network_choices) == 1:
+        return [function(network_choices[0])]
+    with ThreadPoolExecutor(max_workers=len(network_choices)) as executor:
+        futures = [executor.submit(function, network) for network in network_choices]
+    return [future.result() for future in futures]
+
+def load_job_queue(jobs_path):
+    # A queue file holds the shared limits, a default policy and the jobs; each job names its
+    # own directory (with its contract_parameters.json and .env) relative to the queue file
+    with open(jobs_path, 'r') as jobs_file:
+        job_queue = json.load(jobs_file)
+    jobs = job_queue.get('jobs', [])
+    if not jobs:
+        print(f"No jobs in {jobs_path}.")
+        sys.exit(1)
+    queue_directory = os.path.dirname(os.path.abspath(jobs_path))
+    names = set()
+    for job in jobs:
+        if not job.get('name') or not job.get('directory'):
+            print("Every job needs a \"name\" and a \"directory\".")
+            sys.exit(1)
+        if job['name'] in names:
+            print(f"Job name \"{job['name']}\" is used more than once.")
+            sys.exit(1)
+        names.add(job['name'])
+        job['directory'] = os.path.join(queue_directory, job['directory'])
+        job['images'] = os.path.join(job['directory'], job.get('images', 'images'))
+        job['policy'] = dict(job_queue.get('policy', {}), **job.get('policy', {}))
+        unknown_keys = set(job['policy']) - set(JOB_POLICY_KEYS)
+        if unknown_keys:
+            print(f"Unknown policy key(s) {', '.join(sorted(unknown_keys))} for job \"{job['name']}\". Choose from {', '.join(JOB_POLICY_KEYS)}.")
+            sys.exit(1)
+        if not os.path.exists(os.path.join(job['directory'], 'contract_parameters.json')):
+            print(f"Job \"{job['name']}\" has no contract_parameters.json in {job['directory']}.")
+            sys.exit(1)
+    parallel = job_queue.get('parallel', 1)
+    if not isinstance(parallel, int) or parallel < 1:
+        print("parallel must be a whole number of at least 1.")
+        sys.exit(1)
+    return job_queue
+
+def run_job(job, rpc_limiter=None, arweave_rate=None):
+    # Runs in a process of its own: the whole prompt-driven flow of main(), from the job's
+    # directory, with the prompts answered from its policy and the output going to its log
+    global PROMPT_POLICY, RPC_RATE_LIMITER
+    os.chdir(job['directory'])
+    log_file = open(JOB_LOG_FILE, 'w')
+    # At the descriptor level, so truffle and the node scripts write to the log as well
+    os.dup2(log_file.fileno(), sys.stdout.fileno())
+    os.dup2(log_file.fileno(), sys.stderr.fileno())
+    sys.stdout.reconfigure(line_buffering=True)
+    PROMPT_POLICY = job['policy']
+    RPC_RATE_LIMITER = rpc_limiter
+    if arweave_rate:
+        os.environ[ARWEAVE_RATE_ENV_VAR] = str(arweave_rate)
+    try:
+        main(argparse.Namespace(skip_env_check=True, dry_run=job.get('dry_run', False), watch=False, profile=True, images=job['images'], jobs=None))
+    finally:
+        # Not left to atexit, which a multiprocessing child is not guaranteed to run
+        PROFILER.finish()
+
+def summarize_job(job, exit_code, seconds):
+    # Throughput of a finished job, from the profile spans it recorded
+    report = {"name": job['name'], "status": "ok" if exit_code == 0 else f"failed ({exit_code})", "seconds": round(seconds, 3),
+              "tokens_minted": 0, "upload_bytes": 0, "rpc_calls": 0}
+    upload_seconds = 0.0
+    try:
+        with open(os.path.join(job['directory'], PROFILE_FILE), 'r') as profile_file:
+            for line in profile_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get('error'):
+                    continue
+                if entry['span'] == 'mint_tx':
+                    report['tokens_minted'] += entry.get('tokens', 0)
+                elif entry['span'] == 'upload':
+                    report['upload_bytes'] += entry.get('bytes', 0)
+                    upload_seconds += entry['seconds']
+                elif entry['span'] == 'rpc_request':
+                    report['rpc_calls'] += entry.get('calls', 0)
+    except FileNotFoundError:
+        pass
+    report['tokens_per_second'] = round(report['tokens_minted'] / seconds, 2) if seconds else 0
+    report['upload_mb_per_second'] = round(report['upload_bytes'] / upload_seconds / (1024 * 1024), 3) if upload_seconds else 0
+    return report
+
+def run_jobs(jobs_path, skip_env_check=False):
+    # Runs the queue's jobs, up to "parallel" of them at a time, each in a fresh process. The RPC
+    # limit is one token bucket that every job draws on; the Arweave limit is split evenly
+    # between the job slots, as the node upload scripts cannot share the bucket.
+    job_queue = load_job_queue(jobs_path)
+    if skip_env_check:
+        print("Skipping toolchain check.")
+    else:
+        # Once for the whole queue, covering the optional packages any of the jobs needs
+        optional_packages = set()
+        for job in job_queue['jobs']:
+            with open(os.path.join(job['directory'], 'contract_parameters.json'), 'r') as config_file:
+                optional_packages.update(get_optional_npm_packages(json.load(config_file)))
+        check_toolchain(optional_packages)
+    jobs = deque(job_queue['jobs'])
+    job_names = [job['name'] for job in jobs]
+    parallel = min(job_queue.get('parallel', 1), len(jobs))
+    # spawn rather than fork: the parent's threads and atexit handlers stay out of the jobs
+    context = multiprocessing.get_context('spawn')
+    rpc_rate = job_queue.get('rpc_requests_per_second')
+    rpc_limiter = RateLimiter(rpc_rate, context) if rpc_rate else None
+    arweave_rate = job_queue.get('arweave_requests_per_second')
+    job_arweave_rate = arweave_rate / parallel if arweave_rate else None
+
+    running = {}
+    reports = []
+    while jobs or running:
+        while jobs and len(running) < parallel:
+            job = jobs.popleft()
+            os.makedirs(job['directory'], exist_ok=True)
+            project_modules = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node_modules')
+            job_modules = os.path.join(job['directory'], 'node_modules')
+            if os.path.isdir(project_modules) and not os.path.lexists(job_modules):
+                os.symlink(project_modules, job_modules)
+            process = context.Process(target=run_job, args=(job, rpc_limiter, job_arweave_rate), name=job['name'])
+            process.start()
+            running[process.sentinel] = (job, process, time.perf_counter())
+            print(f"Started job \"{job['name']}\", logging to {os.path.join(job['directory'], JOB_LOG_FILE)}.")
+        for sentinel in wait(list(running)):
+            job, process, started = running.pop(sentinel)
+            process.join()
+            report = summarize_job(job, process.exitcode, time.perf_counter() - started)
+            reports.append(report)
+            print(f"Job \"{job['name']}\" {report['status']} after {report['seconds']:.1f}s.")
+    reports.sort(key=lambda report: job_names.index(report['name']))
+
+    print(f"\n{'Job':<24}{'Status':>14}{'Seconds':>10}{'Minted':>8}{'Tokens/s':>10}{'Uploaded MB':>13}{'MB/s':>8}{'RPC calls':>11}")
+    for report in reports:
+        print(f"{report['name']:<24}{report['status']:>14}{report['seconds']:>10.1f}{report['tokens_minted']:>8}{report['tokens_per_second']:>10.2f}"
+              f"{report['upload_bytes'] / (1024 * 1024):>13.2f}{report['upload_mb_per_second']:>8.2f}{report['rpc_calls']:>11}")
+    report_path = os.path.join(os.path.dirname(os.path.abspath(jobs_path)), JOB_REPORT_FILE)
+    with open(report_path, 'w') as report_file:
+        json.dump(reports, report_file, indent=4)
+    print(f"\nJob report written to {report_path}.")
+    if any(report['status'] != 'ok' for report in reports):
+        sys.exit(1)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Mint NFTs from the files in the images directory.")
+    parser.add_argument('--skip-env-check', action='store_true', help="Skip the Node.js, npm and package checks.")
+    parser.add_argument('--dry-run', action='store_true', help="Estimate gas and Arweave fees for the run without uploading or sending transactions.")
+    parser.add_argument('--watch', action='store_true', help="Follow the journaled mint transactions of the deployed contract until they are final, without sending anything.")
+    parser.add_argument('--profile', action='store_true', help=f"Record timing spans for every stage to {PROFILE_FILE} and Prometheus metrics to {PROFILE_METRICS_FILE}.")
+    parser.add_argument('--images', help="Directory of the files to mint, instead of images/ in the project root.")
+    parser.add_argument('--jobs', metavar='QUEUE_FILE', help="Run the collection jobs of a queue file without prompts, answering them from each job's policy.")
+    return parser.parse_args()
+
+def main(args=None):
+    args = args or parse_arguments()
+    if args.jobs:
+        run_jobs(args.jobs, args.skip_env_check)
+        return
+    if args.profile:
+        # Before any node process is started, so every one of them inherits the profile path
+        PROFILER.start()
 
-    # Load user configuration from JSON file
+    # Load user configuration from JSON file; it decides which optional npm packages are checked
+    check_contract_parameters()
     with open('contract_parameters.json', 'r') as config_file:
         contract_parameters = json.load(config_file)
 
+    print("\nSetting up environment...\n")
+    started = time.perf_counter()
+    with PROFILER.span('environment_setup'):
+        if args.skip_env_check:
+            print("Skipping toolchain check.")
+        else:
+            check_toolchain(get_optional_npm_packages(contract_parameters))
+        init_truffle_project()
+    print(f"Environment ready in {time.perf_counter() - started:.2f}s.")
+
+    # Set up Ethereum-related environment
+    create_eth_env_file()
+
     # Extract relevant details from user configuration
     to_address = contract_parameters.get('to_address')
-    network_choice = contract_parameters.get('network_choice').lower()
-    network_id = get_network_id(network_choice)
+    register_networks(contract_parameters.get('networks', {}))
+    # One network name, or a list of them that share one upload and then deploy and mint concurrently
+    network_choice = contract_parameters.get('network_choice')
+    network_list = [network_choice] if isinstance(network_choice, str) else network_choice
+    if not isinstance(network_list, list) or not all(isinstance(name, str) for name in network_list):
+        print("network_choice must be a network name or a list of network names.")
+        sys.exit(1)
+    network_choices = list(dict.fromkeys(name.lower() for name in network_list))
+    unknown_networks = [network for network in network_choices if network not in NETWORKS]
+    if unknown_networks:
+        print(f"Unknown network{'s' if len(unknown_networks) > 1 else ''} {', '.join(unknown_networks)}. Choose from {', '.join(NETWORKS)}, or define it under \"networks\".")
+        sys.exit(1)
     contract_name = contract_parameters.get('contract_name')
     token_name = contract_parameters.get('token_name')
     token_symbol = contract_parameters.get('token_symbol')
     creator_earnings = contract_parameters.get('creator_earnings')
-    gas_price = contract_parameters.get('gas_price')
+    arweave_gateway = contract_parameters.get('arweave_gateway', DEFAULT_ARWEAVE_GATEWAY)
+    upload_concurrency = contract_parameters.get('upload_concurrency', 1)
+    upload_max_inflight_chunks = contract_parameters.get('upload_max_inflight_chunks', 8)
+    upload_retries = contract_parameters.get('upload_retries', 3)
+    bundle_max_bytes = int(contract_parameters.get('upload_bundle_size_mb', 0) * 1024 * 1024)
+    rpc_url = contract_parameters.get('rpc_url')
+    mint_mode = contract_parameters.get('mint_mode', 'single')
+    batch_gas_limit = contract_parameters.get('mint_batch_gas_limit', DEFAULT_BATCH_GAS_LIMIT)
+    pipeline_window = contract_parameters.get('mint_pipeline_window', 1)
+    mint_accounts = contract_parameters.get('mint_accounts', 1)
+    mint_confirmations = contract_parameters.get('mint_confirmations', 0)
+    if not isinstance(mint_confirmations, int) or mint_confirmations < 0:
+        print("mint_confirmations must be a whole number.")
+        sys.exit(1)
+    preprocess = contract_parameters.get('preprocess_media', False)
+    preprocess_workers = contract_parameters.get('preprocess_workers', os.cpu_count())
+    if not isinstance(preprocess_workers, int) or preprocess_workers < 1:
+        print("preprocess_workers must be a whole number of at least 1.")
+        sys.exit(1)
+    if not isinstance(mint_accounts, int) or mint_accounts < 1:
+        print("mint_accounts must be a whole number of at least 1.")
+        sys.exit(1)
+    voucher_min_price = contract_parameters.get('voucher_min_price', 0)
+    if not str(voucher_min_price).isdigit():
+        print("voucher_min_price must be a whole number of wei.")
+        sys.exit(1)
+    voucher_sign_workers = contract_parameters.get('voucher_sign_workers', os.cpu_count())
+    if not isinstance(voucher_sign_workers, int) or voucher_sign_workers < 1:
+        print("voucher_sign_workers must be a whole number of at least 1.")
+        sys.exit(1)
+    metadata_storage = contract_parameters.get('metadata_storage', 'onchain')
+    if metadata_storage not in METADATA_STORAGE_MODES:
+        print(f"Unknown metadata storage \"{metadata_storage}\". Choose one of {', '.join(METADATA_STORAGE_MODES)}.")
+        sys.exit(1)
+
+    pipeline_mode = contract_parameters.get('pipeline_mode', 'staged')
+    if pipeline_mode not in PIPELINE_MODES:
+        print(f"Unknown pipeline mode \"{pipeline_mode}\". Choose one of {', '.join(PIPELINE_MODES)}.")
+        sys.exit(1)
+    overlapped = pipeline_mode == 'overlapped'
+    if overlapped and (mint_mode in ('consecutive', 'lazy') or metadata_storage == 'manifest'):
+        # All of them need every token's metadata before the contract is deployed or vouchers are signed
+        print("The overlapped pipeline cannot be used with consecutive or lazy minting or manifest metadata storage.")
+        sys.exit(1)
+
+    # A network in the registry may override the fee settings and rpc_url of the top level
+    fee_policies = {network: get_fee_policy(dict(contract_parameters, **NETWORKS.get(network, {}))) for network in network_choices}
+    for fee_policy in fee_policies.values():
+        if fee_policy['strategy'] not in FEE_STRATEGIES:
+            print(f"Unknown fee strategy \"{fee_policy['strategy']}\". Choose one of {', '.join(FEE_STRATEGIES)}.")
+            sys.exit(1)
+    rpc_urls = {network: NETWORKS.get(network, {}).get('rpc_url') or rpc_url for network in network_choices}
+    if len(network_choices) > 1:
+        # Each network needs its own node, and its own key in the artifact's deployments
+        for values, setting in ((rpc_urls, 'rpc_url'), ({network: get_network_id(network) for network in network_choices}, 'network id')):
+            seen = {}
+            for network, value in values.items():
+                if value is not None and value in seen:
+                    print(f"Networks \"{seen[value]}\" and \"{network}\" have the same {setting} {value}. Give each network its own in \"networks\".")
+                    sys.exit(1)
+                seen[value] = network
+
+    tx_engine = contract_parameters.get('tx_engine', 'truffle')
+    if tx_engine not in TX_ENGINES:
+        print(f"Unknown transaction engine \"{tx_engine}\". Choose one of {', '.join(TX_ENGINES)}.")
+        sys.exit(1)
+
+    if args.watch:
+        watchers = []
+        for network in network_choices:
+            contract_address = check_for_existing_contract(contract_name, get_network_id(network))
+            if not contract_address:
+                sys.exit(1)
+            watchers.append(start_receipt_watcher(network, contract_address, mint_confirmations or DEFAULT_CONFIRMATIONS, rpc_urls[network]))
+        for watcher in watchers:
+            watcher.finish()
+        return
+
+    # The sidecar loads its node modules while the prompts below wait for the user
+    sidecar = start_sidecar() if contract_parameters.get('use_sidecar', False) and not args.dry_run else None
+    # A dry run estimates over JSON-RPC whichever engine is configured. Each network gets its
+    # own engine, with its own accounts' nonces.
+    engines = {network: start_python_engine(network, fee_policies[network], rpc_urls[network]) for network in network_choices} if tx_engine == 'python' or args.dry_run else {}
 
     # Determine the project root and check if images directory exists
     project_root = os.path.dirname(os.path.abspath(__file__))
-    images_directory = os.path.join(project_root, 'images')
+    images_directory = os.path.abspath(args.images) if args.images else os.path.join(project_root, 'images')
     if os.path.exists(images_directory):
         print(f"Images directory found at {images_directory}.")
+    elif args.images:
+        print(f"\nImages directory {images_directory} does not exist.")
+        sys.exit(1)
     else:
         print(f"\nPlease create an images directory in project root and place the files you'd like to mint there.")
         sys.exit(1)
 
     # Process files and determine the need for Arweave upload
-    files_to_process = process_files(images_directory)
+    with PROFILER.span('scan') as span:
+        files_to_process = process_files(images_directory)
+        span.set(tokens=len(files_to_process))
     files_to_upload = [
         (os.path.join(images_directory, file), content_type) 
         for file, _, _, skip_upload, content_type, _ in files_to_process if not skip_upload
@@ -565,60 +4070,196 @@ def main():
     for file_name, token_id, metadata, _, _, _ in files_to_process:
         token_data.append({'tokenId': token_id, 'metadata': metadata})
 
+    if args.dry_run:
+        for network in network_choices:
+            if len(network_choices) > 1:
+                print(f"\nNetwork \"{network}\":")
+            with PROFILER.span('dry_run', tokens=len(files_to_process), network=network):
+                dry_run(engines[network], network, contract_name, token_name, token_symbol, creator_earnings, to_address, files_to_process, images_directory, mint_mode, batch_gas_limit, metadata_storage, arweave_gateway, bundle_max_bytes, preprocess, preprocess_workers)
+        return
+
+    # Journal tokens seen for the first time so interrupted runs can tell what is left to do
+    journal = load_journal()
+    record_journal([data['tokenId'] for data in token_data if data['tokenId'] not in journal], 'discovered')
+
     # Set up Arweave environment if needed and upload files
+    uploaded_urls = {}
     if files_to_upload:
-        if input(f"\nConfirm Arweave upload for token images {filesnames_to_upload} (y/n): ").strip().lower() != 'y':
+        if not confirm(f"\nConfirm Arweave upload for token images {filesnames_to_upload} (y/n): ", 'upload'):
             sys.exit("Transaction cancelled by user.")
         create_arweave_env_file()
-        uploaded_urls = upload_to_arweave(files_to_upload, images_directory)
 
+    # Preprocessing runs once for the whole collection before the first upload, also when the
+    # overlapped pipeline later uploads it group by group
+    processed_paths = {}
+    if files_to_upload and preprocess:
+        processed_files, original_paths = preprocess_media(files_to_upload, preprocess_workers)
+        processed_paths = {original: processed_file for processed_file in processed_files for original in original_paths[processed_file[0]]}
+
+    def upload_files(files):
+        with PROFILER.span('upload', files=len(files), bytes=sum(os.path.getsize(file_path) for file_path, _ in files)):
+            return upload_media(files)
+
+    def upload_media(files):
+        if not preprocess:
+            return upload_to_arweave(files, images_directory, upload_concurrency, upload_max_inflight_chunks, upload_retries, arweave_gateway, bundle_max_bytes, sidecar)
+        # Optimized copies are uploaded in place of the originals, once for originals that share
+        # one, and their URLs mapped back
+        processed_files = list(dict.fromkeys(processed_paths[file_path] for file_path, _ in files))
+        uploaded = upload_to_arweave(processed_files, images_directory, upload_concurrency, upload_max_inflight_chunks, upload_retries, arweave_gateway, bundle_max_bytes, sidecar)
+        # Files that failed every attempt are missing from uploaded and left out, as without preprocessing
+        urls = {}
+        for file_path, _ in files:
+            uploaded_path = os.path.join(images_directory, os.path.basename(processed_paths[file_path][0]))
+            if uploaded_path in uploaded:
+                urls[file_path] = uploaded[uploaded_path]
+        return urls
+
+    # In overlapped mode uploads run alongside minting, after the contract is ready
+    if files_to_upload and not overlapped:
+        uploaded_urls = upload_files(files_to_upload)
+        for file_name, token_id, _, _, _, _ in files_to_process:
+            file_path = os.path.join(images_directory, file_name)
+            if file_path in uploaded_urls:
+                record_journal([token_id], 'uploaded', url=uploaded_urls[file_path])
+
+    # Manifest mode serves every metadata file from Arweave, so all of them must exist on disk
+    if (files_to_upload and not overlapped) or metadata_storage == 'manifest':
         # Update metadata with Arweave URL if uploaded
         for file_name, token_id, metadata, _, _, _ in files_to_process:
             file_path = os.path.join(images_directory, file_name)
             if file_path in uploaded_urls:
                 metadata['image'] = uploaded_urls[file_path]
-            metadata_file_path = os.path.join(images_directory, f"{token_id}.json")
-            with open(metadata_file_path, 'w') as md_file:
-                json.dump(metadata, md_file, indent=4)
+            with PROFILER.span('metadata_write'):
+                write_token_metadata(images_directory, token_id, metadata)
+        record_journal([token_id for _, token_id, _, _, _, _ in files_to_process], 'metadata_written')
+
+    base_uri = None
+    if metadata_storage == 'manifest':
+        if not confirm(f"\nConfirm Arweave upload of token metadata and path manifest (y/n): ", 'upload_manifest'):
+            sys.exit("Transaction cancelled by user.")
+        create_arweave_env_file()
+        token_ids = [data['tokenId'] for data in token_data]
+        with PROFILER.span('manifest_upload', tokens=len(token_ids)):
+            base_uri = upload_metadata_manifest(token_ids, images_directory, upload_concurrency, upload_max_inflight_chunks, upload_retries, arweave_gateway, bundle_max_bytes, sidecar)
 
     # Confirm network choice
-    if input(f"\nTransact on network \"{network_choice}\"? (y/n): ").strip().lower() != 'y':
+    network_names = ', '.join(f'"{network}"' for network in network_choices)
+    if not confirm(f"\nTransact on network{'s' if len(network_choices) > 1 else ''} {network_names}? (y/n): ", 'transact'):
         sys.exit("Transaction cancelled by user.")
 
     
-    # Check for existing contract and deploy contracts as necessary
-    existing_contract_address = check_for_existing_contract(contract_name, network_id)
-    
-    if existing_contract_address:
-        use_existing = input(f"\nAn existing contract was found at {existing_contract_address}. Would you like to use it? (y/n): ").strip().lower()
-        if use_existing != 'y':
-            deploy_new_contract = True
+    # Written on every run so an existing contract is minted with the current fees and accounts
+    overwrite_truffle_config({network: (suggest_fees(network, fee_policies[network], rpc_urls[network]), rpc_urls[network]) for network in network_choices}, mint_accounts)
+
+    # Check for existing contracts and deploy contracts as necessary
+    deploy_networks = []
+    for network in network_choices:
+        existing_contract_address = check_for_existing_contract(contract_name, get_network_id(network))
+        if existing_contract_address and confirm(f"\nAn existing contract was found at {existing_contract_address} on \"{network}\". Would you like to use it? (y/n): ", 'use_existing_contract'):
+            print(f"\nUsing existing contract on \"{network}\".")
         else:
-            deploy_new_contract = False
-    else:
-        deploy_new_contract = True
+            deploy_networks.append(network)
 
-    if deploy_new_contract:
+    if deploy_networks:
         # Contract creation and deployment
-        if input(f"\nDeploy new contract? (y/n): ").strip().lower() != 'y':
+        if not confirm(f"\nDeploy new contract? (y/n): ", 'deploy'):
             sys.exit("Transaction cancelled by user.")
         print("\nGenerating contracts...\n")
-        create_contract_token(token_name, token_symbol, contract_name, creator_earnings)
-        create_contract_migrations()
-        create_script_initial_migrations()
-        create_script_deploy_contracts(contract_name)
-        overwrite_truffle_config(network_choice, gas_price)
+        constructor_args = generate_token_contract(contract_name, token_name, token_symbol, creator_earnings, to_address, token_data, mint_mode, metadata_storage, base_uri)
         print("\nTruffle scripts and Solidity contracts generated.\n")
-        print("Deploying contracts in 10 seconds...\nWarning: This will be expensive. Press ctrl+c to exit. \n")
-        time.sleep(10)
-        deploy_contracts(network_choice)
-    else:
-        print("\nUsing existing contract.")
+        deploy_delay = DEPLOY_DELAY if PROMPT_POLICY is None else PROMPT_POLICY.get('deploy_delay', 0)
+        print(f"Deploying contracts in {deploy_delay} seconds...\nWarning: This will be expensive. Press ctrl+c to exit. \n")
+        time.sleep(deploy_delay)
+
+        def deploy(network):
+            with PROFILER.span('deploy', network=network):
+                if engines:
+                    deploy_with_python_engine(engines[network], contract_name, constructor_args)
+                elif sidecar:
+                    deploy_with_sidecar(sidecar, network, contract_name, constructor_args, fee_policies[network], rpc_urls[network])
+                else:
+                    deploy_contracts(network)
+
+        run_on_networks(deploy, deploy_networks)
+
+    mint_networks = network_choices
+    if mint_mode == 'consecutive' and metadata_storage == 'manifest':
+        # Only contracts deployed by an earlier run still need their base URI brought up to date
+        mint_networks = [network for network in network_choices if network not in deploy_networks]
+        if deploy_networks:
+            print("\nAll tokens were minted at deployment and resolve through the metadata manifest.")
+        if not mint_networks:
+            return
+
+    if mint_mode == 'lazy':
+        # Nothing is minted now: each token is minted when its voucher is redeemed
+        for network in network_choices:
+            contract_address = check_for_existing_contract(contract_name, get_network_id(network))
+            if not contract_address:
+                sys.exit(1)
+            create_vouchers(network, contract_address, token_name, token_data, int(voucher_min_price), metadata_storage, voucher_sign_workers)
+        return
+
+    # Skip tokens the journal shows as confirmed on each network's contract; tokens that were sent
+    # but never confirmed are checked against ownerOf by the mint script before being sent again
+    mint_targets = {}
+    for network in mint_networks:
+        contract_address = check_for_existing_contract(contract_name, get_network_id(network))
+        # Confirmation depth, reorgs and dropped transactions are tracked alongside sending
+        watcher = start_receipt_watcher(network, contract_address, mint_confirmations, rpc_urls[network]) if mint_confirmations else None
+        journal = load_journal(network, contract_address)
+        remaining_ids = {data['tokenId'] for data in token_data if journal.get(data['tokenId'], {}).get('state') not in MINTED_JOURNAL_STATES}
+        if not remaining_ids:
+            print(f"\nAll tokens are already minted on \"{network}\" according to the journal.")
+            if watcher:
+                watcher.finish()
+            continue
+        if len(remaining_ids) < len(token_data):
+            print(f"\nResuming on \"{network}\": {len(token_data) - len(remaining_ids)} token(s) already minted, {len(remaining_ids)} remaining.")
+        mint_targets[network] = {
+            "remainingIds": remaining_ids,
+            "reconcileIds": [token_id for token_id, entry in journal.items() if entry['state'] in MINT_JOURNAL_STATES and entry['state'] not in MINTED_JOURNAL_STATES],
+            "watcher": watcher,
+        }
+    if not mint_targets:
+        return
+    remaining_token_data = [data for data in token_data if any(data['tokenId'] in target['remainingIds'] for target in mint_targets.values())]
+
+    def mint_tokens(group):
+        # Every network mints its share of the group at the same time
+        def mint_on_network(network):
+            target = mint_targets[network]
+            network_group = [data for data in group if data['tokenId'] in target['remainingIds']]
+            if not network_group:
+                return
+            group_ids = {data['tokenId'] for data in network_group}
+            group_reconcile_ids = [token_id for token_id in target['reconcileIds'] if token_id in group_ids]
+            if len(mint_targets) > 1:
+                print(f"\nMinting {len(network_group)} token(s) on \"{network}\"...")
+            with PROFILER.span('mint', tokens=len(network_group), network=network):
+                if engines:
+                    mint_with_python_engine(engines[network], network, contract_name, to_address, network_group, mint_mode, batch_gas_limit, pipeline_window, metadata_storage, base_uri, group_reconcile_ids, mint_accounts)
+                elif sidecar:
+                    mint_with_sidecar(sidecar, network, contract_name, to_address, network_group, mint_mode, batch_gas_limit, pipeline_window, fee_policies[network], metadata_storage, base_uri, group_reconcile_ids, rpc_urls[network], mint_accounts)
+                else:
+                    create_script_mint(contract_name, to_address, network_group, mint_mode, batch_gas_limit, pipeline_window, fee_policies[network], metadata_storage, base_uri, network, group_reconcile_ids, mint_accounts)
+                    mint_nft(network)
+
+        run_on_networks(mint_on_network, list(mint_targets))
 
     # Minting NFTs
     print("\nMinting NFT(s)...\n")
-    create_script_mint(contract_name, to_address, token_data)
-    mint_nft(network_choice)
+    if overlapped:
+        remaining_ids = {data['tokenId'] for data in remaining_token_data}
+        started = time.perf_counter()
+        run_overlapped_pipeline([entry for entry in files_to_process if entry.token_id in remaining_ids], images_directory, upload_files, mint_tokens)
+        print(f"Upload and mint pipeline finished in {time.perf_counter() - started:.1f}s.")
+    else:
+        mint_tokens(remaining_token_data)
+    for target in mint_targets.values():
+        if target['watcher']:
+            target['watcher'].finish()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file